@@ -0,0 +1,114 @@
+import os
+
+'''--------------------------------------------------------------
+Core mask / thread count / xnnpack sweep for tflite models on a phone.
+
+The cpu clusters are read from cpufreq (cores sharing related_cpus, ordered by cpuinfo_max_freq).
+Candidate configurations are every cluster with 1..n threads, the single fastest core, and the
+two fastest clusters together with more threads than the fastest cluster has. Every candidate
+is probed with a few runs, candidates slower than prune_ratio x the best probe are dropped and
+the rest are benchmarked fully, with energy per inference when a power sampler is given.
+--------------------------------------------------------------'''
+
+READ_TOPOLOGY_CMD = ("'for c in /sys/devices/system/cpu/cpu[0-9]*; do echo ${c##*cpu} $(cat $c/cpufreq/cpuinfo_max_freq 2>/dev/null) "
+                     "$(cat $c/cpufreq/related_cpus 2>/dev/null); done'")
+
+
+def parse_cpu_topology(text):
+    clusters = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 2 or not fields[0].isdigit() or not fields[1].isdigit():
+            continue
+        cpu, max_freq = int(fields[0]), int(fields[1])
+        related = tuple(sorted(int(x) for x in fields[2:])) or (cpu, )
+        clusters.setdefault(related, dict(cpus=list(related), max_freq=0))
+        clusters[related]['max_freq'] = max(clusters[related]['max_freq'], max_freq)
+    # fastest cluster first
+    return sorted(clusters.values(), key=lambda x: -x['max_freq'])
+
+
+def read_cpu_topology(adb):
+    return parse_cpu_topology(adb.run_cmd(READ_TOPOLOGY_CMD, no_root=True))
+
+
+def cpus_to_mask(cpus):
+    return format(sum(1 << i for i in cpus), 'x')
+
+
+def generate_configs(clusters, max_threads=4, use_xnnpack=(False, True)):
+    candidates = []
+    for cluster in clusters:
+        for num_threads in range(1, min(len(cluster['cpus']), max_threads) + 1):
+            candidates.append((cluster['cpus'], num_threads))
+    if len(clusters[0]['cpus']) > 1:
+        # prime core, e.g. cpu7 of a 4+3+1 soc whose related_cpus groups it with the mid cores
+        candidates.append((clusters[0]['cpus'][-1:], 1))
+    if len(clusters) > 1:
+        union = sorted(clusters[0]['cpus'] + clusters[1]['cpus'])
+        for num_threads in range(len(clusters[0]['cpus']) + 1, min(len(union), max_threads) + 1):
+            candidates.append((union, num_threads))
+
+    configs = []
+    for cpus, num_threads in candidates:
+        for xnnpack in use_xnnpack:
+            config = dict(taskset_mask=cpus_to_mask(cpus), num_threads=num_threads, use_xnnpack=xnnpack)
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+
+def sweep_configs(model_path, adb, configs, probe_runs=5, num_runs=50, warmup_runs=10, prune_ratio=1.2, thermal_guard=None,
+                  power_sampler=None, power_log_dir='logs/config_sweep', **run_kwargs):
+    '''
+    returns the results of all configs sorted by latency, pruned configs only have probe_ms.
+    '''
+    from benchmark.run_on_device import run_on_android
+    from benchmark.power import compute_energy, get_timed_window
+
+    # push once, every config runs the same file
+    adb.push_files(model_path, '/sdcard/')
+    results = []
+    try:
+        for config in configs:
+            _, probe_ms, _ = run_on_android(model_path, adb, num_runs=probe_runs, warmup_runs=2, skip_push=True, thermal_guard=thermal_guard,
+                                            **config, **run_kwargs)
+            results.append(dict(config, probe_ms=probe_ms, avg_ms=None, std_ms=None, mj_per_inference=None))
+            print(f'probe {config}: {probe_ms:.2f} ms')
+
+        best_probe = min(x['probe_ms'] for x in results)
+        survivors = [x for x in results if x['probe_ms'] <= best_probe * prune_ratio]
+        print(f'{len(survivors)} / {len(results)} configs within {prune_ratio}x of the best probe {best_probe:.2f} ms.')
+
+        for result in survivors:
+            config = {k: result[k] for k in ['taskset_mask', 'num_threads', 'use_xnnpack']}
+            if power_sampler:
+                power_sampler.start()
+            try:
+                std_ms, avg_ms, _ = run_on_android(model_path, adb, num_runs=num_runs, warmup_runs=warmup_runs, skip_push=True,
+                                                   thermal_guard=thermal_guard, power_sampler=power_sampler, **config, **run_kwargs)
+            finally:
+                name = os.path.basename(model_path).replace('.tflite', '')
+                log_path = os.path.join(power_log_dir, f'{name}_{config["taskset_mask"]}_{config["num_threads"]}_{config["use_xnnpack"]}_power.csv')
+                samples = power_sampler.stop(log_path) if power_sampler else None
+            result.update(avg_ms=avg_ms, std_ms=std_ms)
+            if samples:
+                begin, end = power_sampler.last_window
+                energy = compute_energy(samples, *get_timed_window(begin, end, num_runs, avg_ms), num_runs, busy_window=(begin, end))
+                result['mj_per_inference'] = energy['mj_per_inference']
+            print(f'{config}: {avg_ms:.2f} ms, {result["mj_per_inference"] or "-"} mJ/inference')
+    finally:
+        adb.run_cmd(f'rm -f /sdcard/{os.path.basename(model_path)}', no_root=run_kwargs.get('no_root', False))
+    return sorted(results, key=lambda x: (x['avg_ms'] is None, x['avg_ms'] or x['probe_ms']))
+
+
+def print_config_results(model_path, results):
+    print(f'===== {os.path.basename(model_path)} =====')
+    print(f'{"mask":>6} {"threads":>8} {"xnnpack":>8} {"probe_ms":>10} {"avg_ms":>10} {"std_ms":>8} {"mJ/inf":>8}')
+    for x in results:
+        fmt = lambda v, p=2: '-' if v is None else f'{v:.{p}f}'
+        print(f'{x["taskset_mask"]:>6} {x["num_threads"]:>8} {str(x["use_xnnpack"]):>8} {fmt(x["probe_ms"]):>10} {fmt(x["avg_ms"]):>10} '
+              f'{fmt(x["std_ms"]):>8} {fmt(x["mj_per_inference"]):>8}')
+    best = results[0]
+    print(f'Best: taskset_mask={best["taskset_mask"]} num_threads={best["num_threads"]} use_xnnpack={best["use_xnnpack"]} '
+          f'avg {best["avg_ms"]:.2f} ms')
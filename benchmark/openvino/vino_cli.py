@@ -46,6 +46,8 @@ def model_optimize_cli():
     parser.add_argument('--batch_size', '-b', default=None, type=int, help='input tensor batch size')
     parser.add_argument('--input_shape', default=None, type=str, help='input tensor shape')
     parser.add_argument('--data_type', default='FP32', type=str, help='data type for quantization')
+    parser.add_argument('--num_workers', default=1, type=int, help='number of parallel mo processes')
+    parser.add_argument('--incremental', action='store_true', help='skip models whose input and settings are unchanged since the last conversion')
     args = parser.parse_args()
     path_dict = process_root_args(args)
 
@@ -66,14 +68,26 @@ def model_optimize_cli():
         for name in sorted(os.listdir(input_path)):
             input_list.append(os.path.join(input_path, name))
 
+    if args.num_workers > 1 or args.incremental:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+        from convert_farm import run_convert_farm
+        settings = dict(mo_path=mo_path, batch_size=batch_size, input_shape=input_shape, data_type=data_type)
+        jobs = [dict(kind='mo', src=model_path, dst=os.path.join(output_dir, os.path.splitext(os.path.basename(model_path))[0] + '.xml'),
+                     settings=settings) for model_path in input_list]
+        run_convert_farm(jobs, output_dir, args.num_workers, args.incremental)
+        return
+
     for model_path in input_list:
         model_optimize(mo_path, model_path, output_dir, batch_size, input_shape=input_shape, data_type=data_type)
 
 
-def openvino_benchmark(benchmark_app_path, model_path, niter=10, num_threads=1, batch_size=1, device='CPU', layername_pattern=r'Total', layertype_pattern=None, csv_output_dir=None, show_detail=True):
+def openvino_benchmark(benchmark_app_path, model_path, niter=10, num_threads=1, batch_size=1, device='CPU', layername_pattern=r'Total', layertype_pattern=None, csv_output_dir=None, show_detail=True, shape=None):
     # setup_envs_path = os.path.join(openvino_root_path, 'bin')
     # source_cmd = f'"{os.path.join(setup_envs_path, os.listdir(setup_envs_path)[0])}"'
     benchmark_cmd = f'python "{benchmark_app_path}" -m "{model_path}" -niter={niter} -nthreads={num_threads} -b={batch_size} -d {device} -nireq=1 -api=sync --report_type=detailed_counters'
+    if shape:
+        # set the dynamic dims of the model
+        benchmark_cmd += f' -shape "[{",".join(str(x) for x in shape)}]"'
     # cmd = source_cmd + ' && ' + benchmark_cmd
     print(benchmark_cmd)
     subprocess.run(benchmark_cmd, shell=True)
@@ -108,11 +122,13 @@ def openvino_benchmark_cli():
     parser.add_argument('--num_threads', default=1, type=int, help='num of threads')
     parser.add_argument('--batch_size', '-b', default=1, type=int, help='num of threads')
     parser.add_argument('--device', '-d', default='CPU', type=str, help='device list to benchmark on')
+    parser.add_argument('--api', default='sync', choices=['sync', 'async'], help='sync latency or async throughput mode')
+    parser.add_argument('--num_requests', '-nireq', default=1, type=int, help='num of infer requests in flight in async mode')
+    parser.add_argument('--num_streams', '-nstreams', default=1, type=int, help='num of cpu streams in async mode')
+    parser.add_argument('--benchmark_app', action='store_true', help='run benchmark_app.py in a subprocess instead of the in-process runtime')
     args = parser.parse_args()
-    
-    path_dict = process_root_args(args)
-    benchmark_app_path = path_dict['benchmark_app_path']
-    openvino_root_path = path_dict['openvino_root_path']
+
+    benchmark_app_path = process_root_args(args)['benchmark_app_path'] if args.benchmark_app else None
     num_runs = args.num_runs
     num_threads = args.num_threads
     batch_size = args.batch_size
@@ -133,8 +149,17 @@ def openvino_benchmark_cli():
     print('')
     latency_list = []
     latency_dict = {}
+    throughput_dict = {}
     for model_path in model_list:
-        latency = openvino_benchmark(openvino_root_path, benchmark_app_path, model_path, niter=num_runs, num_threads=num_threads, batch_size=batch_size, device=device)
+        if args.benchmark_app:
+            latency = openvino_benchmark(benchmark_app_path, model_path, niter=num_runs, num_threads=num_threads, batch_size=batch_size, device=device)
+        else:
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+            from benchmark.openvino.vino_runtime import openvino_runtime_benchmark
+            result = openvino_runtime_benchmark(model_path, niter=num_runs, num_threads=num_threads, batch_size=batch_size, device=device,
+                                                api=args.api, num_requests=args.num_requests, num_streams=args.num_streams)
+            latency = result['latency_ms']
+            throughput_dict[os.path.basename(model_path)] = round(result['throughput_fps'], 2)
         latency_list.append(latency)
         latency_dict[os.path.basename(model_path)] = latency
 
@@ -143,6 +168,9 @@ def openvino_benchmark_cli():
     print('[ SUMMARY ]')
     print(latency_dict)
     print(latency_list)
+    if throughput_dict:
+        print(f'Throughput (FPS, api={args.api}, nireq={args.num_requests}, nstreams={args.num_streams}):')
+        print(throughput_dict)
 
 
 if __name__ == '__main__':
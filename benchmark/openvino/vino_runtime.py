@@ -0,0 +1,164 @@
+import os
+import re
+import csv
+import time
+import functools
+
+'''--------------------------------------------------------------
+In-process OpenVINO benchmark on the Inference Engine python API (CPU only).
+
+Every IR is read and loaded once per (threads, streams, requests, shape) and kept in a small cache,
+input blobs are filled once, and only infer() / async_infer() is timed. The sync mode measures the
+latency of one request, the async mode keeps num_requests requests in flight over num_streams CPU
+streams and measures the throughput. Per-layer counters are read from the requests (PERF_COUNT)
+and written in the layout of benchmark_app's detailed_counters report, so layername_pattern and
+layertype_pattern select the same rows as vino_cli.openvino_benchmark without touching the cwd.
+--------------------------------------------------------------'''
+
+COUNTER_FIELDS = ['layerName', 'execStatus', 'layerType', 'execType', 'realTime (ms)', 'cpuTime (ms)']
+
+
+@functools.lru_cache(maxsize=1)
+def _get_core():
+    from openvino.inference_engine import IECore
+    return IECore()
+
+
+@functools.lru_cache(maxsize=8)
+def _load_network(model_path, mtime, num_threads, num_streams, num_requests, batch_size, shape):
+    ie = _get_core()
+    net = ie.read_network(model=model_path, weights=os.path.splitext(model_path)[0] + '.bin')
+    if shape:
+        net.reshape({next(iter(net.input_info)): list(shape)})
+    elif batch_size != 1:
+        net.batch_size = batch_size
+    config = {'CPU_THREADS_NUM': str(num_threads), 'CPU_THROUGHPUT_STREAMS': str(num_streams), 'PERF_COUNT': 'YES'}
+    exec_net = ie.load_network(network=net, device_name='CPU', config=config, num_requests=num_requests)
+    # inputs are set once per request, the timed loops only run inference
+    for request in exec_net.requests:
+        for name, blob in request.input_blobs.items():
+            blob.buffer[:] = _random_input(blob.buffer.shape, blob.buffer.dtype)
+    return exec_net
+
+
+def load_network(model_path, num_threads=1, num_streams=1, num_requests=1, batch_size=1, shape=None):
+    '''
+    returns the cached ExecutableNetwork, the IR is reloaded only when its file changed.
+    '''
+    model_path = os.path.abspath(model_path)
+    shape = tuple(shape) if shape else None
+    return _load_network(model_path, os.path.getmtime(model_path), num_threads, num_streams, num_requests, batch_size, shape)
+
+
+def _random_input(shape, dtype):
+    import numpy as np
+    if np.issubdtype(dtype, np.integer):
+        return np.random.randint(0, 100, size=shape).astype(dtype)
+    return np.random.rand(*shape).astype(dtype)
+
+
+def get_layer_counters(requests):
+    '''
+    per-layer counters of the last inference of every request averaged over the requests, with a Total row
+    like benchmark_app. Times are in ms.
+    '''
+    rows = {}
+    for request in requests:
+        for name, counter in request.get_perf_counts().items():
+            row = rows.setdefault(name, dict(layerName=name, execStatus=counter['status'], layerType=counter['layer_type'],
+                                             execType=counter['exec_type'], realTime=0., cpuTime=0., index=counter.get('execution_index', 0)))
+            row['realTime'] += counter['real_time'] / 1000 / len(requests)
+            row['cpuTime'] += counter['cpu_time'] / 1000 / len(requests)
+    rows = sorted(rows.values(), key=lambda x: x['index'])
+    rows.append(dict(layerName='Total', execStatus='', layerType='', execType='', realTime=sum(x['realTime'] for x in rows),
+                     cpuTime=sum(x['cpuTime'] for x in rows), index=None))
+    return rows
+
+
+def aggregate_counters(rows, layername_pattern=r'Total', layertype_pattern=None):
+    latency = 0.0
+    for row in rows:
+        if re.fullmatch(layername_pattern, row['layerName']) and (layertype_pattern is None or re.fullmatch(layertype_pattern, row['layerType'])):
+            latency += row['realTime']
+    return latency
+
+
+def write_counters_csv(rows, output_path):
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(COUNTER_FIELDS)
+        for row in rows:
+            writer.writerow([row['layerName'], row['execStatus'], row['layerType'], row['execType'], f'{row["realTime"]:.3f}', f'{row["cpuTime"]:.3f}'])
+
+
+def benchmark_sync(exec_net, niter=10, warmup_runs=1):
+    request = exec_net.requests[0]
+    for _ in range(warmup_runs):
+        request.infer()
+    latency_list = []
+    for _ in range(niter):
+        start_time = time.perf_counter()
+        request.infer()
+        latency_list.append((time.perf_counter() - start_time) * 1000)
+    return latency_list
+
+
+def benchmark_async(exec_net, niter=10, warmup_runs=1):
+    '''
+    round robin over the requests so that all of them are in flight, returns (latency_list, elapsed_s).
+    '''
+    requests = exec_net.requests
+    for request in requests:
+        for _ in range(warmup_runs):
+            request.infer()
+    latency_list = []
+    start_time = time.perf_counter()
+    for i in range(max(niter, len(requests))):
+        request = requests[i % len(requests)]
+        if i >= len(requests):
+            request.wait(-1)
+            latency_list.append(request.latency)
+        request.async_infer()
+    for request in requests:
+        request.wait(-1)
+        latency_list.append(request.latency)
+    return latency_list, time.perf_counter() - start_time
+
+
+def openvino_runtime_benchmark(model_path, niter=10, num_threads=1, batch_size=1, device='CPU', api='sync', num_requests=1, num_streams=1,
+                               warmup_runs=1, layername_pattern=r'Total', layertype_pattern=None, csv_output_dir=None, show_detail=True, shape=None):
+    '''
+    returns dict(latency_ms, avg_ms, std_ms, throughput_fps). latency_ms is the sum of the counters selected by
+    layername_pattern / layertype_pattern, the value returned by vino_cli.openvino_benchmark.
+    '''
+    import numpy as np
+
+    if device != 'CPU':
+        raise ValueError(f'Only the CPU device is supported, got {device}.')
+    if api not in ['sync', 'async']:
+        raise ValueError(f'Unknown api {api}, must be sync or async.')
+    if api == 'sync':
+        num_requests, num_streams = 1, 1
+
+    exec_net = load_network(model_path, num_threads=num_threads, num_streams=num_streams, num_requests=num_requests, batch_size=batch_size,
+                            shape=shape)
+    if api == 'sync':
+        latency_list = benchmark_sync(exec_net, niter, warmup_runs)
+        elapsed = sum(latency_list) / 1000
+    else:
+        latency_list, elapsed = benchmark_async(exec_net, niter, warmup_runs)
+
+    rows = get_layer_counters(exec_net.requests)
+    if show_detail:
+        for row in rows:
+            print(f'{row["layerName"]:<40} {row["execStatus"]:<12} {row["layerType"]:<20} {row["execType"]:<24} {row["realTime"]:>8.3f} {row["cpuTime"]:>8.3f}')
+    if csv_output_dir:
+        os.makedirs(csv_output_dir, exist_ok=True)
+        write_counters_csv(rows, os.path.join(csv_output_dir, 'benchmark_detailed_counters_report.csv'))
+
+    return dict(
+        latency_ms=aggregate_counters(rows, layername_pattern, layertype_pattern),
+        avg_ms=float(np.average(latency_list)),
+        std_ms=float(np.std(latency_list)),
+        throughput_fps=len(latency_list) * batch_size / elapsed,
+    )
@@ -0,0 +1,162 @@
+import os
+import re
+import time
+import tempfile
+
+'''--------------------------------------------------------------
+On-device power sampling for energy per inference.
+
+One shell loop runs on the phone and appends timestamped power_supply readings to a file at a
+fixed interval, so no host process is spawned per sample. The benchmark command is wrapped with
+timestamps from the same device clock, which aligns samples to the run window; energy per
+inference is the integral of power over the timed runs divided by the number of runs.
+
+The adb object only needs push_files(src, dst), pull_files(src, dst) and run_cmd(cmd, no_root)
+like benchmark.ADBConnect, so the sampler can be driven by a fake adb that runs the script locally.
+--------------------------------------------------------------'''
+
+POWER_NODES = {
+    'battery_current': '/sys/class/power_supply/battery/current_now',  # uA
+    'battery_voltage': '/sys/class/power_supply/battery/voltage_now',  # uV
+    'usb_current': '/sys/class/power_supply/usb/input_current_now',
+    'usb_voltage': '/sys/class/power_supply/usb/voltage_now',
+}
+
+# reads use the shell builtin `read` and $EPOCHREALTIME (mksh), only `sleep` forks per sample
+SAMPLER_SCRIPT = '''#!/system/bin/sh
+# usage: power_sampler.sh <interval_s> <output_file> <stop_file> <name=sysfs_node>...
+interval=$1; output=$2; stop=$3; shift 3
+rm -f $stop
+header=timestamp
+for pair in "$@"; do header="$header,${pair%%=*}"; done
+echo $header > $output
+while [ ! -e $stop ]; do
+    line=$EPOCHREALTIME
+    for pair in "$@"; do
+        read value < ${pair#*=}
+        line="$line,$value"
+    done
+    echo $line >> $output
+    sleep $interval
+done
+rm -f $stop
+'''
+
+BEGIN_MARKER = 'POWER_WINDOW_BEGIN'
+END_MARKER = 'POWER_WINDOW_END'
+
+
+class PowerSampler:
+    def __init__(self, adb, interval=0.01, nodes=None, device_dir='/data/local/tmp'):
+        self.adb = adb
+        self.interval = interval
+        self.nodes = nodes or POWER_NODES
+        self.script_path = f'{device_dir}/power_sampler.sh'
+        self.output_path = f'{device_dir}/power_samples.csv'
+        self.stop_path = f'{device_dir}/power_sampler.stop'
+        self.running = False
+        self.last_window = None
+
+    def start(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) as f:
+            f.write(SAMPLER_SCRIPT)
+        try:
+            self.adb.push_files(f.name, self.script_path)
+        finally:
+            os.remove(f.name)
+        node_args = ' '.join(f'{name}={path}' for name, path in self.nodes.items())
+        # detach from the adb session, the loop keeps running until the stop file appears
+        self.adb.run_cmd(f'"nohup sh {self.script_path} {self.interval} {self.output_path} {self.stop_path} {node_args} > /dev/null 2>&1 &"',
+                         no_root=True)
+        self.running = True
+
+    def stop(self, local_path):
+        self.adb.run_cmd(f'"touch {self.stop_path}"', no_root=True)
+        # the loop removes the stop file when it exits
+        for _ in range(100):
+            time.sleep(max(self.interval, 0.05))
+            if self.adb.run_cmd(f'"ls {self.stop_path} 2>/dev/null || true"', no_root=True).strip() == '':
+                break
+        self.running = False
+        if os.path.dirname(local_path) != '' and not os.path.exists(os.path.dirname(local_path)):
+            os.makedirs(os.path.dirname(local_path))
+        self.adb.pull_files(self.output_path, local_path)
+        self.adb.run_cmd(f'"rm -f {self.output_path}"', no_root=True)
+        return load_power_samples(local_path)
+
+    def run_marked(self, cmd, no_root=True):
+        '''
+        run cmd on the device between two timestamps of the device clock, returns (output, begin, end).
+        '''
+        if not no_root:
+            cmd = f"su -c '{cmd}'"
+        output = self.adb.run_cmd(f'"echo {BEGIN_MARKER} \\$EPOCHREALTIME; {cmd}; echo {END_MARKER} \\$EPOCHREALTIME"', no_root=True)
+        begin = float(re.search(rf'{BEGIN_MARKER} ([0-9.]+)', output).group(1))
+        end = float(re.search(rf'{END_MARKER} ([0-9.]+)', output).group(1))
+        self.last_window = (begin, end)
+        return output, begin, end
+
+
+def load_power_samples(file_path):
+    samples = []
+    with open(file_path) as f:
+        names = f.readline().strip().split(',')
+        for line in f:
+            values = line.strip().split(',')
+            # skip a line cut by the stop signal
+            if len(values) != len(names) or '' in values:
+                continue
+            samples.append({name: float(value) for name, value in zip(names, values)})
+    return samples
+
+
+def get_power_mw(sample, source='battery'):
+    # current in uA and voltage in uV, some devices report a negative discharging current
+    if source == 'both':
+        return get_power_mw(sample, 'battery') + get_power_mw(sample, 'usb')
+    return abs(sample[f'{source}_current']) * sample[f'{source}_voltage'] / 1e9
+
+
+def _integrate(points):
+    return sum((t1 - t0) * (p0 + p1) / 2 for (t0, p0), (t1, p1) in zip(points[:-1], points[1:]))
+
+
+def _interpolate(points, t):
+    for (t0, p0), (t1, p1) in zip(points[:-1], points[1:]):
+        if t0 <= t <= t1:
+            return p0 if t1 == t0 else p0 + (p1 - p0) * (t - t0) / (t1 - t0)
+    return points[0][1] if t < points[0][0] else points[-1][1]
+
+
+def compute_energy(samples, begin, end, num_inferences, source='battery', busy_window=None):
+    '''
+    integrate power over [begin, end] (device clock seconds). Samples outside busy_window (default
+    [begin, end], pass the whole command window to exclude init and warmup) give the idle power,
+    which is subtracted for the net energy per inference.
+    '''
+    points = sorted((s['timestamp'], get_power_mw(s, source)) for s in samples)
+    inside = [(t, p) for t, p in points if begin < t < end]
+    if len(points) < 2 or points[0][0] > begin or points[-1][0] < end:
+        raise ValueError(f'Power samples [{points[0][0] if points else None}, {points[-1][0] if points else None}] do not cover the run window [{begin}, {end}].')
+    window = [(begin, _interpolate(points, begin))] + inside + [(end, _interpolate(points, end))]
+    energy_mj = _integrate(window)
+    busy_begin, busy_end = busy_window or (begin, end)
+    outside = [p for t, p in points if t < busy_begin or t > busy_end]
+    idle_power_mw = sum(outside) / len(outside) if outside else 0.
+    avg_power_mw = energy_mj / (end - begin)
+    return dict(
+        window_s=end - begin,
+        num_samples=len(inside),
+        avg_power_mw=avg_power_mw,
+        idle_power_mw=idle_power_mw,
+        energy_mj=energy_mj,
+        mj_per_inference=energy_mj / num_inferences,
+        net_mj_per_inference=(avg_power_mw - idle_power_mw) * (end - begin) / num_inferences,
+    )
+
+
+def get_timed_window(begin, end, num_runs, avg_ms):
+    '''
+    benchmark_model runs init and warmup before the timed runs, which are the last num_runs * avg_ms of the command.
+    '''
+    return max(begin, end - num_runs * avg_ms / 1000), end
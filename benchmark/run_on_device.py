@@ -3,7 +3,7 @@ import os
 
 def run_on_android(modelpath, adb, use_gpu=False, num_threads=1, num_runs=10, warmup_runs=10, skip_push=False, 
                    taskset_mask='70', benchmark_binary_dir='/data/local/tmp', bin_name='benchmark_model_plus_flex_r27', no_root=False, use_xnnpack=False, 
-                   profiling_output_csv_file=None):
+                   profiling_output_csv_file=None, input_layer=None, input_layer_shape=None, thermal_guard=None, power_sampler=None):
     if not skip_push:
         #=======Push to device===========
         adb.push_files(modelpath, '/sdcard/')
@@ -15,9 +15,16 @@ def run_on_android(modelpath, adb, use_gpu=False, num_threads=1, num_runs=10, wa
     command = f'taskset {taskset_mask} {benchmark_binary_path} --num_threads={num_threads} {"--use_gpu=true" if use_gpu else ""} '
     command += f'--num_runs={num_runs} --warmup_runs={warmup_runs} {"--use_xnnpack=true" if use_xnnpack else "--use_xnnpack=false"} --graph=/sdcard/{model_name} '
     command += f'--enable_op_profiling=true --profiling_output_csv_file=/sdcard/{os.path.basename(profiling_output_csv_file)} ' if profiling_output_csv_file else ''
+    command += f'--input_layer={input_layer} --input_layer_shape={",".join(str(x) for x in input_layer_shape)} ' if input_layer_shape else ''
     print(command)
 
-    bench_str = adb.run_cmd(command, no_root=no_root)
+    # a running power sampler times the command on the device clock, the window is kept in power_sampler.last_window
+    run = (lambda: power_sampler.run_marked(command, no_root=no_root)[0]) if power_sampler else (lambda: adb.run_cmd(command, no_root=no_root))
+    if thermal_guard:
+        # adaptive cool-down before the run, repeated when throttled, the record is kept in thermal_guard.last_record
+        bench_str, _ = thermal_guard.run(run)
+    else:
+        bench_str = run()
     std_ms, avg_ms, mem_mb = fetech_tf_bench_results(bench_str)
 
     if not skip_push:
@@ -0,0 +1,147 @@
+import os
+import subprocess
+
+'''--------------------------------------------------------------
+Host-side tflite benchmark, the local counterpart of run_on_device.run_on_android.
+
+The model is loaded once in process with tf.lite.Interpreter (or tflite_runtime when tensorflow is
+not installed), inputs are allocated once and only invoke() is timed. Results are returned as
+(std_ms, avg_ms, mem_mb) like run_on_android. The python interpreter has no op profiler, so the
+op-wise profiling csv is produced by the host build of benchmark_model, which writes the same
+layout as the device binary and can be read by analyse.py unchanged.
+--------------------------------------------------------------'''
+
+
+def parse_taskset_mask(taskset_mask):
+    mask = int(taskset_mask, 16)
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
+
+
+def get_interpreter_class():
+    # tensorflow links the flex delegate, tflite_runtime only has builtin ops
+    try:
+        import tensorflow as tf
+        return tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+    except ImportError:
+        from tflite_runtime.interpreter import Interpreter, OpResolverType
+        return Interpreter, OpResolverType
+
+
+def _current_rss_mb():
+    # ru_maxrss is the lifetime peak of the process and does not grow again for a model smaller than a previous one
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.
+
+
+def _random_input(shape, dtype):
+    import numpy as np
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.random.randint(max(info.min, -128), min(info.max, 127) + 1, size=shape).astype(dtype)
+    return np.random.rand(*shape).astype(dtype)
+
+
+def run_on_host(modelpath, use_xnnpack=True, num_threads=1, num_runs=10, warmup_runs=10, taskset_mask=None, input_shape=None,
+                profiling_output_csv_file=None, benchmark_binary='benchmark_model'):
+    import timeit
+    import numpy as np
+
+    # the pinning only lasts for this call, the caller (e.g. a whole op sweep) keeps its own affinity
+    affinity = os.sched_getaffinity(0)
+    if taskset_mask:
+        os.sched_setaffinity(0, parse_taskset_mask(taskset_mask))
+    try:
+        Interpreter, OpResolverType = get_interpreter_class()
+        mem_before = _current_rss_mb()
+        op_resolver_type = OpResolverType.AUTO if use_xnnpack else OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        interpreter = Interpreter(model_path=modelpath, num_threads=num_threads, experimental_op_resolver_type=op_resolver_type)
+        if input_shape:
+            interpreter.resize_tensor_input(interpreter.get_input_details()[0]['index'], input_shape, strict=True)
+        interpreter.allocate_tensors()
+        # inputs are set once, the timed loop only runs invoke()
+        for detail in interpreter.get_input_details():
+            interpreter.set_tensor(detail['index'], _random_input(detail['shape'], detail['dtype']))
+
+        for _ in range(warmup_runs):
+            interpreter.invoke()
+        latency_list = []
+        for _ in range(num_runs):
+            start_time = timeit.default_timer()
+            interpreter.invoke()
+            latency_list.append((timeit.default_timer() - start_time) * 1000)
+        # resident memory held by the loaded interpreter, measured while it is still alive
+        mem_mb = _current_rss_mb() - mem_before
+        std_ms, avg_ms = float(np.std(latency_list)), float(np.average(latency_list))
+        del interpreter
+    finally:
+        if taskset_mask:
+            os.sched_setaffinity(0, affinity)
+
+    if profiling_output_csv_file:
+        profile_on_host(modelpath, profiling_output_csv_file, use_xnnpack=use_xnnpack, num_threads=num_threads, num_runs=num_runs,
+                        warmup_runs=warmup_runs, taskset_mask=taskset_mask, input_shape=input_shape, benchmark_binary=benchmark_binary)
+    return std_ms, avg_ms, mem_mb
+
+
+def profile_on_host(modelpath, profiling_output_csv_file, use_xnnpack=True, num_threads=1, num_runs=10, warmup_runs=10, taskset_mask=None,
+                    input_shape=None, benchmark_binary='benchmark_model'):
+    command = f'{benchmark_binary} --graph={modelpath} --num_threads={num_threads} --num_runs={num_runs} --warmup_runs={warmup_runs} '
+    command += f'{"--use_xnnpack=true" if use_xnnpack else "--use_xnnpack=false"} '
+    command += f'--enable_op_profiling=true --profiling_output_csv_file={profiling_output_csv_file} '
+    if input_shape:
+        Interpreter, _ = get_interpreter_class()
+        input_layer = Interpreter(model_path=modelpath).get_input_details()[0]['name']
+        command += f'--input_layer={input_layer} --input_layer_shape={",".join(str(x) for x in input_shape)} '
+    if taskset_mask:
+        command = f'taskset {taskset_mask} ' + command
+    print(command)
+    subprocess.run(command, shell=True, check=True, stdout=subprocess.DEVNULL)
+    print(f'Save profiling output csv file in {profiling_output_csv_file}')
+
+
+def _init_pinned_worker(mask_queue):
+    # every worker takes one core mask for its whole life, so parallel models never share cores
+    os.sched_setaffinity(0, parse_taskset_mask(mask_queue.get()))
+
+
+def _run_pinned(modelpath, kwargs, profiling_output_dir):
+    import traceback
+    if profiling_output_dir:
+        name = os.path.splitext(os.path.basename(modelpath))[0]
+        kwargs = dict(kwargs, profiling_output_csv_file=os.path.join(profiling_output_dir, f'{name}.csv'))
+    try:
+        return modelpath, run_on_host(modelpath, **kwargs), None
+    except Exception:
+        return modelpath, None, traceback.format_exc()
+
+
+def run_on_host_parallel(model_paths, taskset_masks, profiling_output_dir=None, **kwargs):
+    '''
+    benchmark many models at once, one process per entry of taskset_masks (e.g. ['1', '2', '4', '8']),
+    each pinned to its cores. Returns {model_path: (std_ms, avg_ms, mem_mb)}.
+    '''
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing
+
+    kwargs = dict(kwargs, taskset_mask=None, profiling_output_csv_file=None)
+    if profiling_output_dir:
+        os.makedirs(profiling_output_dir, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    mask_queue = context.Queue()
+    for mask in taskset_masks:
+        mask_queue.put(mask)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=len(taskset_masks), mp_context=context, initializer=_init_pinned_worker,
+                             initargs=(mask_queue, )) as executor:
+        futures = [executor.submit(_run_pinned, modelpath, kwargs, profiling_output_dir) for modelpath in model_paths]
+        for future in as_completed(futures):
+            modelpath, result, error = future.result()
+            if error:
+                print(f'Failed to benchmark {modelpath}:\n{error}')
+                continue
+            results[modelpath] = result
+    return results
@@ -69,3 +69,34 @@ class DummyCalibrator(trt.IInt8EntropyCalibrator2):
         # with open(self.cache_file, "wb") as f:
         #     f.write(cache)
         pass
+
+
+class EntropyCalibrator(DummyCalibrator):
+    '''
+    DummyCalibrator with a persistent calibration cache, calibrate on real data from calibration.CalibrationData.
+    '''
+    def __init__(self, training_data, cache_file='calibration.cache', batch_size=8):
+        # batch_size must be the batch dim of the network input, TensorRT only reads that many images per get_batch.
+        # training_data may be a memmap, it is not loaded at once, every batch is copied in get_batch
+        super().__init__(training_data[: len(training_data) // batch_size * batch_size], batch_size=batch_size)
+        self.cache_file = cache_file
+
+    def get_batch(self, names):
+        if self.current_index + self.batch_size > self.data.shape[0]:
+            return None
+
+        batch = np.ascontiguousarray(self.data[self.current_index:self.current_index + self.batch_size], dtype=np.float32)
+        cuda.memcpy_htod(self.device_input, batch)
+        self.current_index += self.batch_size
+        return [self.device_input]
+
+    def read_calibration_cache(self):
+        # If there is a cache, use it instead of calibrating again. Otherwise, implicitly return None.
+        if os.path.exists(self.cache_file):
+            print(f'Read calibration cache {self.cache_file}.')
+            with open(self.cache_file, "rb") as f:
+                return f.read()
+
+    def write_calibration_cache(self, cache):
+        with open(self.cache_file, "wb") as f:
+            f.write(cache)
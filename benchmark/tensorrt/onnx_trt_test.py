@@ -25,7 +25,9 @@ import onnx
 import torch
 
 import common
-from calibrator import DummyCalibrator
+from calibrator import DummyCalibrator, EntropyCalibrator
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 
 
 # You can set the logger severity higher to suppress messages (or lower to display more messages).
@@ -45,7 +47,7 @@ def get_onnx_input_shape(model_path):
     return input_shape
 
 # The Onnx path is used for Onnx models.
-def build_engine_onnx(model_file, quant=None):
+def build_engine_onnx(model_file, quant=None, calibration_data=None, calibration_cache='calibration.cache'):
     builder = trt.Builder(TRT_LOGGER)
     network = builder.create_network(common.EXPLICIT_BATCH)
     config = builder.create_builder_config()
@@ -56,9 +58,14 @@ def build_engine_onnx(model_file, quant=None):
 
     if quant == 'int8' or quant == 'both':
         config.set_flag(trt.BuilderFlag.INT8)
-        input_shape = get_onnx_input_shape(model_file)
-        dummy_input = torch.rand(input_shape).numpy()
-        config.int8_calibrator = DummyCalibrator(dummy_input, batch_size=1)
+        if calibration_data is not None:
+            # the network is explicit batch with a static batch dim, each calibration batch has exactly that size
+            batch_size = get_onnx_input_shape(model_file)[0]
+            config.int8_calibrator = EntropyCalibrator(calibration_data.array, cache_file=calibration_cache, batch_size=batch_size)
+        else:
+            input_shape = get_onnx_input_shape(model_file)
+            dummy_input = torch.rand(input_shape).numpy()
+            config.int8_calibrator = DummyCalibrator(dummy_input, batch_size=1)
     if quant == 'fp16' or quant == 'both':
         config.set_flag(trt.BuilderFlag.FP16)
 
@@ -82,11 +89,20 @@ def main():
     parser.add_argument('--warmup_runs', default=20, type=int, help='number of warmup runs')
     parser.add_argument('--topk', default=None, type=int, help='take the avg of top k latency to reduce variance')
     parser.add_argument('--precision', default=3, type=int, help='the precision of latency result')
+    parser.add_argument('--calib_data_path', default=None, type=str, help='imagenet root to calibrate int8 with real train images')
+    parser.add_argument('--calib_cache', default='models/calibration/imagenet_train_calib.npy', type=str, help='calibration data cache file')
+    parser.add_argument('--num_calib_samples', default=1000, type=int, help='number of stratified calibration images')
+    parser.add_argument('--trt_calib_cache', default=None, type=str, help='TensorRT calibration cache, reused if it exists')
     args = parser.parse_args()
 
+    calibration_data = None
+    if args.calib_data_path:
+        from calibration import load_calibration_data
+        calibration_data = load_calibration_data(args.calib_data_path, args.calib_cache, args.num_calib_samples)
+    trt_calib_cache = args.trt_calib_cache or os.path.splitext(args.model)[0] + '.calib_cache'
 
     # Build a TensorRT engine.
-    engine = build_engine_onnx(args.model, quant=args.quant)
+    engine = build_engine_onnx(args.model, quant=args.quant, calibration_data=calibration_data, calibration_cache=trt_calib_cache)
     # Inference is the same regardless of which parser is used to build the engine, since the model architecture is the same.
     # Allocate buffers and create a CUDA stream.
     inputs, outputs, bindings, stream = common.allocate_buffers(engine)
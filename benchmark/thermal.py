@@ -0,0 +1,214 @@
+import json
+import os
+import re
+import threading
+import time
+
+'''--------------------------------------------------------------
+Thermal-aware scheduling of mobile benchmarks.
+
+Thermal zones and cpu/gpu frequencies are read with one adb shell call, between the runs only.
+A ThermalGuard records the idle baseline with calibrate(), which must be called on an idle device
+before any workload (or loaded from a persisted baseline file), then before every run waits until
+the temperature is back within a margin of the baseline, or below an absolute cool_temp, and the
+frequency caps (scaling_max_freq) are restored, instead of sleeping for a fixed time. A run is
+flagged as throttled and repeated when the caps of the benchmarked cores (or the gpu) are below the
+baseline right before or right after it. With sample_during, the caps alone are also read during
+the run by a single cat, to catch a drop that recovered before the end, at the cost of an adb call
+next to the measured workload every poll_interval. Every run keeps its cool-down trace, its
+pre/post thermal state and the in-run caps.
+--------------------------------------------------------------'''
+
+DEFAULT_ZONE_PATTERN = r'cpu|gpu|tsens|soc|skin'
+
+# single quotes keep the host shell from expanding the device side $(...)
+READ_STATE_CMD = ("'for z in /sys/class/thermal/thermal_zone*; do echo T $(cat $z/type 2>/dev/null) $(cat $z/temp 2>/dev/null); done; "
+                  'for c in /sys/devices/system/cpu/cpu[0-9]*; do echo F ${c##*cpu} $(cat $c/cpufreq/scaling_cur_freq 2>/dev/null) '
+                  '$(cat $c/cpufreq/scaling_max_freq 2>/dev/null) $(cat $c/cpufreq/cpuinfo_max_freq 2>/dev/null); done; '
+                  "echo G $(cat /sys/class/kgsl/kgsl-3d0/devfreq/cur_freq 2>/dev/null) $(cat /sys/class/kgsl/kgsl-3d0/devfreq/max_freq 2>/dev/null)'")
+# the caps alone, read during a run with sample_during
+CPU_MAX_FREQ_PATH = '/sys/devices/system/cpu/cpu{}/cpufreq/scaling_max_freq'
+GPU_MAX_FREQ_PATH = '/sys/class/kgsl/kgsl-3d0/devfreq/max_freq'
+
+
+def parse_thermal_state(text):
+    temps, cpus, gpu = {}, {}, None
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[0] == 'T' and re.fullmatch(r'-?\d+', fields[2]):
+            temp = float(fields[2])
+            # most zones report millidegree, a few report degree
+            temps[fields[1]] = max(temps.get(fields[1], -1e9), temp / 1000 if abs(temp) > 1000 else temp)
+        elif len(fields) == 5 and fields[0] == 'F':
+            cpus[int(fields[1])] = dict(cur=int(fields[2]), max=int(fields[3]), cpuinfo_max=int(fields[4]))
+        elif len(fields) == 3 and fields[0] == 'G':
+            gpu = dict(cur=int(fields[1]), max=int(fields[2]))
+    return dict(time=time.time(), temps=temps, cpus=cpus, gpu=gpu)
+
+
+def read_thermal_state(adb):
+    return parse_thermal_state(adb.run_cmd(READ_STATE_CMD, no_root=True))
+
+
+class ThermalGuard:
+    def __init__(self, adb, cpus=None, zone_pattern=DEFAULT_ZONE_PATTERN, temp_margin=3., cool_temp=None, baseline_path=None,
+                 sample_during=False, poll_interval=2., max_wait=300., max_retries=1):
+        '''
+        cpus: indices of the benchmarked cores (e.g. from the taskset mask), all cores when None.
+        cool_temp: absolute temperature (degree) to cool down to, instead of baseline + temp_margin.
+        baseline_path: json file of the idle baseline, read by calibrate() when it exists, written otherwise.
+        sample_during: also read the frequency caps every poll_interval while the workload runs.
+        '''
+        self.adb = adb
+        self.cpus = cpus
+        self.zone_pattern = re.compile(zone_pattern, re.IGNORECASE)
+        self.temp_margin = temp_margin
+        self.cool_temp = cool_temp
+        self.baseline_path = baseline_path
+        self.sample_during = sample_during
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.baseline = None
+        self.records = []
+        self.last_record = None
+
+    def max_temp(self, state):
+        temps = [v for k, v in state['temps'].items() if self.zone_pattern.search(k)]
+        return max(temps) if temps else None
+
+    def _caps(self, state):
+        cpus = self.cpus if self.cpus is not None else state['cpus'].keys()
+        return {i: state['cpus'][i]['max'] for i in cpus if i in state['cpus']}
+
+    def summarize(self, state):
+        return dict(time=round(state['time'], 2), max_temp=self.max_temp(state),
+                    cpu_cur={i: state['cpus'][i]['cur'] for i in self._caps(state)}, cpu_max=self._caps(state),
+                    gpu=state['gpu'])
+
+    def calibrate(self):
+        '''
+        records the idle state, the target of every cool-down. Call it on an idle device before any workload,
+        a baseline taken right after a run is already warm and makes every later cool-down pass at once.
+        '''
+        if self.baseline_path and os.path.exists(self.baseline_path):
+            with open(self.baseline_path) as f:
+                self.baseline = json.load(f)
+            # json keys are strings
+            self.baseline['cpus'] = {int(k): v for k, v in self.baseline['cpus'].items()}
+            print(f'Thermal baseline from {self.baseline_path}: {self.summarize(self.baseline)}')
+            return
+        self.baseline = read_thermal_state(self.adb)
+        print(f'Thermal baseline: {self.summarize(self.baseline)}')
+        temp = self.max_temp(self.baseline)
+        if self.cool_temp is not None and temp is not None and temp > self.cool_temp:
+            print(f'Warning: the device is at {temp} degree at calibration, above cool_temp {self.cool_temp}.')
+        if self.baseline_path:
+            if os.path.dirname(self.baseline_path) != '' and not os.path.exists(os.path.dirname(self.baseline_path)):
+                os.makedirs(os.path.dirname(self.baseline_path))
+            with open(self.baseline_path, 'w') as f:
+                json.dump(self.baseline, f, indent=2)
+            print(f'Save thermal baseline to {self.baseline_path}.')
+
+    def is_throttled(self, state):
+        base_caps = self._caps(self.baseline)
+        if any(cap < base_caps.get(i, cap) for i, cap in self._caps(state).items()):
+            return True
+        return bool(state['gpu'] and self.baseline['gpu'] and state['gpu']['max'] < self.baseline['gpu']['max'])
+
+    def read_caps(self):
+        '''
+        the scaling_max_freq of the benchmarked cores (and the gpu max_freq) only, in a single cat.
+        Returns dict(time, cpus={index: cap}, gpu_max), None when the output does not match the files.
+        '''
+        cpus = sorted(self._caps(self.baseline))
+        paths = [CPU_MAX_FREQ_PATH.format(i) for i in cpus] + ([GPU_MAX_FREQ_PATH] if self.baseline['gpu'] else [])
+        values = [int(x) for x in self.adb.run_cmd('cat ' + ' '.join(paths), no_root=True).split() if x.isdigit()]
+        if len(values) != len(paths):
+            return None
+        return dict(time=time.time(), cpus=dict(zip(cpus, values)), gpu_max=values[-1] if self.baseline['gpu'] else None)
+
+    def is_throttled_during(self, samples):
+        '''
+        samples: read_caps() results taken while the workload ran. Throttled when a cap dropped at any time,
+        also if it was restored before the end. Caps only, a gpu run leaves the cpu clocks idle.
+        '''
+        base_caps = self._caps(self.baseline)
+        for caps in samples:
+            if any(cap < base_caps.get(i, cap) for i, cap in caps['cpus'].items()):
+                return True
+            if caps['gpu_max'] is not None and caps['gpu_max'] < self.baseline['gpu']['max']:
+                return True
+        return False
+
+    def is_cool(self, state):
+        temp = self.max_temp(state)
+        if self.cool_temp is not None:
+            too_hot = temp is not None and temp > self.cool_temp
+        else:
+            base_temp = self.max_temp(self.baseline)
+            too_hot = temp is not None and base_temp is not None and temp > base_temp + self.temp_margin
+        return not too_hot and not self.is_throttled(state)
+
+    def wait_cool(self):
+        if self.baseline is None:
+            raise RuntimeError('ThermalGuard.calibrate() must be called on an idle device before the first run.')
+        start = time.time()
+        trace = []
+        while True:
+            state = read_thermal_state(self.adb)
+            trace.append(self.summarize(state))
+            if self.is_cool(state):
+                break
+            if time.time() - start > self.max_wait:
+                print(f'Warning: device did not cool down in {self.max_wait}s, last state {trace[-1]}')
+                break
+            time.sleep(self.poll_interval)
+        return time.time() - start, trace
+
+    def run(self, func):
+        '''
+        run func() after an adaptive cool-down, repeat it when the device throttled, returns (result, record).
+        '''
+        record = dict(cooldown_s=0., attempts=0, throttled=False, trace=[])
+        for attempt in range(self.max_retries + 1):
+            waited, trace = self.wait_cool()
+            pre = read_thermal_state(self.adb)
+            samples = []
+            if self.sample_during:
+                stop = threading.Event()
+                sampler = threading.Thread(target=self._sample, args=(samples, stop), daemon=True)
+                sampler.start()
+            try:
+                result = func()
+            finally:
+                if self.sample_during:
+                    stop.set()
+                    sampler.join()
+            post = read_thermal_state(self.adb)
+            # wait_cool may have given up while the caps were still down
+            throttled = self.is_throttled(pre) or self.is_throttled(post) or self.is_throttled_during(samples)
+            record['cooldown_s'] += waited
+            record['attempts'] = attempt + 1
+            record['throttled'] = throttled
+            record['trace'].append(dict(cooldown=trace, pre=self.summarize(pre), during=samples, post=self.summarize(post)))
+            if not throttled:
+                break
+            print(f'Warning: throttled during run (attempt {attempt + 1}), caps {self._caps(post)} vs baseline {self._caps(self.baseline)}.')
+        self.records.append(record)
+        self.last_record = record
+        return result, record
+
+    def _sample(self, samples, stop):
+        # runs in a thread next to the workload, the first sample is taken one interval in
+        while not stop.wait(self.poll_interval):
+            try:
+                caps = self.read_caps()
+            except Exception as e:
+                print(f'Warning: failed to read the frequency caps during the run: {e}')
+                continue
+            if caps is not None:
+                samples.append(caps)
+
+    def total_cooldown(self):
+        return sum(x['cooldown_s'] for x in self.records)
@@ -0,0 +1,125 @@
+import os
+import json
+
+'''--------------------------------------------------------------
+Real-data int8 calibration shared by tflite, onnxruntime static quantization and TensorRT.
+
+A stratified subset of ImageNet train is pushed through the standard eval transform and cached
+as a NCHW float32 .npy file. The cache is written batch by batch with its progress recorded in
+a sidecar json, so an interrupted build resumes where it stopped.
+--------------------------------------------------------------'''
+
+
+def _select_stratified_indices(samples, num_samples, seed=0):
+    import random
+    class_dict = {}
+    for idx, (_, target) in enumerate(samples):
+        class_dict.setdefault(target, []).append(idx)
+    rng = random.Random(seed)
+    for indices in class_dict.values():
+        rng.shuffle(indices)
+
+    # round robin over classes, so that every prefix of the subset is stratified as well
+    selected = []
+    depth = 0
+    while len(selected) < num_samples:
+        candidates = [indices[depth] for _, indices in sorted(class_dict.items()) if depth < len(indices)]
+        if len(candidates) == 0:
+            break
+        selected.extend(candidates[: num_samples - len(selected)])
+        depth += 1
+    return selected
+
+
+def build_calibration_cache(data_path, cache_path, num_samples=1000, input_size=224, batch_size=50, num_workers=8, seed=0):
+    import numpy as np
+    import torch
+    from torchvision import datasets
+    from utils import build_eval_transform
+
+    meta_path = cache_path + '.json'
+    settings = dict(data_path=os.path.abspath(data_path), num_samples=num_samples, input_size=input_size, seed=seed)
+    done = 0
+    if os.path.exists(meta_path) and os.path.exists(cache_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['settings'] == settings:
+            done = meta['done']
+            if done == meta['total']:
+                print(f'Calibration cache {cache_path} is complete, skip building.')
+                return
+            print(f'Resume building calibration cache {cache_path} from {done} / {meta["total"]}.')
+
+    dataset = datasets.ImageFolder(os.path.join(data_path, 'train'), transform=build_eval_transform(input_size))
+    indices = _select_stratified_indices(dataset.samples, num_samples, seed)
+    total = len(indices)
+
+    if done > 0:
+        array = np.load(cache_path, mmap_mode='r+')
+    else:
+        if os.path.dirname(cache_path) != '' and not os.path.exists(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        array = np.lib.format.open_memmap(cache_path, mode='w+', dtype=np.float32, shape=(total, 3, input_size, input_size))
+
+    # DataLoader workers decode and transform the calibration batches in parallel
+    subset = torch.utils.data.Subset(dataset, indices[done:])
+    data_loader = torch.utils.data.DataLoader(subset, batch_size=batch_size, num_workers=num_workers, shuffle=False)
+    for images, _ in data_loader:
+        array[done: done + len(images)] = images.numpy()
+        array.flush()
+        done += len(images)
+        with open(meta_path, 'w') as f:
+            json.dump(dict(settings=settings, done=done, total=total), f)
+        print(f'Calibration cache {done} / {total}')
+    print(f'Save calibration cache to {cache_path}.')
+
+
+def get_layout(input_shape):
+    return 'NHWC' if input_shape[-1] in [1, 3] else 'NCHW'
+
+
+class CalibrationData:
+    def __init__(self, cache_path):
+        import numpy as np
+        with open(cache_path + '.json') as f:
+            meta = json.load(f)
+        if meta['done'] != meta['total']:
+            raise ValueError(f'Calibration cache {cache_path} is incomplete ({meta["done"]} / {meta["total"]}), build it again to resume.')
+        self.cache_path = cache_path
+        self.array = np.load(cache_path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.array)
+
+    def batches(self, batch_size=1, layout='NCHW', num_samples=None):
+        import numpy as np
+        num_samples = len(self) if num_samples is None else min(num_samples, len(self))
+        for begin in range(0, num_samples - batch_size + 1, batch_size):
+            batch = self.array[begin: begin + batch_size]
+            if layout == 'NHWC':
+                batch = batch.transpose(0, 2, 3, 1)
+            yield np.ascontiguousarray(batch, dtype=np.float32)
+
+    def tflite_representative_dataset(self, input_shape, num_samples=None):
+        def representative_dataset():
+            for batch in self.batches(input_shape[0] or 1, get_layout(input_shape), num_samples):
+                yield [batch]
+        return representative_dataset
+
+    def onnx_data_reader(self, input_name, batch_size=1, layout='NCHW', num_samples=None):
+        from onnxruntime.quantization import CalibrationDataReader
+
+        class ImageNetDataReader(CalibrationDataReader):
+            def __init__(self, batches):
+                self.batches = batches
+
+            def get_next(self):
+                batch = next(self.batches, None)
+                return None if batch is None else {input_name: batch}
+
+        return ImageNetDataReader(self.batches(batch_size, layout, num_samples))
+
+
+def load_calibration_data(data_path, cache_path, num_samples=1000, input_size=224, num_workers=8):
+    build_calibration_cache(data_path, cache_path, num_samples=num_samples, input_size=input_size, num_workers=num_workers)
+    return CalibrationData(cache_path)
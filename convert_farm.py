@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import hashlib
+
+'''--------------------------------------------------------------
+Parallel and incremental model conversion.
+
+Conversions run in a process pool, every worker imports tensorflow once and converts many models.
+A manifest in the output directory records the input hash and the converter settings of every
+output, so a model is only converted again when its input or its settings change.
+--------------------------------------------------------------'''
+
+MANIFEST_NAME = 'convert_manifest.json'
+
+
+def hash_path(path):
+    sha = hashlib.sha1()
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for file in files:
+        sha.update(os.path.relpath(file, path).encode() if file != path else b'')
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _output_size(dst):
+    if dst.endswith('.xml'):
+        return sum(os.path.getsize(x) for x in [dst, dst[: -len('.xml')] + '.bin'] if os.path.exists(x))
+    return os.path.getsize(dst)
+
+
+def _init_worker(kinds):
+    # import once per worker instead of once per model
+    if 'tf2tflite' in kinds or 'onnx2tflite' in kinds:
+        import tensorflow
+    if 'onnx2tflite' in kinds:
+        import onnx_tf
+
+
+def _run_job(job):
+    import traceback
+    kind, src, dst, settings = job['kind'], job['src'], job['dst'], job['settings']
+    if os.path.dirname(dst) != '' and not os.path.exists(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+    start = time.time()
+    try:
+        if kind == 'tf2tflite':
+            from utils import tf2tflite
+            if settings.get('quantization') == 'int8' and settings.get('input_shape') is None:
+                import tensorflow as tf
+                settings = dict(settings, input_shape=list(tf.keras.models.load_model(src).input_shape))
+            calibration_data = None
+            if settings.get('calib_cache'):
+                from calibration import CalibrationData
+                calibration_data = CalibrationData(settings['calib_cache'])
+            tf2tflite(src, dst, quantization=settings.get('quantization', 'None'), use_flex=settings.get('use_flex', True),
+                      input_shape=settings.get('input_shape'), calibration_data=calibration_data)
+        elif kind == 'onnx2tflite':
+            import shutil
+            import tempfile
+            import onnx
+            from onnx_tf.backend import prepare
+            from utils import tf2tflite
+            tf_model_path = tempfile.mkdtemp(suffix='.tf')
+            try:
+                prepare(onnx.load(src)).export_graph(tf_model_path)
+                tf2tflite(tf_model_path, dst, quantization=settings.get('quantization', 'None'), use_flex=settings.get('use_flex', True),
+                          input_shape=settings.get('input_shape'))
+            finally:
+                shutil.rmtree(tf_model_path, ignore_errors=True)
+        elif kind == 'mo':
+            import subprocess
+            cmd = f'python "{settings["mo_path"]}" --input_model "{src}" --output_dir "{os.path.dirname(dst)}" --data_type {settings.get("data_type", "FP32")}'
+            if settings.get('batch_size'):
+                cmd += f' --batch={settings["batch_size"]}'
+            if settings.get('input_shape'):
+                cmd += f' --input_shape="{settings["input_shape"]}"'
+            subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        else:
+            raise ValueError(f'Unknown conversion kind {kind}')
+    except Exception:
+        return dict(job, error=traceback.format_exc())
+    return dict(job, seconds=time.time() - start, size_bytes=_output_size(dst))
+
+
+def _settings_for_manifest(settings):
+    return {k: v for k, v in settings.items() if k not in ['mo_path']}
+
+
+def run_convert_farm(jobs, output_dir, num_workers=4, incremental=True):
+    '''
+    jobs: list of dict(kind=tf2tflite|onnx2tflite|mo, src, dst, settings)
+    '''
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    todo = []
+    for job in jobs:
+        job['src_hash'] = hash_path(job['src'])
+        record = manifest.get(os.path.relpath(job['dst'], output_dir))
+        if incremental and record and os.path.exists(job['dst']) and record['src_hash'] == job['src_hash'] \
+                and record['settings'] == _settings_for_manifest(job['settings']):
+            print(f'{job["dst"]} is up to date, skip it.')
+        else:
+            todo.append(job)
+    print(f'{len(todo)} / {len(jobs)} models to convert with {num_workers} workers.')
+
+    failed = []
+    kinds = set(job['kind'] for job in todo)
+    # spawn so that workers do not inherit a half-initialized tensorflow from the parent
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(kinds, )) as executor:
+        futures = [executor.submit(_run_job, job) for job in todo]
+        for future in as_completed(futures):
+            result = future.result()
+            if result.get('error'):
+                print(f'Failed to convert {result["src"]}:\n{result["error"]}')
+                failed.append(result['src'])
+                continue
+            manifest[os.path.relpath(result['dst'], output_dir)] = dict(
+                kind=result['kind'], src=result['src'], src_hash=result['src_hash'], settings=_settings_for_manifest(result['settings']),
+                seconds=round(result['seconds'], 2), size_bytes=result['size_bytes'])
+            # write after every model so that an interrupted run keeps the finished ones
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
+            print(f'Convert {result["src"]} -> {result["dst"]} in {result["seconds"]:.1f}s, {result["size_bytes"] / 1e6:.2f} MB.')
+
+    print(f'Done. {len(todo) - len(failed)} converted, {len(jobs) - len(todo)} skipped, {len(failed)} failed. Manifest: {manifest_path}')
+    return failed
+
+
+def get_jobs(kind, input_dir, output_dir, settings):
+    quant_suffix_dict = dict(dynamic='_quant_dynamic', float16='_quant_float16', int8='_quant_int8')
+    jobs = []
+    for name in sorted(os.listdir(input_dir)):
+        src = os.path.join(input_dir, name)
+        if kind == 'tf2tflite':
+            stem = name.replace('.tf', '')
+        elif kind == 'onnx2tflite':
+            if not name.endswith('.onnx'):
+                continue
+            stem = name[: -len('.onnx')]
+        else:
+            stem = os.path.splitext(name)[0]
+
+        if kind == 'mo':
+            dst = os.path.join(output_dir, f'{stem}.xml')
+        else:
+            dst = os.path.join(output_dir, f'{stem}{quant_suffix_dict.get(settings.get("quantization"), "")}.tflite')
+        jobs.append(dict(kind=kind, src=src, dst=dst, settings=settings))
+    return jobs
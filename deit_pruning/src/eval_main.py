@@ -11,6 +11,7 @@ from utils import swift_converter, set_random, build_dataset, evaluate
 from trainer import TrainerWithTokenizer
 
 from nn_pruning.inference_model_patcher import optimize_model
+from nn_pruning.modules.hidden_pruning import load_pruned_model
 
 def compute_latencies(model, inputs):
   from data import get_token_att_ids
@@ -84,13 +85,13 @@ def main():
     print("Missing:", m)
     print("Unexpected: ", u)
   else:
-    model = AutoModelForImageClassification.from_pretrained(args.model_dir)
+    model = load_pruned_model(AutoModelForImageClassification, args.model_dir)
 
   testset, _ = build_dataset(args.data_path, is_train=False, shuffle=False, return_dict=False)
 
   if args.nn_pruning:
     original_params = model.num_parameters()
-    model = optimize_model(model, "dense")
+    model = optimize_model(model, "dense", clone=False)
     pruned_params = model.num_parameters()
     print("Original params:", original_params)
     print("After-pruned params:", pruned_params)
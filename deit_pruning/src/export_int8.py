@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import AutoModelForImageClassification
+
+from nn_pruning.inference_model_patcher import optimize_model
+from nn_pruning.modules.hidden_pruning import load_pruned_model, residual_width
+from utils import build_dataset
+
+'''
+Sparse + int8 export of a pruned DeiT checkpoint in one pass:
+  dense fp32 ONNX -> compacted fp32 ONNX -> per-channel int8 ONNX (dynamic or static)
+Every stage is checked for top-1 accuracy on the same fixed proxy subset of ImageNet val, and its file size and
+onnxruntime CPU latency are measured. The report compares each stage with the fp32 compact model.
+
+python src/export_int8.py --model_dir ./results/deit_tiny_pruned/final --data_path <imagenet> --output_dir ./results/deit_tiny_pruned/int8
+'''
+
+
+class LogitsWrapper(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+def build_proxy_subset(data_path, num_samples, offset=0):
+    # evenly spaced over the val set (sorted by class), offset selects a disjoint subset for calibration
+    dataset, _ = build_dataset(data_path, is_train=False, shuffle=False, return_dict=False)
+    step = max(len(dataset) // num_samples, 1)
+    indices = list(range(offset % step, len(dataset), step))[:num_samples]
+    images, labels = zip(*[dataset[i] for i in indices])
+    return torch.stack(images).numpy(), np.array(labels)
+
+
+def export_onnx(model, output_path, input_size=224, opset_version=13):
+    model.eval()
+    torch.onnx.export(
+        LogitsWrapper(model),
+        torch.rand(1, 3, input_size, input_size),
+        str(output_path),
+        input_names=['pixel_values'],
+        output_names=['logits'],
+        dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}},
+        export_params=True,
+        opset_version=opset_version,
+        do_constant_folding=True,
+    )
+
+
+def quantize_onnx(input_path, output_path, mode, calibration_images=None):
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, CalibrationDataReader
+
+    if mode == 'dynamic':
+        quantize_dynamic(str(input_path), str(output_path), per_channel=True, weight_type=QuantType.QInt8)
+        return
+
+    class ProxyDataReader(CalibrationDataReader):
+        def __init__(self, images):
+            self.batches = iter(images[i:i + 1] for i in range(len(images)))
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {'pixel_values': batch}
+
+    quantize_static(str(input_path), str(output_path), ProxyDataReader(calibration_images), per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+
+def create_session(onnx_path, num_threads):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    return ort.InferenceSession(str(onnx_path), options)
+
+
+def predict(session, images, batch_size=50):
+    return np.concatenate([session.run(None, {'pixel_values': images[i:i + batch_size]})[0].argmax(1)
+                           for i in range(0, len(images), batch_size)])
+
+
+def measure_latency_ms(session, image, num_runs=50, warmup_runs=10):
+    for _ in range(warmup_runs):
+        session.run(None, {'pixel_values': image})
+    start = time.perf_counter()
+    for _ in range(num_runs):
+        session.run(None, {'pixel_values': image})
+    return (time.perf_counter() - start) / num_runs * 1000
+
+
+def evaluate_stage(name, onnx_path, images, labels, num_threads, num_runs):
+    session = create_session(onnx_path, num_threads)
+    predictions = predict(session, images)
+    return dict(
+        stage=name,
+        path=str(onnx_path),
+        size_mb=os.path.getsize(onnx_path) / 2 ** 20,
+        latency_ms=measure_latency_ms(session, images[:1], num_runs=num_runs),
+        top1=float((predictions == labels).mean() * 100),
+        predictions=predictions,
+    )
+
+
+def print_report(report):
+    print(f'{"stage":<16} {"size_mb":>8} {"latency_ms":>11} {"top1":>7} {"delta":>7} {"agree":>7}')
+    for x in report['stages']:
+        print(f'{x["stage"]:<16} {x["size_mb"]:>8.2f} {x["latency_ms"]:>11.2f} {x["top1"]:>7.2f} {x["top1_delta"]:>+7.2f} {x["agreement"]:>7.2f}')
+    print(f'Accuracy check (max drop {report["max_accuracy_drop"]}): {"passed" if report["passed"] else "FAILED"}')
+
+
+def export_int8_pipeline(model_dir, data_path, output_dir, quantization='dynamic', num_samples=500, num_calib_samples=100,
+                         num_threads=1, num_runs=50, max_accuracy_drop=1.0, opset_version=13):
+    '''
+    returns the report dict, also written to <output_dir>/report.json.
+    '''
+    output_dir = Path(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    images, labels = build_proxy_subset(data_path, num_samples)
+
+    # also rebuilds checkpoints with a pruned hidden dimension
+    model = load_pruned_model(AutoModelForImageClassification, model_dir)
+    input_size = model.config.image_size
+    hidden_size = residual_width(model)
+    dense_path = output_dir / 'dense_fp32.onnx'
+    export_onnx(model, dense_path, input_size, opset_version)
+
+    # compacted once and in place, the masked checkpoint is not needed anymore
+    model, compaction = optimize_model(model, 'dense', clone=False, return_report=True)
+    compact_path = output_dir / 'compact_fp32.onnx'
+    export_onnx(model, compact_path, input_size, opset_version)
+    del model
+
+    int8_path = output_dir / f'compact_int8_{quantization}.onnx'
+    calibration_images = build_proxy_subset(data_path, num_calib_samples, offset=1)[0] if quantization == 'static' else None
+    quantize_onnx(compact_path, int8_path, quantization, calibration_images)
+
+    stages = [evaluate_stage(name, path, images, labels, num_threads, num_runs)
+              for name, path in [('dense_fp32', dense_path), ('compact_fp32', compact_path), (f'compact_int8_{quantization}', int8_path)]]
+    reference_top1, reference_predictions = stages[1]['top1'], stages[1]['predictions']
+    for x in stages:
+        x['top1_delta'] = x['top1'] - reference_top1
+        # fraction of the proxy subset with the same top-1 class as the fp32 compact model
+        x['agreement'] = float((x.pop('predictions') == reference_predictions).mean() * 100)
+
+    report = dict(
+        model_dir=str(model_dir),
+        num_samples=len(labels),
+        num_threads=num_threads,
+        quantization=quantization,
+        hidden_size=hidden_size,
+        max_accuracy_drop=max_accuracy_drop,
+        passed=all(x['top1_delta'] >= -max_accuracy_drop for x in stages),
+        stages=stages,
+        compaction=compaction,
+    )
+    with open(output_dir / 'report.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', type=Path, required=True, help='pruned checkpoint saved by train_main.py')
+    parser.add_argument('--data_path', type=str, required=True, help='imagenet root, the proxy subset is taken from val')
+    parser.add_argument('--output_dir', type=Path, default=None, help='defaults to <model_dir>/int8')
+    parser.add_argument('--quantization', choices=['dynamic', 'static'], default='dynamic')
+    parser.add_argument('--num_samples', type=int, default=500, help='size of the accuracy proxy subset')
+    parser.add_argument('--num_calib_samples', type=int, default=100, help='static quantization calibration images')
+    parser.add_argument('--num_threads', type=int, default=1)
+    parser.add_argument('--num_runs', type=int, default=50)
+    parser.add_argument('--max_accuracy_drop', type=float, default=1.0, help='top-1 points allowed below the fp32 compact model')
+    parser.add_argument('--opset_version', type=int, default=13)
+    args = parser.parse_args()
+
+    report = export_int8_pipeline(args.model_dir, args.data_path, args.output_dir or args.model_dir / 'int8', args.quantization,
+                                  args.num_samples, args.num_calib_samples, args.num_threads, args.num_runs,
+                                  args.max_accuracy_drop, args.opset_version)
+    if not report['passed']:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,17 @@
 from supernet import SwiftBERT
+import os
+import copy
 import random
+import hashlib
+import time
 import torch
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 from pathlib import Path
 import json
 from transformers import BertConfig
 from supernet import SwiftBERTOutput
+from layers.super_bertlayers import VA_BertLayer
 import argparse
 baseconfig={
   "_name_or_path": "google/bert_uncased_L-4_H-256_A-4",
@@ -100,53 +106,191 @@ def gen_uniform():
 
 #gen_testconfigs()
 
+# python src/get_latency.py --model_dir latency_data --workers 8
+# python src/get_latency.py --model_dir latency_data --blocks --workers 8 --measure
+#
+# Exports go to <output_dir>/<export key>/, the key hashes every config field but the layers together
+# with max_ad_length and opset_version, and the files are named by the layer encoding. Existing
+# files are skipped, so reruns only export the new configs. With --blocks only one transformer block
+# per unique (heads, intermediate_size) pair and the rest of the model (embeddings, mask, classifier)
+# are exported, and the latency of every config is composed as base + sum of its blocks. Every
+# measured session pays the onnxruntime per-run overhead once, the composed latency subtracts it for
+# all but one session with the overhead measured on an Identity model with the block input.
+# --latency_output is read by latency_model.get_model to fit the predictor.
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--model_dir", type=Path, default='latency_data')
-parser.add_argument("--nn_pruning", action='store_true')
-parser.add_argument("--no_opt", action='store_true')
-parser.add_argument("--force_opt", action='store_true')
-parser.add_argument("--max_ad_length", type=int, default=38)
-parser.add_argument("--output_name", type=str, default="output")
-parser.add_argument("--opset_version", type=int, default=13)
-
-args = parser.parse_args()
-assert not (args.no_opt and args.force_opt), "no_opt and force_opt cannot be set together."
-# python src/onnx_export.py --model_dir ./results/dummy_mini/final/
-def gen_onnx(config):
-    myconfig=BertConfig.from_pretrained(config)
-    print(myconfig)
-    model = SwiftBERTOutput(myconfig)
-    print(model)
-    bert_config = model.config
-
-    max_ad_length = args.max_ad_length
-
-    print("==== export ====")
-    output_name = config.replace(".json","")
-
-    torch.onnx.export(
-    model,
-    (torch.tensor([1] * (max_ad_length)).view(-1, max_ad_length),
-        torch.tensor([1] * (max_ad_length)).view(-1, max_ad_length),
-        torch.tensor([1] * (max_ad_length)).view(-1, max_ad_length)),
-     f'{output_name}.onnx', 
-    input_names=['input_ids', 'attention_mask', 'token_type_ids'],
-    output_names=['score'],
-    verbose=False,
-    export_params=True,
-    opset_version=args.opset_version,
-    do_constant_folding=True
-    )
-
-'''
-gen_original()
-gen_onnx('latency_data/config.json')
-'''
-
-#gen_testconfigs(2000)
-#gen_original()
-#gen_uniform()
-filenames=glob('latency_data/**.json')
-for filename in filenames:
-    gen_onnx(filename)
+def load_config(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def layer_configs(config):
+    return [(x['heads'], x['intermediate_size']) for _, x in sorted(config['layers'].items(), key=lambda x: int(x[0]))]
+
+def config_tag(config):
+    # same encoding as the gen_* file names, parsed back by latency_model.get_feature
+    return '-'.join(f"h_{h / config['num_attention_heads']}_d_{d / config['intermediate_size']}" for h, d in layer_configs(config))
+
+def export_key(config, max_ad_length, opset_version):
+    base = {k: v for k, v in config.items() if k not in ['layers', '_name_or_path', 'architectures', 'transformers_version']}
+    encoding = json.dumps(dict(base, max_ad_length=max_ad_length, opset_version=opset_version), sort_keys=True)
+    return hashlib.sha1(encoding.encode()).hexdigest()[:12]
+
+def _export(module, inputs, output_path, input_names, output_names, opset_version):
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    torch.onnx.export(module, inputs, tmp_path, input_names=input_names, output_names=output_names, verbose=False,
+                      export_params=True, opset_version=opset_version, do_constant_folding=True)
+    os.replace(tmp_path, output_path)
+
+class BlockWrapper(torch.nn.Module):
+    # one transformer block, the extended attention mask is computed once per model so it is an input
+    def __init__(self, layer):
+        super().__init__()
+        self.layer = layer
+
+    def forward(self, hidden_states, extended_attention_mask):
+        return self.layer(hidden_states, extended_attention_mask)[0]
+
+def gen_onnx(config, output_path, max_ad_length, opset_version):
+    torch.set_num_threads(1)
+    model = SwiftBERTOutput(BertConfig.from_dict(config)).eval()
+    ids = torch.tensor([1] * (max_ad_length)).view(-1, max_ad_length)
+    _export(model, (ids, ids, ids), output_path, ['input_ids', 'attention_mask', 'token_type_ids'], ['score'], opset_version)
+    return output_path
+
+def gen_block_onnx(config, heads, intermediate_size, output_path, max_ad_length, opset_version):
+    torch.set_num_threads(1)
+    block = BlockWrapper(VA_BertLayer(BertConfig.from_dict(config), {'heads': heads, 'intermediate_size': intermediate_size})).eval()
+    inputs = (torch.rand(1, max_ad_length, config['hidden_size']), torch.zeros(1, 1, 1, max_ad_length))
+    _export(block, inputs, output_path, ['hidden_states', 'extended_attention_mask'], ['output'], opset_version)
+    return output_path
+
+def base_config(config):
+    # embeddings, mask and classifier without any transformer block
+    return dict(config, num_hidden_layers=0, layers={})
+
+def block_name(heads, intermediate_size):
+    return f'block_h_{heads}_d_{intermediate_size}.onnx'
+
+def plan_exports(configs, output_dir, max_ad_length, opset_version, blocks=False):
+    """
+    returns the (function, args) to run for the files that do not exist yet, and the list of all output files.
+    """
+    jobs, outputs, seen = [], [], set()
+    for config in configs:
+        key_dir = Path(output_dir) / export_key(config, max_ad_length, opset_version)
+        if not blocks:
+            path = str(key_dir / f'{config_tag(config)}.onnx')
+            todo = [(path, gen_onnx, (config, path, max_ad_length, opset_version))]
+        else:
+            path = str(key_dir / 'base.onnx')
+            todo = [(path, gen_onnx, (base_config(config), path, max_ad_length, opset_version))]
+            for h, d in layer_configs(config):
+                path = str(key_dir / block_name(h, d))
+                todo.append((path, gen_block_onnx, (config, h, d, path, max_ad_length, opset_version)))
+        for output_path, function, job_args in todo:
+            if output_path in seen:
+                continue
+            seen.add(output_path)
+            outputs.append(output_path)
+            if not os.path.exists(output_path):
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                jobs.append((function, job_args))
+    return jobs, outputs
+
+def run_exports(jobs, workers=1):
+    if workers <= 1:
+        return [function(*job_args) for function, job_args in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(function, *job_args) for function, job_args in jobs]
+        return [future.result() for future in futures]
+
+def measure_onnx_us(onnx_path, num_runs=100, warmup_runs=10):
+    import numpy as np
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    session = ort.InferenceSession(onnx_path, options)
+    feeds = {}
+    for x in session.get_inputs():
+        shape = [d if isinstance(d, int) else 1 for d in x.shape]
+        feeds[x.name] = np.ones(shape, dtype=np.int64) if 'int64' in x.type else np.zeros(shape, dtype=np.float32)
+    for _ in range(warmup_runs):
+        session.run(None, feeds)
+    start = time.perf_counter()
+    for _ in range(num_runs):
+        session.run(None, feeds)
+    return (time.perf_counter() - start) / num_runs * 1e6
+
+def measure_session_overhead_us(config, max_ad_length, num_runs=100, warmup_runs=10):
+    """
+    per-run cost of an onnxruntime session doing nothing (Identity) on the block input.
+    """
+    import tempfile
+    import onnx
+    from onnx import helper, TensorProto
+    shape = [1, max_ad_length, config['hidden_size']]
+    graph = helper.make_graph([helper.make_node('Identity', ['hidden_states'], ['output'])], 'identity',
+                              [helper.make_tensor_value_info('hidden_states', TensorProto.FLOAT, shape)],
+                              [helper.make_tensor_value_info('output', TensorProto.FLOAT, shape)])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'identity.onnx')
+        onnx.save(model, path)
+        return measure_onnx_us(path, num_runs, warmup_runs)
+
+def compose_latency(config, latencies, key_dir, session_overhead_us=0.):
+    """
+    whole model latency from the base and block latencies, latencies maps the onnx path to us.
+    The base and every block are separate sessions, the session overhead is only kept once.
+    """
+    key_dir = Path(key_dir)
+    blocks = layer_configs(config)
+    return (latencies[str(key_dir / 'base.onnx')] + sum(latencies[str(key_dir / block_name(h, d))] for h, d in blocks)
+            - len(blocks) * session_overhead_us)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_dir", type=Path, default='latency_data')
+    parser.add_argument("--output_dir", type=Path, default=None, help='defaults to <model_dir>/onnx')
+    parser.add_argument("--nn_pruning", action='store_true')
+    parser.add_argument("--no_opt", action='store_true')
+    parser.add_argument("--force_opt", action='store_true')
+    parser.add_argument("--max_ad_length", type=int, default=38)
+    parser.add_argument("--output_name", type=str, default="output")
+    parser.add_argument("--opset_version", type=int, default=13)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--blocks", action='store_true', help='export the unique blocks and compose the model latencies')
+    parser.add_argument("--measure", action='store_true', help='measure the exported files with onnxruntime (1 thread)')
+    parser.add_argument("--latency_output", type=str, default='latency.csv')
+
+    args = parser.parse_args()
+    assert not (args.no_opt and args.force_opt), "no_opt and force_opt cannot be set together."
+    output_dir = args.output_dir or args.model_dir / 'onnx'
+
+    #gen_testconfigs(2000)
+    #gen_original()
+    #gen_uniform()
+    filenames = sorted(glob(str(args.model_dir / '*.json')))
+    configs = [load_config(filename) for filename in filenames]
+    jobs, outputs = plan_exports(configs, output_dir, args.max_ad_length, args.opset_version, blocks=args.blocks)
+    print(f'{len(configs)} configs, {len(outputs)} onnx files, {len(outputs) - len(jobs)} already exported, exporting {len(jobs)}.')
+    start = time.perf_counter()
+    run_exports(jobs, workers=args.workers)
+    print(f'Exported {len(jobs)} files in {time.perf_counter() - start:.1f} s.')
+
+    if args.measure:
+        latencies = {x: measure_onnx_us(x) for x in outputs}
+        session_overhead_us = measure_session_overhead_us(configs[0], args.max_ad_length) if args.blocks and configs else 0.
+        if args.blocks:
+            print(f'onnxruntime session overhead {session_overhead_us:.1f} us per run.')
+        with open(Path(output_dir) / 'onnx_latency.json', 'w') as f:
+            json.dump(dict(latencies=latencies, session_overhead_us=session_overhead_us), f, indent=4)
+        with open(args.latency_output, 'w') as f:
+            for config in configs:
+                key_dir = Path(output_dir) / export_key(config, args.max_ad_length, args.opset_version)
+                if args.blocks:
+                    latency = compose_latency(config, latencies, key_dir, session_overhead_us)
+                else:
+                    latency = latencies[str(key_dir / f'{config_tag(config)}.onnx')]
+                f.write(config_tag(config) + ',' + str(latency) + '\n')
+        print(f'Latencies written to {args.latency_output}.')
@@ -38,6 +38,6 @@ if __name__ == "__main__":
 
   model = SwiftBERT.from_pretrained(args.deit_model_name)
   if args.nn_pruning:
-    model = optimize_model(model, "dense")
+    model = optimize_model(model, "dense", clone=False)
   
   show(model, skip_embedding=args.skip_embedding, skip_layernorm=args.skip_layernorm, skip_bias=args.skip_bias)
@@ -36,7 +36,23 @@ def get_feature(fe):
     return X
 
 
+def get_latency_csv(filename):
+    # the tag,us lines written by get_latency.py --measure
+    X=[]
+    Y=[]
+    with open(filename,'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            fe,avg=line.strip().rsplit(',',1)
+            X.append(get_feature(fe))
+            Y.append(float(avg))
+    return X,Y
+
+
 def get_latency(filename):
+    if filename.endswith('.csv'):
+        return get_latency_csv(filename)
     X=[]
     Y=[]
     f1=open("latency.csv",'w')
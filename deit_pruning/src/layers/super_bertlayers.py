@@ -6,11 +6,28 @@ from transformers.activations import ACT2FN
 import torch
 from torch import nn
 from torch.nn import BCEWithLogitsLoss
+
+
+class SuperLinear(nn.Linear):
+    # nn.Linear whose forward only uses the leading active_in columns / active_out rows of the shared weight.
+    # The slices are views, the state dict is the one of the full nn.Linear.
+    def __init__(self, in_features, out_features, bias=True):
+        super().__init__(in_features, out_features, bias)
+        self.active_in = in_features
+        self.active_out = out_features
+
+    def forward(self, input):
+        if self.active_in == self.in_features and self.active_out == self.out_features:
+            return super().forward(input)
+        bias = self.bias[:self.active_out] if self.bias is not None else None
+        return nn.functional.linear(input, self.weight[:self.active_out, :self.active_in], bias)
+
+
 class VA_BertIntermediate(BertIntermediate):
     def __init__(self, config,layerconfig):
         super().__init__(config)
         print(layerconfig['intermediate_size'])
-        self.dense = nn.Linear(config.hidden_size, layerconfig['intermediate_size'])
+        self.dense = SuperLinear(config.hidden_size, layerconfig['intermediate_size'])
         if isinstance(config.hidden_act, str):
             self.intermediate_act_fn = ACT2FN[config.hidden_act]
         else:
@@ -18,7 +35,7 @@ class VA_BertIntermediate(BertIntermediate):
 class VA_BertOutput(BertOutput):
      def __init__(self, config,layerconfig):
         super().__init__(config)
-        self.dense = nn.Linear(layerconfig['intermediate_size'], config.hidden_size)
+        self.dense = SuperLinear(layerconfig['intermediate_size'], config.hidden_size)
         self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 class VA_BertSelfAttention(BertSelfAttention):
@@ -31,21 +48,31 @@ class VA_BertSelfAttention(BertSelfAttention):
             )
 
         self.num_attention_heads = heads_num
+        self.max_heads = heads_num
         self.attention_head_size = int(config.hidden_size / config.num_attention_heads) ##original head size
         self.all_head_size = heads_num * self.attention_head_size
         print('here',heads_num,self.all_head_size)
 
-        self.query = nn.Linear(config.hidden_size, self.all_head_size)
-        self.key = nn.Linear(config.hidden_size, self.all_head_size)
-        self.value = nn.Linear(config.hidden_size, self.all_head_size)
+        self.query = SuperLinear(config.hidden_size, self.all_head_size)
+        self.key = SuperLinear(config.hidden_size, self.all_head_size)
+        self.value = SuperLinear(config.hidden_size, self.all_head_size)
 
         self.dropout = nn.Dropout(config.attention_probs_dropout_prob)
+
+     def set_active_heads(self, heads_num):
+        # the first heads_num heads are kept, BertSelfAttention.forward reshapes with these two attributes
+        if not 0 < heads_num <= self.max_heads:
+            raise ValueError(f'heads must be in [1, {self.max_heads}], got {heads_num}')
+        self.num_attention_heads = heads_num
+        self.all_head_size = heads_num * self.attention_head_size
+        for linear in [self.query, self.key, self.value]:
+            linear.active_out = self.all_head_size
 class VA_BertSelfOutput(BertSelfOutput):
     def __init__(self, config,head_num):
         super().__init__(config)
         attention_head_size = int(config.hidden_size / config.num_attention_heads) ##original head size
         all_head_size = head_num * attention_head_size
-        self.dense = nn.Linear(all_head_size, config.hidden_size)
+        self.dense = SuperLinear(all_head_size, config.hidden_size)
         self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
@@ -73,6 +100,17 @@ class VA_BertLayer(BertLayer):
         self.intermediate = VA_BertIntermediate(config,layerconfig)
         self.output = VA_BertOutput(config,layerconfig)
 
+    def set_active(self, heads, intermediate_size):
+        if not 0 < intermediate_size <= self.intermediate.dense.out_features:
+            raise ValueError(f'intermediate_size must be in [1, {self.intermediate.dense.out_features}], got {intermediate_size}')
+        self.attention.self.set_active_heads(heads)
+        self.attention.output.dense.active_in = self.attention.self.all_head_size
+        self.intermediate.dense.active_out = intermediate_size
+        self.output.dense.active_in = intermediate_size
+
+    def max_config(self):
+        return self.attention.self.max_heads, self.intermediate.dense.out_features
+
 class VA_BertEncoder(BertEncoder):
      def __init__(self, config):
         super().__init__(config)
@@ -92,4 +130,16 @@ class VA_BertModel(BertModel):
         self.pooler = BertPooler(config) if add_pooling_layer else None
 
         self.init_weights()
+
+     def set_subnet(self, subnet):
+        '''
+        subnet: one (heads, intermediate_size) per layer. Slices the shared weights in place, reset_subnet() restores the supernet.
+        '''
+        if len(subnet) != len(self.encoder.layer):
+            raise ValueError(f'subnet has {len(subnet)} layers, the supernet has {len(self.encoder.layer)}')
+        for layer, (heads, intermediate_size) in zip(self.encoder.layer, subnet):
+            layer.set_active(heads, intermediate_size)
+
+     def reset_subnet(self):
+        self.set_subnet([layer.max_config() for layer in self.encoder.layer])
     
\ No newline at end of file
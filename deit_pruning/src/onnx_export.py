@@ -4,6 +4,7 @@ from pathlib import Path
 # missing tokenizer, so just cannot use convert directly
 # convert(framework="pt", model="results/playground/final/", output=Path("results/playground/final/output.onnx"), opset=13)
 
+import json
 import torch
 import argparse
 from model import SwiftBERTOutput
@@ -42,7 +43,8 @@ assert not (args.no_opt and args.force_opt), "no_opt and force_opt cannot be set
 
 model = SwiftBERTOutput.from_pretrained(args.model_dir)
 original_params = model.num_parameters()
-model = nn_optimize(model, "dense")
+# compacted once and in place, the checkpoint is not needed anymore
+model, compaction_report = nn_optimize(model, "dense", clone=False, return_report=True)
 pruned_params = model.num_parameters()
 print("Original params:", original_params)
 print("After-pruned params:", pruned_params)
@@ -55,9 +57,9 @@ max_ad_length = args.max_ad_length
 print("==== export ====")
 output_name = args.output_name
 if args.nn_pruning:
-  model = nn_optimize(model, "dense")
-  print(model)
   output_name += "_removepruned"
+with open(args.model_dir / f'{output_name}-compaction.json', 'w') as f:
+  json.dump(compaction_report, f, indent=2)
 torch.onnx.export(
   model,
   (torch.tensor([1] * (max_ad_length)).view(-1, max_ad_length),
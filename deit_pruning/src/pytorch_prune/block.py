@@ -22,27 +22,7 @@ class BlockPruningMethod(prune.BasePruningMethod):
     self.ord = n
 
   def get_block_view(self, matrix):
-    rows = matrix.shape[0]
-    cols = matrix.shape[1]
-
-    assert rows % self.block_row == 0
-    assert cols % self.block_col == 0
-
-    brows = rows // self.block_row
-    bcols = cols // self.block_col
-    bcnt = brows * bcols
-    
-    def subview(idx):
-        rstart = idx // bcols * self.block_row
-        rend = (idx // bcols + 1) * self.block_row
-        cstart = idx % bcols * self.block_col
-        cend = (idx % bcols + 1) * self.block_col
-        
-        return matrix[rstart:rend, cstart:cend]
-    
-    blocks = [subview(idx) for idx in range(bcnt)]
-    
-    return torch.stack(blocks)
+    return get_block_view(matrix, self.block_row, self.block_col)
 
   def compute_mask(self, t, default_mask):
     # _validate_structured_pruning(t)
@@ -60,17 +40,85 @@ class BlockPruningMethod(prune.BasePruningMethod):
 
     mask = default_mask.clone()
     if nparams_toprune != 0:
-      block_view = self.get_block_view(t)
-      norms = torch.linalg.norm(block_view, ord=self.ord, dim=(1, 2))
+      norms = get_block_norms(t, self.block_row, self.block_col, self.ord)
       indices = torch.topk(norms, k=nparams_toprune, largest=False).indices
-      this_mask = torch.ones((brows, bcols))
-      this_mask.view(-1)[indices] = 0
-      this_mask = torch.repeat_interleave(this_mask, self.block_row, dim=0)
-      this_mask = torch.repeat_interleave(this_mask, self.block_col, dim=1)
-      mask[this_mask == 0] = 0
+      this_mask = torch.ones(bcnt, device=t.device)
+      this_mask[indices] = 0
+      mask[expand_block_mask(this_mask.view(brows, bcols), self.block_row, self.block_col) == 0] = 0
     return mask
 
 
+class NMPruningMethod(prune.BasePruningMethod):
+  # keep the n largest weights of every m consecutive weights along the input dim, e.g. 2:4
+  # "unstructured" would get a 1-d slice of the unpruned entries when applied again, and PruningContainer rejects
+  # custom types, "global" gets the whole 2-d tensor and the previous mask, which compute_mask keeps
+  PRUNING_TYPE = "global"
+
+  def __init__(self, n, m):
+    assert 0 < n <= m
+    self.n = n
+    self.m = m
+
+  def compute_mask(self, t, default_mask):
+    assert len(t.shape) == 2
+    rows = t.shape[0]
+    cols = t.shape[1]
+    assert cols % self.m == 0
+
+    mask = default_mask.clone()
+    if self.n < self.m:
+      groups = t.abs().reshape(rows, cols // self.m, self.m)
+      indices = torch.topk(groups, k=self.m - self.n, dim=2, largest=False).indices
+      this_mask = torch.ones_like(groups).scatter_(2, indices, 0)
+      mask[this_mask.view(rows, cols) == 0] = 0
+    return mask
+
+
+def get_block_view(matrix, block_row, block_col):
+  # (rows, cols) -> (brows * bcols, block_row, block_col), blocks in row-major order
+  rows = matrix.shape[0]
+  cols = matrix.shape[1]
+
+  assert rows % block_row == 0
+  assert cols % block_col == 0
+
+  brows = rows // block_row
+  bcols = cols // block_col
+  return matrix.reshape(brows, block_row, bcols, block_col).permute(0, 2, 1, 3).reshape(brows * bcols, block_row, block_col)
+
+
+def get_block_norms(matrix, block_row, block_col, n='fro'):
+  return torch.linalg.norm(get_block_view(matrix, block_row, block_col), ord=n, dim=(1, 2))
+
+
+def expand_block_mask(block_mask, block_row, block_col):
+  # (brows, bcols) -> (brows * block_row, bcols * block_col)
+  brows, bcols = block_mask.shape
+  return block_mask[:, None, :, None].expand(brows, block_row, bcols, block_col).reshape(brows * block_row, bcols * block_col)
+
+
 def block_pruning(module, name, amount, block_row, block_col, n='fro'):
   BlockPruningMethod.apply(module, name, amount=amount, block_row=block_row, block_col=block_col, n=n)
   return module
+
+
+def nm_pruning(module, name, n, m):
+  NMPruningMethod.apply(module, name, n=n, m=m)
+  return module
+
+
+def global_block_pruning(parameters, amount, block_row, block_col, n='fro'):
+  # rank the blocks of all (module, name) pairs together, pytorch's global_unstructured only accepts unstructured methods
+  with torch.no_grad():
+    norms = [get_block_norms(getattr(module, name), block_row, block_col, n) for module, name in parameters]
+    all_norms = torch.cat(norms)
+    nparams_toprune = _compute_nparams_toprune(amount, len(all_norms))
+    _validate_pruning_amount(nparams_toprune, len(all_norms))
+
+    keep = torch.ones_like(all_norms)
+    if nparams_toprune != 0:
+      keep[torch.topk(all_norms, k=nparams_toprune, largest=False).indices] = 0
+    for (module, name), block_mask in zip(parameters, torch.split(keep, [len(x) for x in norms])):
+      t = getattr(module, name)
+      block_mask = block_mask.view(t.shape[0] // block_row, t.shape[1] // block_col)
+      prune.custom_from_mask(module, name, expand_block_mask(block_mask, block_row, block_col).to(dtype=t.dtype))
@@ -3,7 +3,7 @@ from torch.nn.utils import prune
 import torch.nn
 import argparse
 from pathlib import Path
-from .block import BlockPruningMethod, block_pruning
+from .block import BlockPruningMethod, NMPruningMethod, block_pruning, nm_pruning, global_block_pruning
 from .ln_smart import LnSmartStructured, ln_smart_structured
 
 def is_encoder(name, module):
@@ -16,9 +16,13 @@ prune_mapping = {
   "ln_structured": (prune.ln_structured, prune.LnStructured),
   "block": (block_pruning, BlockPruningMethod),
   "ln_smart_structured": (ln_smart_structured, LnSmartStructured),
+  "nm": (nm_pruning, NMPruningMethod),
 }
 
 def argbuilder(args):
+  if args.func == "nm":
+    n, m = [int(x) for x in args.nm.split(':')]
+    return {"n": n, "m": m}
   if "unstructured" in args.func or args.func == 'block':
     block_args = {}
     if args.func == "block":
@@ -73,6 +77,7 @@ if __name__ == "__main__":
   parser.add_argument("--dim", type=int, default=None)
   parser.add_argument("--block_row", type=int, default=None)
   parser.add_argument("--block_col", type=int, default=None)
+  parser.add_argument("--nm", type=str, default="2:4", help='n:m of the nm func, keep n of every m weights')
   parser.add_argument("--seed", type=int, default=12345)
   parser.add_argument("--hybrid", action='store_true', help='It overwrites func, global & ln options')
   
@@ -106,11 +111,12 @@ if __name__ == "__main__":
       "random_structured",
       "ln_structured",
       "block",
-      "ln_smart_structured"
+      "ln_smart_structured",
+      "nm"
     ]
 
     if args.glob:
-      assert "_structured" not in args.func
+      assert "_structured" not in args.func and args.func != "nm"
 
     if "_structured" in args.func:
       if args.func != "ln_smart_structured":
@@ -128,11 +134,14 @@ if __name__ == "__main__":
       for name, module in model.named_modules():
         if is_encoder(name, module):
           parameters_to_prune.append((module, 'weight'))
-      prune.global_unstructured(
-        parameters_to_prune,
-        pruning_method=prune_mapping[args.func][1],
-        **argbuilder(args)
-      )
+      if args.func == "block":
+        global_block_pruning(parameters_to_prune, **argbuilder(args))
+      else:
+        prune.global_unstructured(
+          parameters_to_prune,
+          pruning_method=prune_mapping[args.func][1],
+          **argbuilder(args)
+        )
       for name, module in model.named_modules():
         if is_encoder(name, module):
           prune.remove(module, 'weight')
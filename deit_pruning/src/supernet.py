@@ -1,9 +1,11 @@
 from layers.super_bertlayers import VA_BertModel
 from transformers.modeling_outputs import SequenceClassifierOutput
 from transformers import BertPreTrainedModel
+import copy
 import torch
 from torch import nn
 from torch.nn import BCEWithLogitsLoss
+from data import get_token_att_ids
 
 
 class SwiftBERT(BertPreTrainedModel):
@@ -131,3 +133,100 @@ class SwiftBERTOutput(SwiftBERT):
     )
 
     return self.sigmoid(outputs.logits[0, 0])
+
+
+def normalize_subnet(subnet):
+  # {'0': {'heads': h, 'intermediate_size': d}, ...} (the config.layers format), a list of such dicts
+  # or a list of (heads, intermediate_size) -> tuple of (heads, intermediate_size) per layer
+  if isinstance(subnet, dict):
+    subnet = [subnet[str(i)] for i in range(len(subnet))]
+  return tuple((x['heads'], x['intermediate_size']) if isinstance(x, dict) else tuple(x) for x in subnet)
+
+
+def extract_subnet(model, subnet):
+  """
+  Standalone SwiftBERT with the weights of the subnet copied out of the supernet.
+  """
+  subnet = normalize_subnet(subnet)
+  config = copy.deepcopy(model.config)
+  config.layers = {str(i): {'heads': heads, 'intermediate_size': intermediate_size} for i, (heads, intermediate_size) in enumerate(subnet)}
+  standalone = type(model)(config)
+  source = model.state_dict()
+  # heads and FFN neurons are kept as prefixes, so every tensor is the leading slice of the supernet one
+  standalone.load_state_dict({k: source[k][tuple(slice(0, n) for n in v.shape)].clone() for k, v in standalone.state_dict().items()})
+  return standalone.to(next(model.parameters()).device)
+
+
+class SubnetEvaluator:
+  """
+  Ranks subnets of a SwiftBERT supernet on a fixed validation subset without building them.
+
+  The subset is batched once and its embedding outputs and attention masks are cached, as the
+  embeddings do not depend on the subnet. Each candidate is activated on the shared weights with
+  VA_BertModel.set_subnet, which only slices views. All candidates go through the same data pass
+  and are sorted so that a candidate reuses the hidden states of the longest layer prefix it shares
+  with the previous candidate.
+  """
+
+  def __init__(self, model, dataset, num_samples=1000, batch_size=100, device='cpu'):
+    self.model = model.to(device).eval()
+    self.batches = []
+    one, zero = torch.tensor(1, device=device), torch.tensor(0, device=device)
+    samples = [dataset[i] for i in range(min(num_samples, len(dataset)))]
+    with torch.no_grad():
+      for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        input_ids = nn.utils.rnn.pad_sequence([x['input_ids'] for x in chunk], batch_first=True).to(device)
+        labels = torch.stack([x['labels'] for x in chunk]).to(device)
+        attention_mask, token_type_ids = get_token_att_ids(zero, one, input_ids)
+        bert = model.bert
+        extended_mask = bert.get_extended_attention_mask(attention_mask, input_ids.shape, device)
+        hidden_states = bert.embeddings(input_ids=input_ids, token_type_ids=token_type_ids)
+        self.batches.append((hidden_states, extended_mask, labels))
+    print(f'Cached {len(samples)} samples in {len(self.batches)} batches.')
+
+  def _forward_batch(self, hidden_states, extended_mask, subnets):
+    layers = self.model.bert.encoder.layer
+    logits = {}
+    # prefix[i] holds (subnet[:i + 1], hidden states after layer i)
+    prefix = []
+    for subnet in subnets:
+      shared = 0
+      while shared < len(prefix) and prefix[shared][0] == subnet[:shared + 1]:
+        shared += 1
+      del prefix[shared:]
+      hidden = prefix[-1][1] if prefix else hidden_states
+      for i in range(shared, len(layers)):
+        layers[i].set_active(*subnet[i])
+        hidden = layers[i](hidden, extended_mask)[0]
+        prefix.append((subnet[:i + 1], hidden))
+      logits[subnet] = self.model.classifier(hidden[:, 0])
+    return logits
+
+  def evaluate(self, subnets):
+    """
+    returns one dict(loss, accuracy) per subnet, in the order of subnets.
+    """
+    subnets = [normalize_subnet(x) for x in subnets]
+    order = sorted(set(subnets))
+    loss_fct = BCEWithLogitsLoss(reduction='sum')
+    totals = {x: torch.zeros(2) for x in order}
+    count = 0
+    try:
+      with torch.no_grad():
+        for hidden_states, extended_mask, labels in self.batches:
+          for subnet, logits in self._forward_batch(hidden_states, extended_mask, order).items():
+            correct = ((logits[:, 0:1] > 0).float() == (labels[:, 0:1] > 0.5).float()).sum()
+            totals[subnet] += torch.stack([loss_fct(logits[:, 0:1], labels[:, 0:1]), correct]).cpu()
+          count += labels.shape[0]
+    finally:
+      self.model.bert.reset_subnet()
+    return [dict(loss=float(totals[x][0]) / count, accuracy=float(totals[x][1]) / count) for x in subnets]
+
+  def rank(self, subnets, key='loss'):
+    """
+    returns (subnet, metrics) sorted from the best to the worst on key.
+    """
+    results = self.evaluate(subnets)
+    reverse = key != 'loss'
+    return sorted(zip([normalize_subnet(x) for x in subnets], results), key=lambda x: x[1][key], reverse=reverse)
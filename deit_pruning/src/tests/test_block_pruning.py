@@ -0,0 +1,99 @@
+import unittest
+from unittest import TestCase
+
+import torch
+from torch.nn.utils import prune
+from torch.nn.utils.prune import _compute_nparams_toprune
+
+from pytorch_prune.block import BlockPruningMethod, block_pruning, global_block_pruning, nm_pruning
+
+
+def reference_block_mask(t, amount, block_row, block_col, n='fro'):
+  # the slice / stack implementation BlockPruningMethod had before it was vectorized
+  rows, cols = t.shape
+  brows, bcols = rows // block_row, cols // block_col
+  bcnt = brows * bcols
+  nparams_toprune = _compute_nparams_toprune(amount, bcnt)
+  mask = torch.ones_like(t)
+  if nparams_toprune != 0:
+    blocks = []
+    for idx in range(bcnt):
+      r, c = idx // bcols * block_row, idx % bcols * block_col
+      blocks.append(t[r:r + block_row, c:c + block_col])
+    norms = torch.linalg.norm(torch.stack(blocks), ord=n, dim=(1, 2))
+    indices = torch.topk(norms, k=nparams_toprune, largest=False).indices
+    this_mask = torch.ones((brows, bcols))
+    this_mask.view(-1)[indices] = 0
+    this_mask = torch.repeat_interleave(this_mask, block_row, dim=0)
+    this_mask = torch.repeat_interleave(this_mask, block_col, dim=1)
+    mask[this_mask == 0] = 0
+  return mask
+
+
+class TestBlockPruning(TestCase):
+  def test_block_mask_matches_reference(self):
+    torch.manual_seed(0)
+    for shape, block_row, block_col in [((3072, 768), 32, 32), ((768, 768), 64, 768), ((96, 64), 8, 16), ((64, 96), 1, 1)]:
+      t = torch.randn(shape)
+      for amount in [0, 0.1, 0.5, 0.9, 7]:
+        for n in ['fro', 'nuc']:
+          if n == 'nuc' and block_row * block_col == 1:
+            continue
+          method = BlockPruningMethod(amount, block_row, block_col, n)
+          mask = method.compute_mask(t, torch.ones_like(t))
+          self.assertTrue(torch.equal(mask, reference_block_mask(t, amount, block_row, block_col, n)),
+                          f'{shape} {block_row}x{block_col} amount {amount} {n}')
+
+  def test_block_pruning_module(self):
+    torch.manual_seed(0)
+    linear = torch.nn.Linear(128, 64)
+    reference = reference_block_mask(linear.weight.detach(), 0.5, 16, 16)
+    block_pruning(linear, 'weight', 0.5, 16, 16)
+    self.assertTrue(torch.equal(linear.weight_mask, reference))
+
+  def test_global_block_pruning(self):
+    torch.manual_seed(0)
+    linears = [torch.nn.Linear(64, 32), torch.nn.Linear(32, 64)]
+    # a single parameter ranked globally is pruned like the per layer method
+    reference = reference_block_mask(linears[0].weight.detach(), 0.25, 8, 8)
+    global_block_pruning([(linears[0], 'weight')], 0.25, 8, 8)
+    self.assertTrue(torch.equal(linears[0].weight_mask, reference))
+
+    with torch.no_grad():
+      linears[1].weight.mul_(100)
+    global_block_pruning([(linears[1], 'weight'), (linears[0], 'weight')], 0.5, 8, 8)
+    # the large blocks all survive, half of the 64 blocks are pruned
+    self.assertEqual(int(linears[1].weight_mask.sum()), 32 * 64)
+    self.assertEqual(int((linears[0].weight_mask == 0).sum()) // 64, 32)
+
+
+class TestNMPruning(TestCase):
+  def test_nm_mask(self):
+    torch.manual_seed(0)
+    linear = torch.nn.Linear(64, 16)
+    nm_pruning(linear, 'weight', 2, 4)
+    groups = linear.weight_mask.view(16, 16, 4)
+    self.assertTrue(torch.equal(groups.sum(2), torch.full((16, 16), 2.)))
+    weight = linear.weight_orig.detach().abs().view(16, 16, 4)
+    kept = torch.where(groups == 1, weight, torch.full_like(weight, float('inf'))).min(2).values
+    pruned = torch.where(groups == 0, weight, torch.full_like(weight, -1.)).max(2).values
+    self.assertTrue(bool((kept >= pruned).all()))
+
+  def test_nm_pruning_applied_twice(self):
+    torch.manual_seed(0)
+    linear = torch.nn.Linear(64, 16)
+    nm_pruning(linear, 'weight', 2, 4)
+    mask = linear.weight_mask.clone()
+    # iterative pruning goes through a PruningContainer, the previous mask is kept
+    nm_pruning(linear, 'weight', 2, 4)
+    self.assertTrue(torch.equal(linear.weight_mask, mask))
+    nm_pruning(linear, 'weight', 1, 4)
+    self.assertTrue(torch.equal(linear.weight_mask.view(16, 16, 4).sum(2), torch.ones(16, 16)))
+    self.assertTrue(bool((linear.weight_mask <= mask).all()))
+
+    prune.remove(linear, 'weight')
+    self.assertEqual(int((linear.weight != 0).sum()), 16 * 16)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from unittest import TestCase
+
+import torch
+from transformers import BertConfig
+
+from supernet import SwiftBERT, SubnetEvaluator, extract_subnet, normalize_subnet
+
+
+class TestSubnet(TestCase):
+  SUBNETS = [[(4, 64), (4, 64)], [(2, 32), (4, 64)], [(2, 32), (1, 16)], [(3, 48), (2, 8)]]
+
+  def helper(self):
+    torch.manual_seed(0)
+    config = BertConfig(hidden_size=32, num_hidden_layers=2, num_attention_heads=4, intermediate_size=64, vocab_size=200)
+    config.layers = {str(i): {'heads': 4, 'intermediate_size': 64} for i in range(config.num_hidden_layers)}
+    model = SwiftBERT(config).eval()
+    dataset = []
+    for _ in range(10):
+      input_ids = torch.randint(103, 200, (12, ))
+      input_ids[0], input_ids[5], input_ids[9:] = 101, 102, 0
+      dataset.append({'input_ids': input_ids, 'labels': torch.randint(0, 2, (1, )).float()})
+    return model, dataset
+
+  def standalone_loss(self, model, dataset):
+    loss = 0
+    with torch.no_grad():
+      for x in dataset:
+        input_ids = x['input_ids'].unsqueeze(0)
+        attention_mask = torch.min(input_ids, torch.tensor(1))
+        token_type_ids = torch.zeros_like(input_ids)
+        token_type_ids[0, 6:] = 1
+        token_type_ids = token_type_ids * attention_mask
+        output = model(input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids, labels=x['labels'].unsqueeze(0))
+        loss += output.loss.item()
+    return loss / len(dataset)
+
+  def test_subnet_matches_extracted_model(self):
+    model, dataset = self.helper()
+    weights = {k: v.data_ptr() for k, v in model.state_dict().items()}
+    evaluator = SubnetEvaluator(model, dataset, num_samples=10, batch_size=4)
+    results = evaluator.evaluate(self.SUBNETS)
+
+    for subnet, result in zip(self.SUBNETS, results):
+      standalone = extract_subnet(model, subnet).eval()
+      self.assertAlmostEqual(result['loss'], self.standalone_loss(standalone, dataset), places=5)
+
+    # in place: the supernet weights are neither copied nor reallocated, and the full net is restored
+    self.assertEqual(weights, {k: v.data_ptr() for k, v in model.state_dict().items()})
+    self.assertEqual(results[0]['loss'], evaluator.evaluate([self.SUBNETS[0]])[0]['loss'])
+    self.assertAlmostEqual(results[0]['loss'], self.standalone_loss(model, dataset), places=5)
+
+  def test_rank(self):
+    model, dataset = self.helper()
+    evaluator = SubnetEvaluator(model, dataset, num_samples=10, batch_size=4)
+    ranking = evaluator.rank(self.SUBNETS)
+    self.assertEqual(sorted(x for x, _ in ranking), sorted(normalize_subnet(x) for x in self.SUBNETS))
+    self.assertEqual([x['loss'] for _, x in ranking], sorted(x['loss'] for _, x in ranking))
+
+
+if __name__ == "__main__":
+  unittest.main()
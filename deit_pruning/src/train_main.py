@@ -28,6 +28,9 @@ def sparse_argument_builder(args):
             dict[name] = item
     #print('build sparse',args.attention_threshold)
     print(args)
+    hidden_params = {}
+    set_dict(hidden_params, args.hidden_pruning_method, 'hidden_pruning_method')
+    set_dict(hidden_params, args.hidden_threshold, 'hidden_threshold')
     if not args.sparse_preset:
 
         #print('here',attention_threshold, args.attention_threshold,'\n',)
@@ -46,17 +49,34 @@ def sparse_argument_builder(args):
             attention_output_with_dense=0,
             regularization_final_lambda=20,
             dense_lambda=0.25,
-            regularization=None
+            regularization=None,
+            **hidden_params
         )
     print('here')
     with open(args.sparse_preset) as f:
         sparse_params = json.load(f)
         set_dict(sparse_params, args.layerwise_thresholds,
                  'layerwise_thresholds')
+        sparse_params.update(hidden_params)
         #set_dict(sparse_params, args.attention_threshold, 'attention_threshold')
         return SparseTrainingArguments(**sparse_params)
 
 
+def latency_table_from_predictor(predictor_path, num_layers):
+    import pickle
+    from nn_pruning.latency_regularizer import LatencyLookupTable
+    with open(predictor_path, 'rb') as f:
+        predictor = pickle.load(f)
+    # the latency_model.py regressor predicts us from the kept [head, ffn] fractions of every layer, it must have
+    # been fitted on models with the same number of layers (the SwiftBERT one has 4 layers, 8 features)
+    n_features = getattr(predictor, 'n_features_in_', None)
+    if n_features is not None and n_features != 2 * num_layers:
+        raise ValueError(f'Latency predictor {predictor_path} takes {n_features} features ({n_features // 2} layers), '
+                         f'the model has {num_layers} layers and needs a predictor fitted on {2 * num_layers} features.')
+    return LatencyLookupTable.from_predictor(lambda feature: predictor.predict([feature])[0], num_layers,
+                                             head_fractions=[0.25, 0.5, 0.75, 1.0], ffn_fractions=[x / 10 for x in range(1, 11)], scale=1e-3)
+
+
 # def override_sparse_training_arguments_attention_block_size(sparse_training_arguments: SparseTrainingArguments, deit_model_name):
 #   print('override sparse traning arguments attention block rows and columns according to attention head sizes')
 #   assert 'tiny' in deit_model_name or 'small' in deit_model_name or 'base' in deit_model_name
@@ -120,6 +140,10 @@ def main():
     parser.add_argument('--trainset_length', type=int, default=1281167)
     parser.add_argument("--layerwise_thresholds", type=str, default='-'.join(['h_0.5_d_0.5' for _ in range(12)]),
                         help='The final value of the masking threshold. When using topK, this is the final density. With sigmoied_threshold, a good choice is 0.1')
+    parser.add_argument("--hidden_pruning_method", type=str, default=None, choices=['disabled', 'topK', 'threshold', 'sigmoied_threshold'],
+                        help='Prune the hidden (embedding) dimension with one mask shared by the residual stream')
+    parser.add_argument("--hidden_threshold", type=float, default=None,
+                        help='The final hidden masking threshold. When using topK, this is the fraction of kept hidden dimensions.')
     parser.add_argument("--deepspeed", type=Path, default=None)
     parser.add_argument("--no_training", action='store_true',
                         help='Save model directly (no fine-tuning)')
@@ -154,6 +178,14 @@ def main():
     parser.add_argument('--distil_temperature', type=float, default=1.0)
     parser.add_argument('--alpha_distil', type=float, default=1.0,
                         help='loss = alpha_distil * distil_loss + (1 - alpha_distil) * student_loss')
+    # latency_args ----------------------------------
+    parser.add_argument('--latency_budget_ms', type=float, default=None,
+                        help='regularize the latency predicted from the mask scores towards this budget instead of the density, '
+                             'needs a threshold / sigmoied_threshold --sparse_preset')
+    parser.add_argument('--latency_lut', type=str, default=None,
+                        help='JSON latency lookup table, see nn_pruning.latency_regularizer.LatencyLookupTable')
+    parser.add_argument('--latency_predictor', type=str, default=None,
+                        help='pickled latency_model.py regressor, used instead of --latency_lut')
 
     # Reference:
     # - ImageNet1K has 1281167 training images, 1000 classes
@@ -313,6 +345,17 @@ def main():
         dist_print(is_main, 'Start building mpc')
         # print('before',args)
         sparse_args = sparse_argument_builder(args)
+        if args.latency_budget_ms is not None:
+            assert args.latency_lut or args.latency_predictor, 'latency regularization needs --latency_lut or --latency_predictor'
+            from nn_pruning.latency_regularizer import LatencyRegularizer
+            methods = [sparse_args.attention_pruning_method.split(':')[0], sparse_args.dense_pruning_method.split(':')[0]]
+            if any(x not in LatencyRegularizer.PRUNING_METHODS for x in methods):
+                # the default (no --sparse_preset) topK masks keep the per-layer densities, the latency term would move nothing
+                raise ValueError(f'--latency_budget_ms needs a --sparse_preset with {LatencyRegularizer.PRUNING_METHODS} pruning '
+                                 f'methods (e.g. sigmoied_threshold-hybrid), got {methods}.')
+            sparse_args.regularization = 'latency'
+            sparse_args.latency_budget_ms = args.latency_budget_ms
+            sparse_args.latency_lut = args.latency_lut
         # override_sparse_training_arguments_attention_block_size(sparse_args, args.deit_model_name)
         # print('sparse',sparse_args)
         # sys.exit()
@@ -327,6 +370,8 @@ def main():
             teacher_constructor=None
         )
        # print(model)
+        if args.latency_budget_ms is not None and args.latency_predictor:
+            mpc.latency_table = latency_table_from_predictor(args.latency_predictor, model.config.num_hidden_layers)
         mpc.patch_model(model)
         #print('patched model',model)
        # sys.exit()
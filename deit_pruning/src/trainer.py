@@ -64,7 +64,9 @@ class SparseWithoutTeacherTrainer(SparseTrainer, Trainer):
 
         # We don't use .loss here since the model may return tuples instead of ModelOutput.
         loss = outputs["loss"] if isinstance(outputs, dict) else outputs[0]
-        self.metrics["ce_loss"] += float(loss.mean())
+        self.add_metric("ce_loss", loss.mean())
+        if self.sparse_args.regularization in ['l1', 'l0', 'latency']:
+            loss = self.add_regularization_loss(model, loss)
         self.loss_counter += 1
         return (loss, outputs) if return_outputs else loss
 
@@ -88,10 +90,12 @@ class SparserWithTeacherTrainer(SparseTrainer, Trainer):
 
         # We don't use .loss here since the model may return tuples instead of ModelOutput.
         loss = outputs['loss'] if isinstance(outputs, dict) else outputs[0]
-        self.metrics['ce_loss'] += float(loss.mean())
+        self.add_metric('ce_loss', loss.mean())
         distil_loss = get_distil_loss(outputs.logits, teacher_logits, self.distil_temperature, 'kldiv')
-        self.metrics['distil_loss'] += float(distil_loss)
+        self.add_metric('distil_loss', distil_loss)
         loss = (1 - self.alpha_distil) * loss + self.alpha_distil * distil_loss
+        if self.sparse_args.regularization in ['l1', 'l0', 'latency']:
+            loss = self.add_regularization_loss(model, loss)
         self.loss_counter += 1
 
         return (loss, outputs) if return_outputs else loss
@@ -264,7 +264,8 @@ def show_deit_sparsity(model_path):
         return round(float(rv) * 100, 2)
 
     from transformers import AutoModelForImageClassification
-    model = AutoModelForImageClassification.from_pretrained(model_path)
+    from nn_pruning.modules.hidden_pruning import load_pruned_model
+    model = load_pruned_model(AutoModelForImageClassification, model_path)
     layers = model.vit.encoder.layer
 
     for i in range(len(layers)):
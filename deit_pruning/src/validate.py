@@ -1,13 +1,14 @@
 from nn_pruning.inference_model_patcher import optimize_model as nn_optimize
 from model import SwiftBERT
+from nn_pruning.modules.hidden_pruning import load_pruned_model
 from transformers import AutoModelForImageClassification
 import sys
-model = AutoModelForImageClassification.from_pretrained(sys.argv[1])
+model = load_pruned_model(AutoModelForImageClassification, sys.argv[1])
 # model = SwiftBERTOutput.from_pretrained('results/playground/swift_bert_final')
 original_params = model.num_parameters()
 print('=== model before optimize ===')
 print(model)
-model = nn_optimize(model, "dense")
+model = nn_optimize(model, "dense", clone=False)
 pruned_params = model.num_parameters()
 print("Original params:", original_params)
 print("After-pruned params:", pruned_params)
@@ -10,25 +10,96 @@ from utils import add_keras_input_layer
 
 
 
+def _peak_rss_mb():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _generate_one(name, builder, kwargs, output_tf_dir, output_tflite_dir, convert):
+    '''
+    build, save and optionally convert one model, then free it. Returns the peak RSS in MB.
+    '''
+    import gc
+    from utils import tf2tflite
+    model = builder(**kwargs)
+    dest = os.path.join(output_tf_dir, f'{name}.tf')
+    model.save(dest)
+    print(f'Save model to {dest}.')
+    del model
+    tf.keras.backend.clear_session()
+    gc.collect()
+    if convert:
+        tf2tflite(dest, os.path.join(output_tflite_dir, f'{name}.tflite'))
+    return _peak_rss_mb()
+
+
 class ModelGenerator():
+    '''
+    Models are registered either eagerly in self.model_dict, or lazily in self.model_specs by add_model().
+    A lazy model is only built when it is generated and is freed right after being saved and converted.
+    '''
     def __init__(self, output_tf_dir, output_tflite_dir):
         self.output_tf_dir = output_tf_dir
         self.output_tflite_dir = output_tflite_dir
         self.model_dict = {}
+        self.model_specs = {}
+
+    def add_model(self, name, builder, **kwargs):
+        # builder must be a module level function so that it can be sent to worker processes
+        self.model_specs[name] = (builder, kwargs)
 
     def save_model(self):
         for k, v in self.model_dict.items():
             dest = os.path.join(self.output_tf_dir, f'{k}.tf')
             v.save(dest)
             print(f'Save model to {dest}.')
+        self.generate(convert=False)
 
     def convert_to_tflite(self):
         from utils import tf2tflite
-        for k, v in self.model_dict.items():
+        for k in list(self.model_dict.keys()) + list(self.model_specs.keys()):
             src = os.path.join(self.output_tf_dir, f'{k}.tf')
             dst = os.path.join(self.output_tflite_dir, f'{k}.tflite')
             tf2tflite(src, dst)
 
+    def generate(self, convert=True, num_workers=1, memory_limit_mb=None):
+        '''
+        Generate the lazy models one by one, or in a process pool of num_workers. With memory_limit_mb, a new
+        model is only started when the running models plus one more, each estimated by the largest peak RSS
+        seen so far, fit in the limit. The first model runs alone to get the estimate.
+        '''
+        if num_workers <= 1:
+            for name, (builder, kwargs) in self.model_specs.items():
+                peak_rss = _generate_one(name, builder, kwargs, self.output_tf_dir, self.output_tflite_dir, convert)
+                print(f'{name} done, peak RSS {peak_rss:.0f} MB.')
+            return
+
+        import multiprocessing
+        import queue
+        pending = list(self.model_specs.items())
+        running = set()
+        estimate_mb = None
+        finished = queue.Queue()
+        # one task per child so that every task starts from a clean process and its peak RSS is its own
+        # (multiprocessing.Pool, ProcessPoolExecutor only has max_tasks_per_child from python 3.11 on)
+        with multiprocessing.get_context('spawn').Pool(num_workers, maxtasksperchild=1) as pool:
+            while pending or running:
+                while pending and len(running) < num_workers:
+                    if len(running) > 0 and (estimate_mb is None or
+                                             (memory_limit_mb is not None and (len(running) + 1) * estimate_mb > memory_limit_mb)):
+                        break
+                    name, (builder, kwargs) = pending.pop(0)
+                    pool.apply_async(_generate_one, (name, builder, kwargs, self.output_tf_dir, self.output_tflite_dir, convert),
+                                     callback=lambda peak_rss, name=name: finished.put((name, peak_rss, None)),
+                                     error_callback=lambda error, name=name: finished.put((name, None, error)))
+                    running.add(name)
+                name, peak_rss, error = finished.get()
+                running.remove(name)
+                if error is not None:
+                    raise RuntimeError(f'Failed to generate {name}.') from error
+                estimate_mb = peak_rss if estimate_mb is None else max(estimate_mb, peak_rss)
+                print(f'{name} done, peak RSS {peak_rss:.0f} MB, {len(pending)} models pending.')
+
 class FusionTestTransformer(ModelGenerator):
     def __init__(self, output_tf_dir, output_tflite_dir, l=197, h=768, i=3072) -> None:
         super().__init__(output_tf_dir, output_tflite_dir)
@@ -147,11 +218,17 @@ class FusionTestConv(ModelGenerator):
         return model
 
 
+def build_vit_pruned(hidden_size, num_heads, intermediate_size, prune_encoding):
+    model = ViT_Pruned(dim=hidden_size, depth=12, heads=num_heads, mlp_dim=intermediate_size,
+                       head_size=64, prune_encoding=prune_encoding)
+    return add_keras_input_layer(model, [3, 224, 224], 1)
+
+
 class PruneBenchmark(ModelGenerator):
     def __init__(self, output_tf_dir, output_tflite_dir):
         super().__init__(output_tf_dir, output_tflite_dir)
         self.num_heads_dict = dict(tiny=3, small=6, base=12)
-        # TODO: This impl is memory conusing. It is easy to run into OOM error.
+        # models are added lazily and built one at a time by generate()
         self._add_ffn_only_models()
         self._add_head_only_models()
         self._add_head_ffn_models()
@@ -163,10 +240,8 @@ class PruneBenchmark(ModelGenerator):
             return hidden_size, intermediate_size
 
     def _add_to_model_dict(self, type, prune_encoding, num_heads, intermediate_size, hidden_size):
-            model = ViT_Pruned(dim=hidden_size, depth=12, heads=num_heads, mlp_dim=intermediate_size,
-                                head_size=64, prune_encoding=prune_encoding)
-            model = add_keras_input_layer(model, [3, 224, 224], 1)
-            self.model_dict[f'deit_{type}_b1_{prune_encoding}'] = model
+            self.add_model(f'deit_{type}_b1_{prune_encoding}', build_vit_pruned, hidden_size=hidden_size, num_heads=num_heads,
+                           intermediate_size=intermediate_size, prune_encoding=prune_encoding)
 
     def _add_ffn_only_models(self):
         for type in ['tiny', 'small', 'base']:
@@ -253,10 +328,13 @@ def ncs2_test(parser: argparse.ArgumentParser):
 def prune_benchmark(parser: argparse.ArgumentParser):
     parser.add_argument('--output_tf_dir', required=True, type=str, help='output tf saved model dir')
     parser.add_argument('--output_tflite_dir', required=True, type=str, help='output tflite model dir')
+    parser.add_argument('--convert', action='store_true', help='also convert each model to tflite right after saving it')
+    parser.add_argument('--num_workers', default=1, type=int, help='number of models to generate in parallel')
+    parser.add_argument('--memory_limit_mb', default=None, type=float, help='memory ceiling of all parallel workers')
     args = parser.parse_args()  
 
     prune_benchmarker = PruneBenchmark(args.output_tf_dir, args.output_tflite_dir)
-    prune_benchmarker.save_model()
+    prune_benchmarker.generate(convert=args.convert, num_workers=args.num_workers, memory_limit_mb=args.memory_limit_mb)
 
 
 def quant_op_test(parser: argparse.ArgumentParser):
@@ -404,11 +482,88 @@ def quant_op_test(parser: argparse.ArgumentParser):
     #     )
 
         
+def gelu_variant_test(parser: argparse.ArgumentParser):
+    parser.add_argument('--output_tf_dir', required=True, type=str, help='output tf saved model dir')
+    parser.add_argument('--output_tflite_dir', required=True, type=str, help='output tflite model dir')
+    parser.add_argument('--type', required=True, choices=['deit_tiny', 'deit_small', 'deit_base', 't2t_vit_7', 't2t_vit_10', 't2t_vit_12', 't2t_vit_14'])
+    parser.add_argument('--variants', default='tanh_pow,tanh,erf,hard,relu', type=str, help='comma separated GELU variants')
+    parser.add_argument('--serial_number', default=None, type=str, help='phone serial number, skip latency test if not set')
+    parser.add_argument('--num_threads', default=1, type=int)
+    parser.add_argument('--num_runs', default=50, type=int)
+    parser.add_argument('--taskset_mask', default='70', type=str)
+    parser.add_argument('--data_path', default=None, type=str, help='imagenet path, skip accuracy test if not set')
+    parser.add_argument('--relu_state_dict', default=None, type=str, help='deit state_dict fine-tuned by nn_pruning gelu2relu, required for relu accuracy')
+    parser.add_argument('--output_csv', default=None, type=str, help='save the report to this csv file')
+    args = parser.parse_args()
+
+    # Accuracy is measured on the pretrained torch DeiT with nn.GELU replaced by each variant,
+    # since the tf models are randomly initialized and only used for op counting and latency.
+    from modeling.layers.activation import get_gelu
+    from utils import tf2tflite, get_tflite_op_counts
+    variants = args.variants.split(',')
+
+    if args.type.startswith('deit'):
+        from modeling.models import vit
+        get_model = lambda activation: add_keras_input_layer(getattr(vit, f'get_{args.type}')(activation=activation), [3, 224, 224], batch_size=1)
+    else:
+        from modeling.models import t2t_vit
+        get_model = lambda activation: add_keras_input_layer(getattr(t2t_vit, f'get_{args.type}')(builtin_only=True, activation=activation), [224, 224, 3], batch_size=1)
+
+    if args.serial_number:
+        from benchmark.ADBConnect import ADBConnect
+        from benchmark.run_on_device import run_on_android
+        adb = ADBConnect(args.serial_number)
+
+    report = []
+    for variant in variants:
+        name = f'{args.type}_gelu_{variant}'
+        tf_path = os.path.join(args.output_tf_dir, f'{name}.tf')
+        tflite_path = os.path.join(args.output_tflite_dir, f'{name}.tflite')
+        get_model(get_gelu(variant)).save(tf_path)
+        tf2tflite(tf_path, tflite_path, use_flex=variant == 'erf')
+
+        op_counts = get_tflite_op_counts(tflite_path)
+        result = dict(variant=variant, num_ops=sum(op_counts.values()), op_counts=dict(op_counts), latency_ms=None, std_ms=None, accuracy=None)
+
+        if args.serial_number:
+            std_ms, avg_ms, _ = run_on_android(tflite_path, adb, num_threads=args.num_threads, num_runs=args.num_runs, taskset_mask=args.taskset_mask)
+            result['latency_ms'], result['std_ms'] = avg_ms, std_ms
+
+        if args.data_path and args.type.startswith('deit') and (variant != 'relu' or args.relu_state_dict):
+            import torch
+            from utils import get_torch_deit, load_torch_deit_state_dict, build_eval_dataset, to_data_loader, evaluate_torch
+            from modeling.torch_layers.activation import replace_gelu
+            model = get_torch_deit(args.type.replace('deit_', ''), pretrained=True)
+            if variant == 'relu':
+                load_torch_deit_state_dict(model, args.relu_state_dict)
+            replace_gelu(model, variant)
+            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+            dataset, _ = build_eval_dataset(args.data_path)
+            result['accuracy'] = evaluate_torch(model.to(device), to_data_loader(dataset, 50, 8), device) * 100
+        report.append(result)
+
+    print(f'{"variant":<10}{"ops":>6}{"latency(ms)":>14}{"std(ms)":>10}{"acc(%)":>10}')
+    for r in report:
+        fmt = lambda x: 'N/A' if x is None else f'{x:.2f}'
+        print(f'{r["variant"]:<10}{r["num_ops"]:>6}{fmt(r["latency_ms"]):>14}{fmt(r["std_ms"]):>10}{fmt(r["accuracy"]):>10}')
+    for r in report:
+        print(r['variant'], r['op_counts'])
+
+    if args.output_csv:
+        import csv
+        with open(args.output_csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(report[0].keys()))
+            writer.writeheader()
+            writer.writerows(report)
+        print(f'Save report to {args.output_csv}.')
+
+
 function_dict = {
     'fusion_test': fusion_test,
     'ncs2_test': ncs2_test,
     'prune_benchmark': prune_benchmark,
-    'quant_op_test': quant_op_test
+    'quant_op_test': quant_op_test,
+    'gelu_variant_test': gelu_variant_test
 }
 
 if __name__ == '__main__':
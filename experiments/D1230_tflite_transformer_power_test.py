@@ -2,77 +2,25 @@ import argparse
 import re
 import os
 import sys
-import subprocess
-import re
 from collections import defaultdict
 import time 
-import threading
-import csv 
-
-import numpy as np
 
 sys.path.insert(0, f'{os.path.dirname(sys.argv[0])}/..')
+from benchmark.ADBConnect import ADBConnect
+from benchmark.power import PowerSampler, compute_energy, get_power_mw, get_timed_window
+from benchmark.thermal import ThermalGuard
 
 RESULT_CSV_DIR = 'logs/D1230_transformer_power_test'
 USB_POWER_THRESHOLD = 2300
 
-class ADB:
-    def __init__(self, serino):
-        self.serino = serino
-    
-    def push(self, src, dst):
-        subprocess.run(f'adb -s {self.serino} push {src} {dst}', shell=True)
-
-    def pull(self, src, dst):
-        subprocess.run(f'adb -s {self.serino} pull {src} {dst}', shell=True)
-
-    def remove(self, dst):
-        subprocess.run(f'adb -s {self.serino} shell rm {dst}', shell=True)
-
-    def fetch_power(self):
-        battery_current_str = self.run_cmd('taskset f cat /sys/class/power_supply/battery/current_now', mute=True)
-        battery_voltage_str = self.run_cmd('taskset f cat /sys/class/power_supply/battery/voltage_now', mute=True)
-        usb_current_str = self.run_cmd('taskset f cat /sys/class/power_supply/usb/input_current_now', mute=True)
-        usb_voltage_str = self.run_cmd('taskset f cat /sys/class/power_supply/usb/voltage_now', mute=True)
-        bc = float(battery_current_str) / 1e3 # <>e-6A / 1000 = <>mA
-        bv = float(battery_voltage_str) / 1e6 # <>e-6V / 1e6 = <>V
-        uc = float(usb_current_str) / 1e3
-        uv = float(usb_voltage_str) / 1e6
-        return bc, bv, uc, uv
-
-    def run_cmd(self, cmd, mute=False):
-        if not mute:
-            print(cmd)
-        result = subprocess.check_output(f'adb -s {self.serino} shell {cmd}', shell=True).decode('utf-8')
-        if not mute:
-            print(result)
-        return result
-
-
-stop_threads = False
-def fetch_power(adb: ADB, delay: float, result_csv_path: str):
-        try:
-            f = open(result_csv_path, 'w')
-            f.write('Battery Power(mW), USB Power(mW), Battery Current(mA), Battery Voltage(V), USB Current(mA), USB Voltage(V)\n')
-            while True:
-                # time.sleep(delay) # Force no delay
-                bc, bv, uc, uv = adb.fetch_power()
-                bp = bc * bv
-                up = uc * uv
-                f.write(', '.join([str(round(x, 2)) for x in [bp, up, bc, bv, uc, uv]]))
-                f.write('\n')
-
-                global stop_threads
-                if stop_threads:
-                    break
-        finally:
-            f.close()
-
-
 class TfliteTester:
-    def __init__(self, adb: ADB, model_zoo_dir: str):
+    def __init__(self, adb: ADBConnect, model_zoo_dir: str, sample_interval: float, min_usb_power: float):
         self.adb = adb
         self.model_zoo_dir = model_zoo_dir
+        self.sampler = PowerSampler(adb, interval=sample_interval)
+        # cores 4-6 of taskset 70
+        self.thermal_guard = ThermalGuard(adb, cpus=[4, 5, 6])
+        self.min_usb_power = min_usb_power
 
     def _fetch_latency(self, text: str):
         match = re.findall(r'avg=[0-9e+.]+ ', text)[-1]
@@ -84,45 +32,34 @@ class TfliteTester:
 
     def _benchmark_single(self, model_path):
         file_name = os.path.basename(model_path)
-        dst_path = f'/sdcard/{file_name}'   
-        avg_ms = 0.0
-        self.adb.push(model_path, f'/sdcard/{file_name}')
+        dst_path = f'/sdcard/{file_name}'
+        self.adb.push_files(model_path, dst_path)
         result_csv_path = self._get_result_csv_path(model_path)
         try:
             output_text_first = self.adb.run_cmd(
                 f'taskset 70 /data/local/tmp/benchmark_model_plus_flex_r27 --graph={dst_path} --num_runs=5 --warmup_runs=5 --use_xnnpack=false --num_threads=1',
-                mute=True)
+                no_root=True)
             avg_ms_first = self._fetch_latency(output_text_first)
             num_runs_for_one_minute = int(1000 * 60 / avg_ms_first + 0.5)
             num_runs = max(num_runs_for_one_minute, 10)
             warmup_runs = num_runs // 2
-            time.sleep(15)
 
-            global stop_threads
-            stop_threads = False
-            power_fetcher = threading.Thread(target=fetch_power, args=(self.adb, 0.001, result_csv_path))
-            power_fetcher.start()
+            # idle samples before and after the run give the baseline power
+            self.sampler.start()
             time.sleep(15)
-            output_text = self.adb.run_cmd(
-                f'taskset 70 /data/local/tmp/benchmark_model_plus_flex_r27 --graph={dst_path} --num_runs={num_runs} --warmup_runs={warmup_runs} --use_xnnpack=false --num_threads=1')
+            # waits until the device is back to its baseline temperature and frequency caps instead of a fixed sleep
+            (output_text, begin, end), thermal_record = self.thermal_guard.run(lambda: self.sampler.run_marked(
+                f'taskset 70 /data/local/tmp/benchmark_model_plus_flex_r27 --graph={dst_path} --num_runs={num_runs} --warmup_runs={warmup_runs} --use_xnnpack=false --num_threads=1'))
             time.sleep(15)
-            stop_threads = True
-            power_fetcher.join()
-        except:
-            pass
-        
-        self.adb.remove(dst_path)
-        avg_ms = self._fetch_latency(output_text)
-        return avg_ms
+        finally:
+            samples = self.sampler.stop(result_csv_path) if self.sampler.running else []
+            self.adb.run_cmd(f'rm {dst_path}', no_root=True)
 
-    def _get_battery_power(self, result_csv_path: str):
-        battery_power_list = []
-        with open(result_csv_path) as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            for row in csv_reader:
-                if len(row) > 1 and re.match(r'\d*\.?\d+', row[0]) and float(row[1]) > USB_POWER_THRESHOLD:
-                    battery_power_list.append(float(row[0]))
-        return np.average(battery_power_list)
+        avg_ms = self._fetch_latency(output_text)
+        # battery readings are only used while the usb supply powers the phone
+        samples = [x for x in samples if get_power_mw(x, 'usb') > self.min_usb_power]
+        energy = compute_energy(samples, *get_timed_window(begin, end, num_runs, avg_ms), num_runs, busy_window=(begin, end))
+        return avg_ms, energy, thermal_record
 
     def _benchmark(self, ):
         print('===== Benchmarking =====')
@@ -131,20 +68,23 @@ class TfliteTester:
 
         for model_name in name_list:
             model_path = os.path.join(self.model_zoo_dir, model_name)
-            avg_ms = self._benchmark_single(model_path)
+            avg_ms, energy, thermal_record = self._benchmark_single(model_path)
             result_dict[model_name]['avg_ms'] = round(avg_ms, 2)
-
-            result_csv_path = self._get_result_csv_path(model_path)
-            battery_power = self._get_battery_power(result_csv_path)
-            result_dict[model_name]['battery_power'] = round(battery_power, 1)
+            result_dict[model_name]['battery_power'] = round(energy['avg_power_mw'], 1)
+            result_dict[model_name]['mj_per_inference'] = round(energy['mj_per_inference'], 2)
+            result_dict[model_name]['net_mj_per_inference'] = round(energy['net_mj_per_inference'], 2)
+            result_dict[model_name]['cooldown_s'] = round(thermal_record['cooldown_s'], 1)
+            result_dict[model_name]['throttled'] = thermal_record['throttled']
         print('===============================')
         print('          SUMMARY')
         print('===============================')
         print(*name_list)
-        for target in ['avg_ms', 'battery_power']:
+        for target in ['avg_ms', 'battery_power', 'mj_per_inference', 'net_mj_per_inference', 'cooldown_s', 'throttled']:
             print(target, *[result_dict[k][target] for k in name_list])
 
     def run(self, ):
+        # before the first probe run, the baseline of every later cool-down must be the idle device
+        self.thermal_guard.calibrate()
         self._benchmark()
 
 
@@ -152,10 +92,12 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--model_zoo_dir', default='models/tflite_model/project1_model_zoo_fp32', help='root dir to save tf and tflite models')
     parser.add_argument('--serial_number', default='98281FFAZ009SV', help='phone serial number')
+    parser.add_argument('--sample_interval', default=0.01, type=float, help='seconds between two power samples on the device')
+    parser.add_argument('--min_usb_power', default=USB_POWER_THRESHOLD, type=float, help='drop samples whose usb power (mW) is not above this')
     args = parser.parse_args()
 
-    adb = ADB(args.serial_number)
-    tester = TfliteTester(adb, args.model_zoo_dir)
+    adb = ADBConnect(args.serial_number)
+    tester = TfliteTester(adb, args.model_zoo_dir, args.sample_interval, args.min_usb_power)
     tester.run()
 
 if __name__ == '__main__':
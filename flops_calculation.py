@@ -258,13 +258,15 @@ class PrunedViTHparams(ViTHparams):
         super().__init__(heads=num_heads_per_layer, head_size=head_size, i=intermediate_size, **kwargs)
 
     @staticmethod
-    def get_pruned_deit_flops(type, num_heads_per_layer, ffn_sparsity_per_layer):
+    def get_pruned_deit_flops(type, num_heads_per_layer, ffn_sparsity_per_layer, hidden_size=None):
+        # hidden_size: width of the residual stream after hidden dimension pruning (len(config.hidden_kept_dims)),
+        # the head size and the unpruned intermediate size still follow the original model
         assert type in ['tiny', 'small', 'base']
         hidden_size_dict = {'tiny': 192, 'small': 384, 'base': 768}
         h = hidden_size_dict[type]
         return PrunedViTHparams(num_heads_per_layer=num_heads_per_layer,
                                 ffn_sparsity_per_layer=ffn_sparsity_per_layer, 
-                                h=h, l=12
+                                h=h if hidden_size is None else hidden_size, i=h * 4, l=12
         ).get_infer_flops()
 
     @staticmethod
@@ -309,6 +311,17 @@ class PrunedViTHparams(ViTHparams):
         print('small head4', small_flops_list[:4])
         print('small head5', small_flops_list[4:])
 
+        print('** 4) only prune hidden **')
+        hidden_size_dict = {'tiny': 192, 'small': 384, 'base': 768}
+        for type in ['tiny', 'small', 'base']:
+            flops_list = []
+            num_heads = type2heads_dict[type]
+            for kept in range(100, 40, -10):
+                hidden_size = hidden_size_dict[type] * kept // 100
+                flops = PrunedViTHparams.get_pruned_deit_flops(type, num_heads, 0, hidden_size=hidden_size)
+                flops_list.append(round(flops / 2e6, 2))
+            print(type, flops_list)
+
 
 class SwinFlops:
     def __init__(self, depths: List, base_dim: int,  mlp_ratio: float, base_heads: int, image_size=224, patch_size=4, window_size=7, num_stages=4, num_classes=1000) -> None:
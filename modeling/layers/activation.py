@@ -12,4 +12,35 @@ def gelu(x):
     """
     cdf = 0.5 * (1.0 + tf.tanh(
         (math.sqrt(2 / math.pi) * (x + 0.044715 * tf.pow(x, 3)))))
-    return x * cdf
\ No newline at end of file
+    return x * cdf
+
+def gelu_tanh(x):
+    """tanh approximation with x * x * x, which lowers to MUL instead of POW in TFLite."""
+    cdf = 0.5 * (1.0 + tf.tanh(
+        (math.sqrt(2 / math.pi) * (x + 0.044715 * x * x * x))))
+    return x * cdf
+
+
+def gelu_erf(x):
+    """Exact GELU. Erf has no TFLite builtin kernel and needs the Flex delegate."""
+    return 0.5 * x * (1.0 + tf.math.erf(x / math.sqrt(2.0)))
+
+
+def gelu_hard(x):
+    """Piecewise linear GELU: x * relu6(1.702 * x + 3) / 6, the hard-swish form of the sigmoid approximation."""
+    return x * tf.nn.relu6(1.702 * x + 3.) / 6.
+
+
+GELU_VARIANTS = {
+    'tanh_pow': gelu,
+    'tanh': gelu_tanh,
+    'erf': gelu_erf,
+    'hard': gelu_hard,
+    'relu': tf.nn.relu,
+}
+
+
+def get_gelu(variant='tanh_pow'):
+    if variant not in GELU_VARIANTS:
+        raise ValueError(f'GELU variant {variant} not supported. Supported variants: {list(GELU_VARIANTS.keys())}')
+    return GELU_VARIANTS[variant]
@@ -3,9 +3,9 @@ from .activation import gelu
 
 
 class FeedForward(tf.keras.Model):
-    def __init__(self, dim, hidden_dim):
+    def __init__(self, dim, hidden_dim, activation=gelu):
         super().__init__()
-        self.net = tf.keras.Sequential([tf.keras.layers.Dense(hidden_dim, activation=gelu),
+        self.net = tf.keras.Sequential([tf.keras.layers.Dense(hidden_dim, activation=activation),
                                         tf.keras.layers.Dense(dim)])
 
     def call(self, x):
@@ -5,15 +5,16 @@ from .residual import Residual
 from .norm import LayerNorm
 from .attention import Attention
 from .ffn import FeedForward
+from .activation import gelu
 
 class TransformerEncoderBlock(tf.keras.Model):
-    def __init__(self, hidden_size, num_layers, num_heads, intermediate_size, norm_first=True):
+    def __init__(self, hidden_size, num_layers, num_heads, intermediate_size, norm_first=True, activation=gelu):
         super().__init__()
         layers = []
         for _ in range(num_layers):
             layers.extend([
                 LayerNorm(Residual(Attention(hidden_size, num_heads=num_heads)), pre=norm_first),
-                LayerNorm(Residual(FeedForward(hidden_size, intermediate_size)), pre=norm_first)
+                LayerNorm(Residual(FeedForward(hidden_size, intermediate_size, activation=activation)), pre=norm_first)
             ])
         self.net = tf.keras.Sequential(layers)
 
@@ -22,13 +23,13 @@ class TransformerEncoderBlock(tf.keras.Model):
 
 
 class  TransformerEncoderBlock_Pruned(tf.keras.Model):
-    def __init__(self, hidden_size, num_layers, num_remain_heads_list, intermediate_size_list, head_size=64, norm_first=True):
+    def __init__(self, hidden_size, num_layers, num_remain_heads_list, intermediate_size_list, head_size=64, norm_first=True, activation=gelu):
         super().__init__()
         layers = []
         for i in range(num_layers):
             layers.extend([
                 LayerNorm(Residual(Attention(hidden_size, num_heads=num_remain_heads_list[i], h_k=head_size)), pre=norm_first),
-                LayerNorm(Residual(FeedForward(hidden_size, intermediate_size_list[i])), pre=norm_first)
+                LayerNorm(Residual(FeedForward(hidden_size, intermediate_size_list[i], activation=activation)), pre=norm_first)
             ])
         self.net = tf.keras.Sequential(layers)
 
@@ -39,9 +40,11 @@ class  TransformerEncoderBlock_Pruned(tf.keras.Model):
 class TokenPerformer(tf.keras.Model):
     '''
     T2T-Module performer for T2T-ViT
+    builtin_only: replace einsums with tf.matmul, which lowers to TFLite BATCH_MATMUL instead of FlexEinsum
     '''
-    def __init__(self, head_size, num_heads, kernel_ratio=0.5, dp1=0.1, dp2=0.1):
+    def __init__(self, head_size, num_heads, kernel_ratio=0.5, dp1=0.1, dp2=0.1, builtin_only=False, activation=gelu):
         super().__init__()
+        self.builtin_only = builtin_only
         self.hidden_size = head_size * num_heads
         self.kqv = tf.keras.layers.Dense(self.hidden_size * 3)
         self.dp = tf.keras.layers.Dropout(dp1)
@@ -52,7 +55,7 @@ class TokenPerformer(tf.keras.Model):
         self.epsilon = 1e-8  # for stable in division   
 
         self.mlp = tf.keras.Sequential([
-            FeedForward(self.hidden_size, self.hidden_size),
+            FeedForward(self.hidden_size, self.hidden_size, activation=activation),
             tf.keras.layers.Dropout(dp2)
         ])
 
@@ -74,6 +77,9 @@ class TokenPerformer(tf.keras.Model):
         # SM(x, y) = E_w[exp(w^T x - |x|/2) exp(w^T y - |y|/2)]
         # therefore return exp(w^Tx - |x|/2)/sqrt(m)
         xd = tf.math.reduce_sum(x * x, axis=-1, keepdims=True)
+        if self.builtin_only:
+            wtd = tf.matmul(x, self.w, transpose_b=True)
+            return tf.exp(wtd - xd / 2) / math.sqrt(self.m)
         broadcast_shape = tf.where([True, True, False], tf.shape(xd), [0, 0, self.m])
         xd = tf.broadcast_to(xd, broadcast_shape) / 2
         wtd = tf.einsum('bti,mi->btm', tf.convert_to_tensor(x, dtype=tf.float32), self.w)
@@ -83,6 +89,12 @@ class TokenPerformer(tf.keras.Model):
     def single_attn(self, x):
         k, q, v = tf.split(self.kqv(x), 3, axis=-1)
         kp, qp = self.prm_exp(k), self.prm_exp(q) # (B, T, m), (B, T, m)
+        if self.builtin_only:
+            D = tf.matmul(qp, tf.math.reduce_sum(kp, axis=1, keepdims=True), transpose_b=True) # (B, T, m) * (B, 1, m)^T -> (B, T, 1)
+            kptv = tf.matmul(v, kp, transpose_a=True) # (B, emb, m)
+            y = tf.matmul(qp, kptv, transpose_b=True) / (D + self.epsilon) # (B, T, emb) / Diag
+            y = v + self.dp(self.attn_output(y))
+            return y
         D = tf.einsum('bti,bi->bt', qp, tf.math.reduce_sum(kp, axis=1)) # (B, T, m) * (B, m) -> (B, T, 1)
         D = tf.expand_dims(D, axis=2)
         kptv = tf.einsum('bin,bim->bnm', tf.convert_to_tensor(v, dtype=tf.float32), kp) # (B, emb, m)
@@ -2,25 +2,53 @@ import tensorflow as tf
 import numpy as np
 from modeling.layers.transformer_encoder import TokenPerformer, TransformerEncoderBlock
 from modeling.layers.embedding import get_sinusoid_encoding
+from modeling.layers.activation import gelu
 
 
 class tf_Unfold(tf.keras.Model):
     '''
     tensorflow implementation of torch.nn.Unfold
     expect input image to be channel-last
+    builtin_only: lower to a strided CONV_2D with an identity kernel instead of
+    tf.image.extract_patches, which is only available through the Flex delegate
     '''
-    def __init__(self, kernel_size, stride, padding, channel_last=False, exact_same_as_torch=False):
+    def __init__(self, kernel_size, stride, padding, channel_last=False, exact_same_as_torch=False, builtin_only=False):
         super().__init__()
+        self.kernel_size = kernel_size
+        self.stride = stride
         self.kernel_sizes = [1, kernel_size, kernel_size, 1]
         self.strides = [1, stride, stride, 1]
         self.paddings = tf.constant([[0, 0], [padding, padding], [padding, padding], [0, 0]])
         self.channel_last = channel_last
         self.exact_same_as_torch = exact_same_as_torch
-        
+        self.builtin_only = builtin_only
+
+    def build(self, input_shape):
+        if self.builtin_only:
+            self.identity_kernel = tf.constant(self._identity_kernel(input_shape[-1]))
+        super().build(input_shape)
+
+    def _identity_kernel(self, channels):
+        # kernel[i, j, c, o] = 1 copies pixel (i, j) of channel c to output channel o.
+        # extract_patches orders a patch as (kh, kw, c), torch.nn.Unfold as (c, kh, kw).
+        k = self.kernel_size
+        kernel = np.zeros([k, k, channels, k * k * channels], dtype=np.float32)
+        for i in range(k):
+            for j in range(k):
+                for c in range(channels):
+                    if self.exact_same_as_torch:
+                        o = c * k * k + i * k + j
+                    else:
+                        o = (i * k + j) * channels + c
+                    kernel[i, j, c, o] = 1.
+        return kernel
+
     def call(self, x):
         x = tf.pad(x, self.paddings)
 
-        if self.exact_same_as_torch:
+        if self.builtin_only:
+            x = tf.nn.conv2d(x, self.identity_kernel, strides=self.strides, padding='VALID')
+        elif self.exact_same_as_torch:
             x = [tf.image.extract_patches(
                     x[:, :, :, i: i + 1],
                     sizes=self.kernel_sizes,
@@ -44,15 +72,15 @@ class T2T_module(tf.keras.Model):
     """
     Tokens-to-Token encoding module
     """
-    def __init__(self, image_size=224, tokens_type='performer', in_channels=3, embedding_size=768, token_size=64):
+    def __init__(self, image_size=224, tokens_type='performer', in_channels=3, embedding_size=768, token_size=64, builtin_only=False, activation=gelu):
         super().__init__()
         if tokens_type == 'performer':
-            self.soft_split0 = tf_Unfold(kernel_size=7, stride=4, padding=2, channel_last=True)
-            self.soft_split1 = tf_Unfold(kernel_size=3, stride=2, padding=1, channel_last=True)
-            self.soft_split2 = tf_Unfold(kernel_size=3, stride=2, padding=1, channel_last=True)
+            self.soft_split0 = tf_Unfold(kernel_size=7, stride=4, padding=2, channel_last=True, builtin_only=builtin_only)
+            self.soft_split1 = tf_Unfold(kernel_size=3, stride=2, padding=1, channel_last=True, builtin_only=builtin_only)
+            self.soft_split2 = tf_Unfold(kernel_size=3, stride=2, padding=1, channel_last=True, builtin_only=builtin_only)
 
-            self.performer1 = TokenPerformer(head_size=token_size, num_heads=1, kernel_ratio=0.5)
-            self.performer2 = TokenPerformer(head_size=token_size, num_heads=1, kernel_ratio=0.5)
+            self.performer1 = TokenPerformer(head_size=token_size, num_heads=1, kernel_ratio=0.5, builtin_only=builtin_only, activation=activation)
+            self.performer2 = TokenPerformer(head_size=token_size, num_heads=1, kernel_ratio=0.5, builtin_only=builtin_only, activation=activation)
             self.project = tf.keras.layers.Dense(embedding_size)
 
         else:
@@ -91,13 +119,14 @@ class T2T_module(tf.keras.Model):
 class T2T_ViT(tf.keras.Model):
     def __init__(self, image_size=224, tokens_type='performer', in_channels=3, num_classes=1000, hidden_size=768, depth=12,
                  num_heads=12, mlp_ratio=4., token_size=64, qkv_bias=False, qk_scale=None, drop_rate=0., attn_drop_rate=0.,
-                 drop_path_rate=0.):
+                 drop_path_rate=0., builtin_only=False, activation=gelu):
         super().__init__()
         self.num_classes = num_classes
         self.num_features = self.hidden_size = hidden_size  # num_features for consistency with other models
 
         self.tokens_to_token = T2T_module(image_size=image_size, tokens_type=tokens_type, 
-                                          in_channels=in_channels, embedding_size=hidden_size, token_size=token_size)
+                                          in_channels=in_channels, embedding_size=hidden_size, token_size=token_size,
+                                          builtin_only=builtin_only, activation=activation)
         num_patches = self.tokens_to_token.num_patches
 
         self.cls_tokens = self.add_weight('cls_tokens', shape=[1, 1, hidden_size],
@@ -107,7 +136,8 @@ class T2T_ViT(tf.keras.Model):
         self.pos_embedding.assign(tf.squeeze(get_sinusoid_encoding(num_patches + 1, hidden_size)))
 
         self.transformer_encoders = TransformerEncoderBlock(hidden_size=hidden_size, num_layers=depth, num_heads=num_heads, 
-                                                            intermediate_size=int(mlp_ratio * hidden_size), norm_first=True) 
+                                                            intermediate_size=int(mlp_ratio * hidden_size), norm_first=True,
+                                                            activation=activation)
         self.norm = tf.keras.layers.LayerNormalization(epsilon=1e-5)
 
         # Classifier head
@@ -135,14 +165,14 @@ class T2T_ViT(tf.keras.Model):
         return x
 
 
-def get_t2t_vit_7():
-    return T2T_ViT(hidden_size=256, depth=7, num_heads=4, mlp_ratio=2)
+def get_t2t_vit_7(**kwargs):
+    return T2T_ViT(hidden_size=256, depth=7, num_heads=4, mlp_ratio=2, **kwargs)
 
-def get_t2t_vit_10():
-    return T2T_ViT(hidden_size=256, depth=10, num_heads=4, mlp_ratio=2)
+def get_t2t_vit_10(**kwargs):
+    return T2T_ViT(hidden_size=256, depth=10, num_heads=4, mlp_ratio=2, **kwargs)
 
-def get_t2t_vit_12():
-    return T2T_ViT(hidden_size=256, depth=12, num_heads=4, mlp_ratio=2)
+def get_t2t_vit_12(**kwargs):
+    return T2T_ViT(hidden_size=256, depth=12, num_heads=4, mlp_ratio=2, **kwargs)
 
-def get_t2t_vit_14():
-    return T2T_ViT(hidden_size=384, depth=14, num_heads=6, mlp_ratio=3)
\ No newline at end of file
+def get_t2t_vit_14(**kwargs):
+    return T2T_ViT(hidden_size=384, depth=14, num_heads=6, mlp_ratio=3, **kwargs)
\ No newline at end of file
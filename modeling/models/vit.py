@@ -8,7 +8,7 @@ from modeling.layers.activation import gelu
 
 class ViT(tf.keras.Model):
 
-    def __init__(self, *, image_size=224, patch_size=16, num_classes=1000, dim=768, depth=12, heads=12, mlp_dim=3072):
+    def __init__(self, *, image_size=224, patch_size=16, num_classes=1000, dim=768, depth=12, heads=12, mlp_dim=3072, activation=gelu):
         super().__init__()
         assert image_size % patch_size == 0, 'image dimensions must be divisible by the patch size'
         num_patches = (image_size // patch_size) ** 2
@@ -31,11 +31,11 @@ class ViT(tf.keras.Model):
         self.rearrange = Rearrange(
             'b c (h p1) (w p2) -> b (h w) (p1 p2 c)', p1=self.patch_size, p2=self.patch_size)
 
-        self.transformer = TransformerEncoderBlock(dim, depth, heads, mlp_dim)
+        self.transformer = TransformerEncoderBlock(dim, depth, heads, mlp_dim, activation=activation)
 
         self.to_cls_token = tf.identity
 
-        self.mlp_head = tf.keras.Sequential([tf.keras.layers.Dense(mlp_dim, activation=gelu),
+        self.mlp_head = tf.keras.Sequential([tf.keras.layers.Dense(mlp_dim, activation=activation),
                                              tf.keras.layers.Dense(num_classes)])
 
     @tf.function
@@ -57,7 +57,7 @@ class ViT(tf.keras.Model):
 
 class ViT_Pruned(ViT):
 
-    def __init__(self, *, image_size=224, patch_size=16, num_classes=1000, dim=768, depth=12, heads=12, mlp_dim=3072, head_size=64, prune_encoding='all_head12_ffn1.0'):
+    def __init__(self, *, image_size=224, patch_size=16, num_classes=1000, dim=768, depth=12, heads=12, mlp_dim=3072, head_size=64, prune_encoding='all_head12_ffn1.0', activation=gelu):
         prune_setting, num_remain_heads, ffn_thresholds = self.decode_prune_encoding(prune_encoding)
         if prune_setting == 'all':
             num_remain_heads_list = [num_remain_heads for _ in range(depth)]
@@ -68,11 +68,12 @@ class ViT_Pruned(ViT):
             intermediate_size_list = [int(ffn_thresholds[i] * mlp_dim) for i in range(depth)]
 
         super().__init__(image_size=image_size, patch_size=patch_size,
-                         num_classes=num_classes, dim=dim, depth=depth, heads=heads, mlp_dim=mlp_dim)
+                         num_classes=num_classes, dim=dim, depth=depth, heads=heads, mlp_dim=mlp_dim, activation=activation)
 
         # override TransformerEncoderBlock
         self.transformer = TransformerEncoderBlock_Pruned(hidden_size=dim, num_layers=depth, num_remain_heads_list=num_remain_heads_list, 
-                                                          intermediate_size_list=intermediate_size_list, head_size=head_size, norm_first=True)
+                                                          intermediate_size_list=intermediate_size_list, head_size=head_size, norm_first=True,
+                                                          activation=activation)
         
     def decode_prune_encoding(self, prune_encoding: str):
         tokens = prune_encoding.split('_')
@@ -97,13 +98,13 @@ class ViT_Pruned(ViT):
             return prune_setting, num_heads_list, ffn_threshold_list
 
 
-def get_deit_base():
-    return ViT(dim=768, depth=12)
+def get_deit_base(**kwargs):
+    return ViT(dim=768, depth=12, **kwargs)
 
 
-def get_deit_small():
-    return ViT(dim=384, heads=6, mlp_dim=384 * 4)
+def get_deit_small(**kwargs):
+    return ViT(dim=384, heads=6, mlp_dim=384 * 4, **kwargs)
 
 
-def get_deit_tiny():
-    return ViT(dim=192, heads=3, mlp_dim=192 * 4)
+def get_deit_tiny(**kwargs):
+    return ViT(dim=192, heads=3, mlp_dim=192 * 4, **kwargs)
@@ -4,4 +4,46 @@ import torch
 def gelu(x):
     cdf = 0.5 * (1.0 + torch.tanh(
         (math.sqrt(2 / math.pi) * (x + 0.044715 * torch.pow(x, 3)))))
-    return x * cdf
\ No newline at end of file
+    return x * cdf
+
+def gelu_tanh(x):
+    return 0.5 * x * (1.0 + torch.tanh(math.sqrt(2 / math.pi) * (x + 0.044715 * x * x * x)))
+
+
+def gelu_hard(x):
+    return x * torch.nn.functional.relu6(1.702 * x + 3.) / 6.
+
+
+GELU_VARIANTS = {
+    'tanh_pow': gelu,
+    'tanh': gelu_tanh,
+    'erf': torch.nn.functional.gelu,
+    'hard': gelu_hard,
+    'relu': torch.relu,
+}
+
+
+class GELUVariant(torch.nn.Module):
+    '''
+    drop-in replacement of nn.GELU. nn.GELU exports to onnx Erf, which has no TFLite builtin kernel
+    and falls back to the Flex delegate after onnx2tflite.
+    '''
+    def __init__(self, variant='tanh'):
+        super().__init__()
+        if variant not in GELU_VARIANTS:
+            raise ValueError(f'GELU variant {variant} not supported. Supported variants: {list(GELU_VARIANTS.keys())}')
+        self.variant = variant
+
+    def forward(self, x):
+        return GELU_VARIANTS[self.variant](x)
+
+
+def replace_gelu(model, variant='tanh'):
+    count = 0
+    for name, module in model.named_children():
+        if isinstance(module, (torch.nn.GELU, GELUVariant)):
+            setattr(model, name, GELUVariant(variant))
+            count += 1
+        else:
+            count += replace_gelu(module, variant)
+    return count
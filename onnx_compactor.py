@@ -0,0 +1,508 @@
+import math
+
+'''--------------------------------------------------------------
+Graph-level compaction of mask-pruned transformer ONNX models.
+
+Pruned models exported with their masks folded into the weights still run the full dense MatMuls.
+This pass finds, in a plain (not onnxruntime-fused) BERT / ViT export, the attention blocks
+(Q/K/V MatMul -> Reshape -> Transpose ... context Reshape -> output MatMul) and the FFN blocks
+(MatMul -> activation -> MatMul), removes the heads and neurons whose output is exactly zero, and
+rewrites the initializers and the Reshape constants holding the head counts to the compacted sizes.
+
+A head is removed when its value slice (weight and bias) or its output projection rows are all zero,
+a neuron when its output projection row is all zero, or when its input column and bias are zero and
+the activation maps 0 to 0, checked by evaluating the activation subgraph at 0 (gelu and relu do,
+Erf(x) + 1 or a sigmoid do not). The outputs are thus unchanged, verify_compaction checks it under ORT CPU.
+--------------------------------------------------------------'''
+
+# ops allowed between the two MatMuls of a FFN block
+ACTIVATION_OPS = ['Add', 'Sub', 'Mul', 'Div', 'Pow', 'Erf', 'Tanh', 'Relu', 'Sigmoid', 'Gelu', 'FastGelu', 'Cast']
+
+
+class _Graph:
+    def __init__(self, model):
+        from onnx import numpy_helper
+
+        self.model = model
+        self.graph = model.graph
+        self.nodes = list(self.graph.node)
+        self.initializers = {x.name: x for x in self.graph.initializer}
+        self.constants = {x.name: numpy_helper.to_array(x) for x in self.graph.initializer}
+        self.constant_nodes = {}
+        for node in self.nodes:
+            if node.op_type == 'Constant':
+                value = next((attr.t for attr in node.attribute if attr.name == 'value'), None)
+                if value is not None:
+                    self.constants[node.output[0]] = numpy_helper.to_array(value)
+                    self.constant_nodes[node.output[0]] = node
+        # torch.onnx.export replaces a deduplicated initializer by an Identity of the kept one, read it directly
+        outputs = {x.name for x in self.graph.output}
+        sources = {node.output[0]: node.input[0] for node in self.nodes
+                   if node.op_type == 'Identity' and node.input[0] in self.constants and node.output[0] not in outputs}
+        self.nodes = [node for node in self.nodes if node.output[0] not in sources]
+        for node in self.nodes:
+            for i, x in enumerate(node.input):
+                if x in sources:
+                    node.input[i] = sources[x]
+        self.producer = {}
+        self.consumers = {}
+        for node in self.nodes:
+            for name in node.output:
+                self.producer[name] = node
+            for name in node.input:
+                self.consumers.setdefault(name, []).append(node)
+        # new nodes to insert before a node, keyed by its first output
+        self.inserts = {}
+        self.names = set(self.producer) | set(self.constants) | {x.name for x in self.graph.input}
+
+    def unique_name(self, base):
+        i = 0
+        while f'{base}_compact{i}' in self.names:
+            i += 1
+        self.names.add(f'{base}_compact{i}')
+        return f'{base}_compact{i}'
+
+    def weight(self, node):
+        # name of the constant 2-D weight of a MatMul, None otherwise
+        if node is None or node.op_type != 'MatMul' or len(node.input) < 2:
+            return None
+        value = self.constants.get(node.input[1])
+        return node.input[1] if value is not None and value.ndim == 2 else None
+
+    def single_consumer(self, name, op_type):
+        consumers = self.consumers.get(name, [])
+        if len(consumers) == 1 and consumers[0].op_type == op_type:
+            return consumers[0]
+        return None
+
+    def bias_after(self, name):
+        # (bias name, output) of the bias Add following a MatMul output, (None, name) without bias
+        add = self.single_consumer(name, 'Add')
+        if add is not None:
+            other = add.input[1] if add.input[0] == name else add.input[0]
+            if other in self.constants and self.constants[other].ndim == 1:
+                return other, add.output[0]
+        return None, name
+
+    def matmul_before(self, name):
+        # (matmul, bias name) producing name, through an optional bias Add
+        node = self.producer.get(name)
+        bias = None
+        if node is not None and node.op_type == 'Add':
+            for i, x in enumerate(node.input):
+                if x in self.constants and self.constants[x].ndim == 1:
+                    bias, node = x, self.producer.get(node.input[1 - i])
+                    break
+        return (node, bias) if self.weight(node) else (None, None)
+
+    def set_constant(self, name, value):
+        from onnx import numpy_helper
+
+        self.constants[name] = value
+        if name in self.initializers:
+            self.initializers[name].CopyFrom(numpy_helper.from_array(value, name))
+        else:
+            node = self.constant_nodes[name]
+            next(attr for attr in node.attribute if attr.name == 'value').t.CopyFrom(numpy_helper.from_array(value, name))
+
+    def private_constant(self, name, node):
+        # exporters deduplicate equal initializers (e.g. zero biases), a shared one is copied before node changes it
+        users = self.consumers.get(name, [])
+        if len(users) <= 1:
+            return name
+        copy = self.add_initializer(name, self.constants[name])
+        node.input[list(node.input).index(name)] = copy
+        self.consumers[name] = [x for x in users if x is not node]
+        self.consumers[copy] = [node]
+        return copy
+
+    def add_initializer(self, base, value):
+        from onnx import numpy_helper
+
+        name = self.unique_name(base)
+        self.graph.initializer.append(numpy_helper.from_array(value, name))
+        self.initializers[name] = self.graph.initializer[-1]
+        self.constants[name] = value
+        return name
+
+    def insert_before(self, node, new_node):
+        self.inserts.setdefault(node.output[0], []).append(new_node)
+
+    def finalize(self):
+        import onnx
+
+        ordered = []
+        for node in self.nodes:
+            ordered.extend(self.inserts.get(node.output[0], []))
+            copy = onnx.NodeProto()
+            copy.CopyFrom(node)
+            ordered.append(copy)
+        del self.graph.node[:]
+        self.graph.node.extend(ordered)
+        # the intermediate shapes changed, onnxruntime infers them again
+        del self.graph.value_info[:]
+
+
+def _perm(node):
+    return list(next((attr.ints for attr in node.attribute if attr.name == 'perm'), []))
+
+
+def _shape_source(g, shape_name, position):
+    '''
+    locates the element `position` (negative, from the end) of a Reshape shape input. Returns
+    (value, source): source is ('constant', name, position) for a constant shape, ('concat', node, input index,
+    position in the piece) for a Concat of 1-D pieces, each a constant or an Unsqueeze of a constant scalar.
+    (None, None) when the element is not a constant.
+    '''
+    if shape_name in g.constants:
+        return int(g.constants[shape_name].reshape(-1)[position]), ('constant', shape_name, position)
+    node = g.producer.get(shape_name)
+    if node is None or node.op_type != 'Concat':
+        return None, None
+    end = 0
+    for k in reversed(range(len(node.input))):
+        piece = node.input[k]
+        if piece in g.constants:
+            length = g.constants[piece].size
+        elif g.producer.get(piece) is not None and g.producer[piece].op_type == 'Unsqueeze':
+            length = 1
+        else:
+            return None, None
+        if end - length <= position < end:
+            if piece in g.constants:
+                return int(g.constants[piece].reshape(-1)[position - end]), ('concat', node, k, position - end)
+            data = g.producer[piece].input[0]
+            if data in g.constants and g.constants[data].size == 1:
+                return int(g.constants[data].reshape(-1)[0]), ('concat', node, k, -1)
+            return None, None
+        end -= length
+    return None, None
+
+
+def _rewrite_shape(g, reshape, position, value):
+    # every rewritten shape gets its own constant (and Concat), the originals may be shared between layers
+    import onnx
+    import numpy as np
+
+    _, source = _shape_source(g, reshape.input[1], position)
+    if source[0] == 'constant':
+        shape = g.constants[source[1]].copy()
+        shape.reshape(-1)[source[2]] = value
+        reshape.input[1] = g.add_initializer(source[1], shape)
+        return
+
+    concat, k, offset = source[1:]
+    piece = concat.input[k]
+    if piece in g.constants:
+        shape = g.constants[piece].copy()
+        shape.reshape(-1)[offset] = value
+    else:
+        data = g.constants[g.producer[piece].input[0]]
+        shape = np.array([value], dtype=data.dtype)
+    new_concat = onnx.NodeProto()
+    new_concat.CopyFrom(concat)
+    new_concat.name = g.unique_name(concat.name or 'Concat')
+    new_concat.input[k] = g.add_initializer(piece, shape)
+    new_concat.output[0] = g.unique_name(concat.output[0])
+    g.insert_before(reshape, new_concat)
+    reshape.input[1] = new_concat.output[0]
+
+
+def find_attention_blocks(g):
+    splits = []
+    for node in g.nodes:
+        if node.op_type != 'Transpose' or _perm(node) not in [[0, 2, 1, 3], [0, 2, 3, 1]]:
+            continue
+        reshape = g.producer.get(node.input[0])
+        if reshape is None or reshape.op_type != 'Reshape':
+            continue
+        matmul, bias = g.matmul_before(reshape.input[0])
+        if matmul is None:
+            continue
+        num_heads, _ = _shape_source(g, reshape.input[1], -2)
+        if num_heads is None:
+            continue
+        splits.append(dict(matmul=matmul, weight=g.weight(matmul), bias=bias, reshape=reshape, transpose=node, num_heads=num_heads))
+
+    groups = {}
+    for split in splits:
+        groups.setdefault(split['matmul'].input[0], []).append(split)
+
+    blocks = []
+    for group in groups.values():
+        if len(group) != 3:
+            continue
+        outputs = {x['transpose'].output[0] for x in group}
+        value = None
+        for split in group:
+            for consumer in g.consumers.get(split['transpose'].output[0], []):
+                # the context MatMul multiplies the attention probabilities by V
+                if consumer.op_type == 'MatMul' and consumer.input[1] == split['transpose'].output[0] and consumer.input[0] not in outputs:
+                    value, context = split, consumer
+        if value is None:
+            continue
+        transpose = g.single_consumer(context.output[0], 'Transpose')
+        merge = g.single_consumer(transpose.output[0], 'Reshape') if transpose is not None else None
+        output = g.single_consumer(merge.output[0], 'MatMul') if merge is not None else None
+        if output is None or g.weight(output) is None or _shape_source(g, merge.input[1], -1)[0] is None:
+            continue
+        blocks.append(dict(qk=[x for x in group if x is not value], value=value, merge=merge, output=output,
+                           output_weight=g.weight(output), num_heads=value['num_heads']))
+    return blocks
+
+
+def _eval_activation(g, nodes, name, output):
+    '''
+    evaluates the activation nodes (in visit order) with numpy, tensor `name` set to 0. Returns the value of
+    `output`, None when an op can not be evaluated.
+    '''
+    import numpy as np
+
+    erf = np.vectorize(math.erf, otypes=[np.float64])
+    gelu = lambda x: 0.5 * x * (1 + erf(x / math.sqrt(2)))
+    values = {name: np.zeros(1)}
+    for node in nodes:
+        try:
+            x = [values[i] if i in values else g.constants[i].astype(np.float64) for i in node.input if i]
+        except KeyError:
+            return None
+        if node.op_type in ['Add', 'Sub', 'Mul', 'Div', 'Pow']:
+            func = dict(Add=np.add, Sub=np.subtract, Mul=np.multiply, Div=np.divide, Pow=np.power)[node.op_type]
+            with np.errstate(all='ignore'):
+                y = func(x[0], x[1])
+        elif node.op_type == 'Erf':
+            y = erf(x[0])
+        elif node.op_type == 'Tanh':
+            y = np.tanh(x[0])
+        elif node.op_type == 'Relu':
+            y = np.maximum(x[0], 0)
+        elif node.op_type == 'Sigmoid':
+            y = 1 / (1 + np.exp(-x[0]))
+        elif node.op_type in ['Gelu', 'FastGelu']:
+            # com.microsoft ops, with an optional bias input
+            y = gelu(x[0] + x[1] if len(x) > 1 else x[0])
+        elif node.op_type == 'Cast':
+            y = x[0]
+        else:
+            return None
+        values[node.output[0]] = y
+    return values.get(output)
+
+
+def find_ffn_blocks(g, excluded):
+    import numpy as np
+
+    blocks = []
+    for node in g.nodes:
+        weight = g.weight(node)
+        if weight is None or node.output[0] in excluded:
+            continue
+        bias, name = g.bias_after(node.output[0])
+        num_neurons = g.constants[weight].shape[1]
+        frontier, visited, activation, found = [name], {name}, [], []
+        while frontier:
+            tensor = frontier.pop()
+            for consumer in g.consumers.get(tensor, []):
+                if g.weight(consumer) and consumer.input[0] == tensor:
+                    if g.constants[g.weight(consumer)].shape[0] == num_neurons and consumer.output[0] not in excluded and consumer not in found:
+                        found.append(consumer)
+                # an elementwise function of the MatMul output only: stops at the residual Add and the LayerNorm
+                elif (consumer.op_type in ACTIVATION_OPS and len(visited) < 32 and consumer not in activation
+                      and all(x in visited or x in g.constants for x in consumer.input)):
+                    activation.append(consumer)
+                    for x in consumer.output:
+                        if x not in visited:
+                            visited.add(x)
+                            frontier.append(x)
+        if len(found) != 1 or not activation:
+            continue
+        output_weight = g.weight(found[0])
+        # H -> I -> H, a classification head does not go back to the input width
+        if g.constants[output_weight].shape[1] != g.constants[weight].shape[0]:
+            continue
+        # an unused neuron sees 0 at the activation input, it can go only when the output MatMul then sees 0 too
+        value = _eval_activation(g, activation, name, found[0].input[0])
+        blocks.append(dict(input=node, weight=weight, bias=bias, output=found[0], output_weight=output_weight,
+                           zero_preserving=value is not None and bool(np.all(value == 0))))
+    return blocks
+
+
+def _kept_heads(g, block):
+    import numpy as np
+
+    value_weight = g.constants[block['value']['weight']]
+    head_size = value_weight.shape[1] // block['num_heads']
+    value = value_weight.reshape(value_weight.shape[0], block['num_heads'], head_size) != 0
+    kept = value.any(axis=(0, 2))
+    if block['value']['bias'] is not None:
+        kept |= (g.constants[block['value']['bias']].reshape(block['num_heads'], head_size) != 0).any(1)
+    output = g.constants[block['output_weight']]
+    kept &= (output.reshape(block['num_heads'], head_size, output.shape[1]) != 0).any(axis=(1, 2))
+    # one empty head is kept rather than an empty attention
+    kept[0] |= not kept.any()
+    return np.nonzero(kept)[0], head_size
+
+
+def _kept_neurons(g, block):
+    import numpy as np
+
+    kept = (g.constants[block['output_weight']] != 0).any(1)
+    if block['zero_preserving']:
+        used = (g.constants[block['weight']] != 0).any(0)
+        if block['bias'] is not None:
+            used |= g.constants[block['bias']] != 0
+        kept &= used
+    kept[0] |= not kept.any()
+    return np.nonzero(kept)[0]
+
+
+def _slice(g, name, index, axis, node):
+    # node: the MatMul or bias Add reading the constant
+    if name is not None:
+        value = g.constants[name].take(index, axis=axis)
+        g.set_constant(g.private_constant(name, node), value)
+
+
+def _bias_add(g, matmul, bias):
+    return next((x for x in g.consumers.get(matmul.output[0], []) if bias in x.input), None) if bias is not None else None
+
+
+def _tokens(shapes, name):
+    # (tokens, sequence length) of a [batch, seq, hidden] activation, unknown dims count as 1
+    shape = shapes.get(name, [1, 1, 1])
+    return max(1, int(math.prod(shape[:-1]))), shape[-2] if len(shape) > 2 else 1
+
+
+def _inferred_shapes(model):
+    from onnx import shape_inference
+
+    graph = shape_inference.infer_shapes(model).graph
+    shapes = {}
+    for value_info in list(graph.value_info) + list(graph.input) + list(graph.output):
+        dims = value_info.type.tensor_type.shape.dim
+        shapes[value_info.name] = [d.dim_value if d.dim_value > 0 else 1 for d in dims]
+    return shapes
+
+
+def _assign_layers(g, attention_blocks, ffn_blocks):
+    '''
+    layer index of every block, keyed by its first MatMul output. Blocks are walked in graph order, an attention
+    block starts a layer and the FFN block after it joins that layer, so that a block the matchers missed shifts
+    nothing but its own layer.
+    '''
+    position = {node.output[0]: i for i, node in enumerate(g.nodes)}
+    blocks = [(position[x['value']['matmul'].output[0]], 'attention', x['value']['matmul'].output[0]) for x in attention_blocks]
+    blocks += [(position[x['input'].output[0]], 'ffn', x['input'].output[0]) for x in ffn_blocks]
+    layers, layer, has_ffn = {}, -1, True
+    for _, kind, name in sorted(blocks):
+        if kind == 'attention' or has_ffn:
+            layer += 1
+            has_ffn = False
+        has_ffn |= kind == 'ffn'
+        layers[name] = layer
+    return layers
+
+
+def compact_onnx_model(model):
+    '''
+    compacts the onnx ModelProto in place. Returns the report, one entry per layer (an attention block and the
+    FFN block following it in graph order): kept head / neuron indices, original counts and the MatMul FLOPs
+    before and after.
+    '''
+    shapes = _inferred_shapes(model)
+    g = _Graph(model)
+    attention_blocks = find_attention_blocks(g)
+    excluded = {x['matmul'].output[0] for block in attention_blocks for x in block['qk'] + [block['value']]}
+    excluded |= {block['output'].output[0] for block in attention_blocks}
+    ffn_blocks = find_ffn_blocks(g, excluded)
+    layers = _assign_layers(g, attention_blocks, ffn_blocks)
+    report = {i: dict(layer=i, flops=0, compact_flops=0) for i in sorted(set(layers.values()))}
+
+    for block in attention_blocks:
+        i = layers[block['value']['matmul'].output[0]]
+        index, head_size = _kept_heads(g, block)
+        columns = (index[:, None] * head_size + list(range(head_size))).reshape(-1)
+        hidden_size, all_head_size = g.constants[block['value']['weight']].shape
+        tokens, seq_len = _tokens(shapes, block['value']['matmul'].input[0])
+        # Q/K/V and output projections, attention scores and context
+        flops = lambda width: 2 * tokens * hidden_size * width * 4 + 2 * 2 * tokens * seq_len * width
+        report[i].update(heads=index.tolist(), num_heads=block['num_heads'])
+        report[i]['flops'] += flops(all_head_size)
+        report[i]['compact_flops'] += flops(len(columns))
+        if len(index) == block['num_heads']:
+            continue
+        for split in block['qk'] + [block['value']]:
+            _slice(g, split['weight'], columns, 1, split['matmul'])
+            _slice(g, split['bias'], columns, 0, _bias_add(g, split['matmul'], split['bias']))
+            _rewrite_shape(g, split['reshape'], -2, len(index))
+        _slice(g, block['output_weight'], columns, 0, block['output'])
+        _rewrite_shape(g, block['merge'], -1, len(columns))
+
+    for block in ffn_blocks:
+        i = layers[block['input'].output[0]]
+        index = _kept_neurons(g, block)
+        hidden_size, num_neurons = g.constants[block['weight']].shape
+        tokens, _ = _tokens(shapes, block['input'].input[0])
+        report[i].update(neurons=index.tolist(), num_neurons=num_neurons)
+        report[i]['flops'] += 2 * 2 * tokens * hidden_size * num_neurons
+        report[i]['compact_flops'] += 2 * 2 * tokens * hidden_size * len(index)
+        if len(index) == num_neurons:
+            continue
+        _slice(g, block['weight'], index, 1, block['input'])
+        _slice(g, block['bias'], index, 0, _bias_add(g, block['input'], block['bias']))
+        _slice(g, block['output_weight'], index, 0, block['output'])
+
+    g.finalize()
+    report = list(report.values())
+    for x in report:
+        x['saved_flops'] = x['flops'] - x['compact_flops']
+    return report
+
+
+def verify_compaction(model_path, compact_model_path, num_threads=1, atol=1e-4, num_runs=3):
+    '''
+    runs both models on the same random inputs with ORT CPU, returns the max absolute output difference
+    '''
+    import onnx
+    import numpy as np
+    from utils import create_onnx_session, get_onnx_model_inputs
+
+    session, _ = create_onnx_session(model_path, num_threads=num_threads, cache_dir=None)
+    compact_session, _ = create_onnx_session(compact_model_path, num_threads=num_threads, cache_dir=None)
+    model = onnx.load(model_path)
+    max_diff = 0.
+    for _ in range(num_runs):
+        inputs = get_onnx_model_inputs(model)
+        for output, compact_output in zip(session.run(None, inputs), compact_session.run(None, inputs)):
+            max_diff = max(max_diff, float(np.abs(output - compact_output).max()))
+    print(f'Max abs output difference {max_diff:.2e} ({"passed" if max_diff <= atol else "FAILED"}, atol {atol:.0e}).')
+    return max_diff
+
+
+def print_compaction_report(report):
+    print(f'{"layer":<7}{"heads":>9}{"neurons":>13}{"MFLOPs":>10}{"compact":>10}{"saved":>10}')
+    for x in report:
+        heads = f'{len(x["heads"])}/{x["num_heads"]}' if 'heads' in x else '-'
+        neurons = f'{len(x["neurons"])}/{x["num_neurons"]}' if 'neurons' in x else '-'
+        print(f'{x["layer"]:<7}{heads:>9}{neurons:>13}{x["flops"] / 1e6:>10.1f}{x["compact_flops"] / 1e6:>10.1f}{x["saved_flops"] / 1e6:>10.1f}')
+    flops = sum(x['flops'] for x in report)
+    saved = sum(x['saved_flops'] for x in report)
+    if flops:
+        print(f'Total MatMul MFLOPs {flops / 1e6:.1f} -> {(flops - saved) / 1e6:.1f}, saved {saved / flops * 100:.1f}%')
+
+
+def compact_onnx(model_path, output_path, verify=True, num_threads=1, atol=1e-4):
+    '''
+    returns dict(layers=per layer report, max_diff=max abs output difference under ORT CPU or None).
+    '''
+    import onnx
+
+    model = onnx.load(model_path)
+    report = compact_onnx_model(model)
+    if not report:
+        print(f'No attention or FFN block found in {model_path}, is it an onnxruntime fused graph?')
+    onnx.save(model, output_path)
+    print(f'Save compacted model to {output_path}.')
+    print_compaction_report(report)
+    max_diff = verify_compaction(model_path, output_path, num_threads, atol) if verify else None
+    return dict(layers=report, max_diff=max_diff)
@@ -0,0 +1,576 @@
+import os
+import csv
+import json
+import time
+import hashlib
+
+'''--------------------------------------------------------------
+Declarative op sweeps.
+
+A sweep spec lists cases of one op type with parameter ranges, and the backends and quantization
+modes to measure. The engine expands the spec into shape points, builds and converts every point
+in a process pool, benchmarks the converted models with a local runner per backend and appends
+one row per measurement to a single csv table.
+
+Converted models are cached under a key computed from (op, params, backend, quantization, settings),
+and finished measurements are read back from the results table, so re-running a sweep after adding
+a shape only builds, converts and benchmarks the new shape.
+
+Spec example (json):
+{
+    "backends": {"tflite": ["None", "int8"], "onnx": ["None", "dynamic"]},
+    "runners": {"tflite": "tflite_android"},
+    "cases": {
+        "dense_out": {"op": "dense", "params": {"n": 197, "cin": 192, "cout": {"range": [160, 225]}}},
+        "conv_kernel": {"op": "conv", "params": {"k": [1, 3, 5, 7], "cin": 32, "cout": 32, "hw": 56}}
+    }
+}
+A param value is a scalar, a list, {"range": [start, stop(, step)]} or {"pow2": [start, stop]}.
+
+With "dynamic": true (on the spec or on a case), tflite, onnx and openvino export one model per op
+family with symbolic activation dims (ACTIVATION_DIMS) and every shape point is benchmarked by
+resizing the input in place. Weight dims cannot be symbolic, so onnx and openvino models of
+different weight shapes are produced by rewriting the initializers of a single exported template
+instead of exporting from torch again.
+--------------------------------------------------------------'''
+
+CACHE_NAME = 'sweep_cache.json'
+RESULTS_NAME = 'sweep_results.csv'
+EXTRA_NAME = 'sweep_extra.jsonl'
+FAILED_NAME = 'sweep_failed.jsonl'
+RESULT_FIELDS = ['case', 'name', 'op', 'n', 'cin', 'cout', 'k', 'hw', 'backend', 'quantization', 'runner', 'key',
+                 'latency_ms', 'std_ms', 'size_bytes']
+
+# op: (required params, model name format). names follow the old op test scripts so that
+# quant_planner.parse_op_features still understands them.
+OP_DEFS = {
+    'dense': (['n', 'cin', 'cout'], 'dense{n}_{cin}_{cout}'),
+    'dense2d': (['n', 'cin', 'cout'], 'dense2d{n}_{cin}_{cout}'),
+    'conv': (['k', 'cin', 'cout', 'hw'], 'conv_k{k}_i{cin}_o{cout}_hw{hw}'),
+    'dwconv': (['k', 'cin', 'hw'], 'dwconv_k{k}_io{cin}_hw{hw}'),
+    'relu': (['cin', 'hw'], 'relu_hw{hw}_c{cin}'),
+}
+
+# the first mode of every backend is its fp32 baseline
+BACKEND_QUANTIZATIONS = {
+    'tflite': ['None', 'dynamic', 'float16', 'int8'],
+    'onnx': ['None', 'dynamic', 'static'],
+    'openvino': ['FP32', 'FP16'],
+    'tensorrt': ['fp32', 'fp16', 'int8'],
+}
+INT8_MODES = dict(tflite='int8', onnx='static', tensorrt='int8')
+BACKEND_LAYOUT = dict(tflite='NHWC', onnx='NCHW', openvino='NCHW', tensorrt='NCHW')
+BACKEND_SUFFIX = dict(tflite='.tflite', onnx='.onnx', openvino='.xml', tensorrt='.pth')
+DEFAULT_RUNNERS = dict(tflite='tflite_host', onnx='onnx_host', openvino='openvino_runtime', tensorrt='tensorrt')
+
+# dims that only change activation shapes, they can stay symbolic in a dynamic model
+ACTIVATION_DIMS = dict(dense=['n'], dense2d=['n'], conv=['hw'], dwconv=['hw'], relu=['cin', 'hw'])
+DYNAMIC_BACKENDS = ['tflite', 'onnx', 'openvino']
+# distinct sizes in the onnx template, so that every weight dim can be told apart when rewriting
+ONNX_TEMPLATE_PARAMS = dict(n=4, cin=5, cout=7, k=3, hw=8)
+INPUT_DIMS = dict(dense=[1, 'n', 'cin'], dense2d=['n', 'cin'], NHWC=[1, 'hw', 'hw', 'cin'], NCHW=[1, 'cin', 'hw', 'hw'])
+
+
+def _expand_value(value):
+    if isinstance(value, dict):
+        if 'range' in value:
+            return list(range(*value['range']))
+        if 'pow2' in value:
+            return [1 << x for x in range(*value['pow2'])]
+        raise ValueError(f'Unknown param range {value}')
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def expand_spec(spec):
+    import itertools
+    points = []
+    for case, case_spec in spec['cases'].items():
+        op = case_spec['op']
+        if op not in OP_DEFS:
+            raise ValueError(f'Unknown op {op} in case {case}, supported ops: {list(OP_DEFS.keys())}')
+        keys, name_format = OP_DEFS[op]
+        missing = [k for k in keys if k not in case_spec['params']]
+        if missing:
+            raise ValueError(f'Case {case} misses params {missing} of op {op}')
+        value_lists = [_expand_value(case_spec['params'][k]) for k in keys]
+        for values in itertools.product(*value_lists):
+            params = dict(zip(keys, values))
+            if op == 'dwconv':
+                params['cout'] = params['cin']
+            points.append(dict(case=case, op=op, params=params, name=name_format.format(**params),
+                               backends=case_spec.get('backends', spec['backends']), dynamic=case_spec.get('dynamic', spec.get('dynamic', False))))
+    return points
+
+
+def get_input_shape(op, params, layout='NHWC', dynamic_dims=()):
+    dims = INPUT_DIMS.get(op, INPUT_DIMS[layout])
+    return [d if isinstance(d, int) else (None if d in dynamic_dims else params[d]) for d in dims]
+
+
+def get_spec_key(op, params, backend, quantization, settings):
+    text = json.dumps(dict(op=op, params=params, backend=backend, quantization=quantization, settings=settings), sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def build_keras_op(op, params, dynamic_dims=()):
+    import tensorflow as tf
+    layers = tf.keras.layers
+    input_shape = get_input_shape(op, params, 'NHWC', dynamic_dims)
+    input = tf.keras.Input(shape=input_shape[1:], batch_size=input_shape[0])
+    if op in ['dense', 'dense2d']:
+        output = layers.Dense(params['cout'])(input)
+    elif op == 'conv':
+        output = layers.Conv2D(params['cout'], params['k'], padding='same')(input)
+    elif op == 'dwconv':
+        output = layers.DepthwiseConv2D(kernel_size=params['k'], padding='same', depth_multiplier=1)(input)
+    elif op == 'relu':
+        output = layers.ReLU()(input)
+    return tf.keras.Model(input, output)
+
+
+def build_torch_op(op, params):
+    import torch
+    if op in ['dense', 'dense2d']:
+        return torch.nn.Linear(params['cin'], params['cout'])
+    if op == 'conv':
+        return torch.nn.Conv2d(params['cin'], params['cout'], params['k'], padding=params['k'] // 2)
+    if op == 'dwconv':
+        return torch.nn.Conv2d(params['cin'], params['cin'], params['k'], padding=params['k'] // 2, groups=params['cin'])
+    if op == 'relu':
+        return torch.nn.ReLU()
+
+
+def export_onnx_template(op, output_path):
+    import torch
+    params = dict(ONNX_TEMPLATE_PARAMS)
+    if op == 'dwconv':
+        params['cout'] = params['cin']
+    dims = INPUT_DIMS.get(op, INPUT_DIMS['NCHW'])
+    # every op keeps the position of its activation dims, so input and output share the dynamic axes
+    dynamic_axes = {i: d for i, d in enumerate(dims) if d in ACTIVATION_DIMS[op]}
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    torch.onnx.export(build_torch_op(op, params).eval(), torch.randn(*get_input_shape(op, params, 'NCHW')), output_path,
+                      input_names=['input'], output_names=['output'], opset_version=12, do_constant_folding=True,
+                      dynamic_axes={'input': dynamic_axes, 'output': dynamic_axes})
+    print(f'Export {op} onnx template to {output_path}.')
+
+
+def rewrite_onnx_template(template_path, op, params, output_path):
+    '''
+    resize the weight dims of a template exported by export_onnx_template to params: float initializers
+    are replaced by random ones of the new shape, conv attributes and static io dims are updated.
+    '''
+    import numpy as np
+    import onnx
+    from onnx import numpy_helper
+    model = onnx.load(template_path)
+    graph = model.graph
+    dim_map = {ONNX_TEMPLATE_PARAMS[k]: params[k] for k in ['cin', 'cout', 'k'] if k in params}
+
+    for init in graph.initializer:
+        if init.data_type == onnx.TensorProto.FLOAT:
+            shape = [dim_map.get(d, d) for d in init.dims]
+            init.CopyFrom(numpy_helper.from_array(np.random.randn(*shape).astype(np.float32), init.name))
+    for node in graph.node:
+        if node.op_type != 'Conv':
+            continue
+        for attr in node.attribute:
+            if attr.name == 'kernel_shape':
+                attr.ints[:] = [params['k']] * len(attr.ints)
+            elif attr.name == 'pads':
+                attr.ints[:] = [params['k'] // 2] * len(attr.ints)
+            elif attr.name == 'group' and attr.i > 1:
+                attr.i = params['cin']
+    for value in list(graph.input) + list(graph.output):
+        for dim in value.type.tensor_type.shape.dim:
+            if dim.HasField('dim_value'):
+                dim.dim_value = dim_map.get(dim.dim_value, dim.dim_value)
+    # intermediate shapes of the template are stale now
+    del graph.value_info[:]
+    onnx.save(model, output_path)
+
+
+def _build_tflite(job, outputs):
+    import shutil
+    import tempfile
+    from utils import tf2tflite
+    # int8 calibration needs a concrete shape, dynamic models are calibrated at their first shape point
+    input_shape = get_input_shape(job['op'], job['params'], 'NHWC')
+    tf_model_path = tempfile.mkdtemp(suffix='.tf')
+    try:
+        build_keras_op(job['op'], job['params'], job['dynamic_dims']).save(tf_model_path)
+        for quantization, path, _ in outputs:
+            tf2tflite(tf_model_path, path, quantization=quantization, input_shape=input_shape)
+    finally:
+        shutil.rmtree(tf_model_path, ignore_errors=True)
+
+
+def _build_onnx(job, outputs, fp32_path):
+    from utils import export_onnx_fix_batch
+    input_shape = get_input_shape(job['op'], job['params'], 'NCHW')
+    if job['template']:
+        rewrite_onnx_template(job['template'], job['op'], job['params'], fp32_path)
+    else:
+        export_onnx_fix_batch(build_torch_op(job['op'], job['params']).eval(), fp32_path, input_shape)
+    if os.path.exists(fp32_path.replace('.onnx', '-opt.onnx')):
+        os.remove(fp32_path.replace('.onnx', '-opt.onnx'))
+    for quantization, path, _ in outputs:
+        if quantization == 'dynamic':
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(fp32_path, path, activation_type=QuantType.QUInt8)
+        elif quantization == 'static':
+            import numpy as np
+            from onnxruntime.quantization import quantize_static, CalibrationDataReader
+
+            # op latency does not depend on the calibration data, random inputs are enough
+            class RandomDataReader(CalibrationDataReader):
+                def __init__(self, num_samples=20):
+                    self.data = iter([{'input': np.random.rand(*input_shape).astype(np.float32)} for _ in range(num_samples)])
+
+                def get_next(self):
+                    return next(self.data, None)
+            quantize_static(fp32_path, path, RandomDataReader())
+
+
+def _build_job(job):
+    import shutil
+    import tempfile
+    import traceback
+    backend, outputs = job['backend'], job['outputs']
+    for _, path, _ in outputs:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    start = time.time()
+    try:
+        if backend == 'tflite':
+            _build_tflite(job, outputs)
+        elif backend == 'onnx':
+            fp32_path = next((path for quantization, path, _ in outputs if quantization == 'None'), None)
+            tmp_dir = None
+            if fp32_path is None:
+                tmp_dir = tempfile.mkdtemp()
+                fp32_path = os.path.join(tmp_dir, job['name'] + '.onnx')
+            try:
+                _build_onnx(job, [x for x in outputs if x[0] != 'None'], fp32_path)
+            finally:
+                if tmp_dir:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+        elif backend == 'openvino':
+            from convert_farm import _run_job
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                for quantization, path, _ in outputs:
+                    # mo names the IR after its input, so the temporary onnx takes the name of the output
+                    onnx_path = os.path.join(tmp_dir, os.path.basename(path).replace('.xml', '.onnx'))
+                    if not os.path.exists(onnx_path):
+                        _build_onnx(job, [], onnx_path)
+                    result = _run_job(dict(kind='mo', src=onnx_path, dst=path,
+                                           settings=dict(mo_path=job['settings']['mo_path'], data_type=quantization)))
+                    if result.get('error'):
+                        raise RuntimeError(result['error'])
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        elif backend == 'tensorrt':
+            import torch
+            from torch2trt import torch2trt
+            input_shape = get_input_shape(job['op'], job['params'], 'NCHW')
+            model = build_torch_op(job['op'], job['params']).eval().cuda()
+            dummy_input = torch.randn(input_shape).cuda()
+            for quantization, path, _ in outputs:
+                model_trt = torch2trt(model, [dummy_input], fp16_mode=quantization == 'fp16', int8_mode=quantization == 'int8')
+                torch.save({'input_shape': input_shape, 'model': model_trt.state_dict()}, path)
+        else:
+            raise ValueError(f'Unknown backend {backend}')
+    except Exception:
+        return dict(job, error=traceback.format_exc())
+    return dict(job, seconds=time.time() - start)
+
+
+'''--------------------------------------------------------------
+Runners: name -> function(model_path, **runner_args) returning (avg_ms, std_ms) or
+(avg_ms, std_ms, extra), extra is a json-serializable dict kept in sweep_extra.jsonl.
+Register a new runner with @register_runner('name') and select it per backend in spec['runners'].
+--------------------------------------------------------------'''
+
+RUNNERS = {}
+
+
+def register_runner(name):
+    def wrapper(func):
+        RUNNERS[name] = func
+        return func
+    return wrapper
+
+
+@register_runner('tflite_host')
+def run_tflite_host(model_path, num_runs=50, warmup_runs=10, num_threads=1, use_xnnpack=True, taskset_mask=None, input_shape=None, **_):
+    from benchmark.run_on_host import run_on_host
+    std_ms, avg_ms, _ = run_on_host(model_path, use_xnnpack=use_xnnpack, num_threads=num_threads, num_runs=num_runs, warmup_runs=warmup_runs,
+                                    taskset_mask=taskset_mask, input_shape=input_shape)
+    return avg_ms, std_ms
+
+
+@register_runner('onnx_host')
+def run_onnx_host(model_path, num_runs=50, warmup_runs=10, num_threads=1, input_shape=None, **_):
+    from quant_planner import measure_onnx_latency
+    return measure_onnx_latency(model_path, num_runs, warmup_runs, num_threads, input_shape), None
+
+
+_adb_dict = {}
+_pushed_models = set()
+_thermal_guards = {}
+
+
+@register_runner('tflite_android')
+def run_tflite_android(model_path, serial_number=None, num_runs=50, warmup_runs=10, num_threads=1, use_gpu=False, taskset_mask='70',
+                       benchmark_binary_dir='/data/local/tmp', bin_name='benchmark_model_plus_flex_r27', no_root=False, input_shape=None,
+                       thermal_guard=False, **_):
+    from benchmark.ADBConnect import ADBConnect
+    from benchmark.run_on_device import run_on_android
+    if serial_number not in _adb_dict:
+        _adb_dict[serial_number] = ADBConnect(serial_number)
+    adb = _adb_dict[serial_number]
+    guard = None
+    if thermal_guard:
+        from benchmark.thermal import ThermalGuard
+        from benchmark.run_on_host import parse_taskset_mask
+        if serial_number not in _thermal_guards:
+            # created before the first run on this device, the baseline is the idle state
+            _thermal_guards[serial_number] = ThermalGuard(adb, cpus=parse_taskset_mask(taskset_mask))
+            _thermal_guards[serial_number].calibrate()
+        guard = _thermal_guards[serial_number]
+    input_layer = None
+    if input_shape:
+        import tensorflow as tf
+        input_layer = tf.lite.Interpreter(model_path=model_path).get_input_details()[0]['name']
+        # a dynamic model is measured at many shapes, push it once and keep it on the device
+        if (serial_number, model_path) not in _pushed_models:
+            adb.push_files(model_path, '/sdcard/')
+            _pushed_models.add((serial_number, model_path))
+    std_ms, avg_ms, _ = run_on_android(model_path, adb, use_gpu=use_gpu, num_threads=num_threads, num_runs=num_runs,
+                                       warmup_runs=warmup_runs, taskset_mask=taskset_mask, benchmark_binary_dir=benchmark_binary_dir,
+                                       bin_name=bin_name, no_root=no_root, skip_push=input_shape is not None,
+                                       input_layer=input_layer, input_layer_shape=input_shape, thermal_guard=guard)
+    if guard:
+        return avg_ms, std_ms, dict(thermal=guard.last_record)
+    return avg_ms, std_ms
+
+
+@register_runner('openvino')
+def run_openvino(model_path, benchmark_app_path=None, num_runs=50, num_threads=1, device='CPU', input_shape=None, **_):
+    from benchmark.openvino.vino_cli import openvino_benchmark
+    return openvino_benchmark(benchmark_app_path, model_path, niter=num_runs, num_threads=num_threads, device=device, show_detail=False,
+                              shape=input_shape), None
+
+
+@register_runner('openvino_runtime')
+def run_openvino_runtime(model_path, num_runs=50, num_threads=1, api='sync', num_requests=1, num_streams=1, input_shape=None, **_):
+    from benchmark.openvino.vino_runtime import openvino_runtime_benchmark
+    result = openvino_runtime_benchmark(model_path, niter=num_runs, num_threads=num_threads, api=api, num_requests=num_requests,
+                                        num_streams=num_streams, show_detail=False, shape=input_shape)
+    # wall-clock avg / std like the other runners, the PERF_COUNT counter sum of the last inference is kept as extra
+    return result['avg_ms'], result['std_ms'], dict(counter_latency_ms=result['latency_ms'], throughput_fps=result['throughput_fps'])
+
+
+@register_runner('tensorrt')
+def run_tensorrt(model_path, num_runs=50, warmup_runs=20, **_):
+    from utils import trt_benchmark
+    return trt_benchmark(model_path, num_runs=num_runs, warmup_runs=warmup_runs)
+
+
+def _load_json(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _load_finished(results_path):
+    if not os.path.exists(results_path):
+        return set()
+    with open(results_path, newline='') as f:
+        return set((row['key'], row['runner']) for row in csv.DictReader(f))
+
+
+def get_targets(spec, work_dir):
+    settings = spec.get('settings', {})
+    targets = []
+    for point in expand_spec(spec):
+        for backend, quantizations in point['backends'].items():
+            for quantization in quantizations:
+                if quantization not in BACKEND_QUANTIZATIONS[backend]:
+                    raise ValueError(f'Unknown quantization {quantization} for {backend}, supported: {BACKEND_QUANTIZATIONS[backend]}')
+                # settings that only locate tools (e.g. mo_path) do not change the model
+                model_settings = {k: v for k, v in settings.get(backend, {}).items() if not k.endswith('_path')}
+                op, params = point['op'], point['params']
+                dynamic_dims = ACTIVATION_DIMS[op] if point['dynamic'] and backend in DYNAMIC_BACKENDS else []
+                if dynamic_dims:
+                    # one model per family, measured at every shape point by resizing its input
+                    model_settings = dict(model_settings, dynamic=dynamic_dims)
+                    model_params = {k: v for k, v in params.items() if k not in dynamic_dims}
+                    model_key = get_spec_key(op, model_params, backend, quantization, model_settings)
+                    model_name = OP_DEFS[op][1].format(**dict(params, **{d: 'x' for d in dynamic_dims}))
+                    input_shape = get_input_shape(op, params, BACKEND_LAYOUT[backend])
+                key = get_spec_key(op, params, backend, quantization, model_settings)
+                if not dynamic_dims:
+                    model_key, model_name, input_shape = key, point['name'], None
+                path = os.path.join(work_dir, 'models', backend, quantization, f'{model_name}_{model_key}{BACKEND_SUFFIX[backend]}')
+                targets.append(dict(point, backend=backend, quantization=quantization, key=key, model_key=model_key, model_name=model_name,
+                                    path=path, dynamic_dims=dynamic_dims, input_shape=input_shape))
+    return targets
+
+
+def build_targets(targets, work_dir, settings=None, num_workers=4):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import multiprocessing
+
+    cache_path = os.path.join(work_dir, CACHE_NAME)
+    cache = _load_json(cache_path)
+
+    # one job per (model, backend): the source model is built once and converted to every quantization mode
+    jobs = {}
+    for target in targets:
+        if target['model_key'] in cache and os.path.exists(target['path']):
+            continue
+        model_params = {k: v for k, v in target['params'].items() if k not in target['dynamic_dims']}
+        job = jobs.setdefault((target['op'], json.dumps(model_params, sort_keys=True), target['backend'], tuple(target['dynamic_dims'])), dict(
+            op=target['op'], params=target['params'], name=target['model_name'], backend=target['backend'], dynamic_dims=target['dynamic_dims'],
+            template=None, settings=(settings or {}).get(target['backend'], {}), outputs=[]))
+        if target['model_key'] not in [x[2] for x in job['outputs']]:
+            job['outputs'].append((target['quantization'], target['path'], target['model_key']))
+    print(f'{sum(len(job["outputs"]) for job in jobs.values())} models to build in {len(jobs)} jobs with {num_workers} workers, '
+          f'{len(set(x["model_key"] for x in targets))} models for {len(set(x["key"] for x in targets))} measurements in the sweep.')
+    if len(jobs) == 0:
+        return []
+
+    # dynamic onnx / openvino models are rewritten from one template per op, exported here once
+    for job in jobs.values():
+        if job['dynamic_dims'] and job['backend'] in ['onnx', 'openvino']:
+            job['template'] = os.path.join(work_dir, 'models', 'templates', f'{job["op"]}.onnx')
+            if not os.path.exists(job['template']):
+                export_onnx_template(job['op'], job['template'])
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(_build_job, job) for job in jobs.values()]
+        for future in as_completed(futures):
+            result = future.result()
+            if result.get('error'):
+                print(f'Failed to build {result["name"]} for {result["backend"]}:\n{result["error"]}')
+                failed.append(result['name'])
+                continue
+            for quantization, path, key in result['outputs']:
+                cache[key] = dict(path=os.path.relpath(path, work_dir), backend=result['backend'], quantization=quantization,
+                                  seconds=round(result['seconds'], 2))
+            # write after every job so that an interrupted sweep keeps the finished models
+            with open(cache_path, 'w') as f:
+                json.dump(cache, f, indent=2)
+            print(f'Build {result["name"]} for {result["backend"]} {[x[0] for x in result["outputs"]]} in {result["seconds"]:.1f}s.')
+    return failed
+
+
+def _model_size(path):
+    if path.endswith('.xml'):
+        return sum(os.path.getsize(x) for x in [path, path[: -len('.xml')] + '.bin'] if os.path.exists(x))
+    return os.path.getsize(path)
+
+
+def benchmark_targets(targets, work_dir, runners=None, runner_args=None):
+    '''
+    a point whose runner raises is appended to sweep_failed.jsonl and left out of the results table,
+    so the sweep goes on and a re-run retries it.
+    '''
+    import traceback
+    runners = dict(DEFAULT_RUNNERS, **(runners or {}))
+    results_path = os.path.join(work_dir, RESULTS_NAME)
+    finished = _load_finished(results_path)
+
+    todo = [x for x in targets if (x['key'], runners[x['backend']]) not in finished and os.path.exists(x['path'])]
+    todo = list({(x['key'], runners[x['backend']]): x for x in todo}.values())
+    print(f'{len(todo)} models to benchmark, {len(finished)} measurements in {results_path}.')
+
+    write_header = not os.path.exists(results_path)
+    failed = []
+    with open(results_path, 'a', newline='') as f, open(os.path.join(work_dir, EXTRA_NAME), 'a') as extra_file, \
+            open(os.path.join(work_dir, FAILED_NAME), 'a') as failed_file:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        if write_header:
+            writer.writeheader()
+        for target in todo:
+            runner = runners[target['backend']]
+            if runner not in RUNNERS:
+                raise ValueError(f'Unknown runner {runner}, registered runners: {list(RUNNERS.keys())}')
+            try:
+                result = RUNNERS[runner](target['path'], **dict((runner_args or {}).get(runner, {}), input_shape=target['input_shape']))
+            except Exception:
+                error = traceback.format_exc()
+                print(f'Failed to benchmark {target["name"]} {target["backend"]} {target["quantization"]} ({runner}):\n{error}')
+                failed_file.write(json.dumps(dict(key=target['key'], runner=runner, name=target['name'], backend=target['backend'],
+                                                  quantization=target['quantization'], error=error)) + '\n')
+                failed_file.flush()
+                failed.append(target['name'])
+                continue
+            avg_ms, std_ms = result[:2]
+            if len(result) > 2:
+                extra_file.write(json.dumps(dict(key=target['key'], runner=runner, name=target['name'], **result[2])) + '\n')
+                extra_file.flush()
+            params = {k: target['params'].get(k, '') for k in ['n', 'cin', 'cout', 'k', 'hw']}
+            writer.writerow(dict(case=target['case'], name=target['name'], op=target['op'], backend=target['backend'],
+                                 quantization=target['quantization'], runner=runner, key=target['key'], latency_ms=f'{avg_ms:.4f}',
+                                 std_ms='' if std_ms is None else f'{std_ms:.4f}', size_bytes=_model_size(target['path']), **params))
+            # stream rows so that partial sweeps are usable and resumable
+            f.flush()
+            print(f'{target["name"]} {target["backend"]} {target["quantization"]} ({runner}): {avg_ms:.4f} ms')
+    if failed:
+        print(f'{len(failed)} measurements failed, see {os.path.join(work_dir, FAILED_NAME)}: {failed}')
+    for serial_number, guard in _thermal_guards.items():
+        throttled = sum(x['throttled'] for x in guard.records)
+        print(f'Device {serial_number}: adaptive cool-down {guard.total_cooldown():.0f}s over {len(guard.records)} runs, {throttled} still throttled.')
+    return results_path
+
+
+def run_sweep(spec, work_dir, num_workers=4, runner_args=None, skip_benchmark=False):
+    os.makedirs(work_dir, exist_ok=True)
+    targets = get_targets(spec, work_dir)
+    failed = build_targets(targets, work_dir, spec.get('settings'), num_workers)
+    if failed:
+        print(f'{len(failed)} models failed to build: {failed}')
+    if skip_benchmark:
+        return None
+    return benchmark_targets(targets, work_dir, spec.get('runners'), runner_args)
+
+
+def load_spec(spec_path):
+    with open(spec_path) as f:
+        return json.load(f)
+
+
+def export_quant_latency_table(results_path, output_path, int8_mode=None):
+    '''
+    pair the fp32 and int8 rows of a sweep into the table read by quant_planner.load_latency_table,
+    the backend column of the table is <backend>_<runner>.
+    '''
+    from quant_planner import TABLE_FIELDS
+    latency = {}
+    with open(results_path, newline='') as f:
+        for row in csv.DictReader(f):
+            latency.setdefault((row['backend'], row['runner'], row['name']), {})[row['quantization']] = row
+
+    rows = []
+    for (backend, runner, _), modes in latency.items():
+        fp32_mode, int8 = BACKEND_QUANTIZATIONS[backend][0], int8_mode or INT8_MODES.get(backend)
+        if fp32_mode not in modes or int8 not in modes:
+            continue
+        row = modes[fp32_mode]
+        rows.append(dict(backend=f'{backend}_{runner}', op=row['op'], fp32_ms=row['latency_ms'], int8_ms=modes[int8]['latency_ms'],
+                         **{k: row[k] or 1 for k in ['n', 'cin', 'cout', 'k', 'hw']}))
+
+    write_header = not os.path.exists(output_path)
+    with open(output_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+    print(f'Append {len(rows)} rows to {output_path}.')
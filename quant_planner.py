@@ -0,0 +1,274 @@
+import os
+import re
+import csv
+import math
+
+'''--------------------------------------------------------------
+Selective int8 quantization planner.
+
+Per-op fp32 vs int8 latency measured by the quant op sweeps (experiments/D11xx_*_quant_op_test.py)
+is stored in a csv table. For a given model, every quantizable node is matched to its nearest
+measured op shape, and only nodes predicted to be faster in int8 are quantized.
+--------------------------------------------------------------'''
+
+TABLE_FIELDS = ['backend', 'op', 'n', 'cin', 'cout', 'k', 'hw', 'fp32_ms', 'int8_ms']
+FEATURE_KEYS = ['n', 'cin', 'cout', 'k', 'hw']
+
+# model names used by the quant op sweeps, dwconv must be matched before conv
+OP_NAME_PATTERNS = [
+    ('dwconv', re.compile(r'^dwconv_k(?P<k>\d+)_io(?P<cin>\d+)_hw(?P<hw>\d+)')),
+    ('conv', re.compile(r'^conv_k(?P<k>\d+)_i(?P<cin>\d+)_o(?P<cout>\d+)_hw(?P<hw>\d+)')),
+    ('dense', re.compile(r'^dense(?P<n>\d+)_(?P<cin>\d+)_(?P<cout>\d+)')),
+]
+
+
+def parse_op_features(name):
+    name = os.path.basename(name)
+    for op, pattern in OP_NAME_PATTERNS:
+        m = pattern.match(name)
+        if m:
+            features = {k: 1 for k in FEATURE_KEYS}
+            features.update({k: int(v) for k, v in m.groupdict().items()})
+            if op == 'dwconv':
+                features['cout'] = features['cin']
+            return op, features
+    return None, None
+
+
+def load_latency_log(file_path):
+    '''
+    parse a benchmark log where each model name line (ends with .tflite/.onnx/.xml) is followed by
+    a line containing its latency, e.g. the output of `tools.py mobile_benchmark` or `server_benchmark`.
+    '''
+    from utils import _fetch_float_from_text
+    latency_dict = {}
+    name = None
+    with open(file_path) as f:
+        for line in f:
+            line = line.strip()
+            for suffix in ['.tflite', '.onnx', '.xml']:
+                if suffix in line:
+                    token = [x for x in line.split() if x.endswith(suffix)]
+                    if token:
+                        name = os.path.basename(token[0])[: -len(suffix)]
+                        name = re.sub(r'_quant(_\w+)?$', '', name)
+            latency = _fetch_float_from_text(line.lower(), 'latency')
+            if latency and name:
+                latency_dict[name] = latency
+                name = None
+    return latency_dict
+
+
+def build_latency_table(fp32_log, int8_log, backend, output_path):
+    fp32_latency = load_latency_log(fp32_log)
+    int8_latency = load_latency_log(int8_log)
+
+    rows = []
+    for name, fp32_ms in fp32_latency.items():
+        op, features = parse_op_features(name)
+        if op is None or name not in int8_latency:
+            print(f'Skip {name}.')
+            continue
+        rows.append(dict(backend=backend, op=op, fp32_ms=fp32_ms, int8_ms=int8_latency[name], **features))
+
+    write_header = not os.path.exists(output_path)
+    with open(output_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_FIELDS)
+        if write_header:
+            writer.writeheader()
+        writer.writerows(rows)
+    print(f'Append {len(rows)} {backend} rows to {output_path}.')
+
+
+def load_latency_table(table_path, backend):
+    table = {}
+    with open(table_path) as f:
+        for row in csv.DictReader(f):
+            if row['backend'] != backend:
+                continue
+            entry = {k: int(row[k]) for k in FEATURE_KEYS}
+            entry['fp32_ms'] = float(row['fp32_ms'])
+            entry['int8_ms'] = float(row['int8_ms'])
+            table.setdefault(row['op'], []).append(entry)
+    if not table:
+        raise ValueError(f'No latency data of backend {backend} in {table_path}.')
+    return table
+
+
+def predict_latency(table, op, features):
+    '''
+    nearest measured shape in log space, latency scaled by the MAC ratio between the node and the measured op.
+    '''
+    if op not in table:
+        return None, None
+
+    def macs(x):
+        return x['n'] * x['cin'] * x['cout'] * x['k'] * x['k'] * x['hw'] * x['hw'] / (x['cout'] if op == 'dwconv' else 1)
+
+    def distance(entry):
+        return sum((math.log(entry[k]) - math.log(features[k])) ** 2 for k in FEATURE_KEYS)
+
+    entry = min(table[op], key=distance)
+    scale = macs(features) / macs(entry)
+    return entry['fp32_ms'] * scale, entry['int8_ms'] * scale
+
+
+def get_onnx_quant_nodes(model_path):
+    import onnx
+    from onnx import numpy_helper, shape_inference
+
+    model = shape_inference.infer_shapes(onnx.load(model_path))
+    graph = model.graph
+    initializers = {x.name: numpy_helper.to_array(x).shape for x in graph.initializer}
+    shapes = {}
+    for value_info in list(graph.value_info) + list(graph.input) + list(graph.output):
+        dims = value_info.type.tensor_type.shape.dim
+        shapes[value_info.name] = [d.dim_value if d.dim_value > 0 else 1 for d in dims]
+
+    nodes = []
+    for node in graph.node:
+        if node.op_type in ['MatMul', 'Gemm'] and len(node.input) > 1 and node.input[1] in initializers:
+            weight_shape = initializers[node.input[1]]
+            trans_b = any(attr.name == 'transB' and attr.i for attr in node.attribute)
+            cin, cout = (weight_shape[1], weight_shape[0]) if trans_b else (weight_shape[0], weight_shape[1])
+            input_shape = shapes.get(node.input[0], [1, cin])
+            features = dict(n=max(1, int(math.prod(input_shape[:-1]))), cin=cin, cout=cout, k=1, hw=1)
+            nodes.append((node.name, 'dense', features))
+        elif node.op_type == 'Conv' and node.input[1] in initializers:
+            cout, cin_per_group, k = initializers[node.input[1]][:3]
+            group = next((attr.i for attr in node.attribute if attr.name == 'group'), 1)
+            input_shape = shapes.get(node.input[0], [1, cin_per_group * group, 1, 1])
+            op = 'dwconv' if group > 1 and group == cout else 'conv'
+            features = dict(n=1, cin=cin_per_group * group, cout=cout, k=k, hw=input_shape[2])
+            nodes.append((node.name, op, features))
+    return nodes
+
+
+def get_tflite_quant_nodes(model_path):
+    '''
+    returns nodes named by their output tensor, which is what QuantizationDebugOptions.denylisted_nodes expects.
+    '''
+    import tensorflow as tf
+
+    interpreter = tf.lite.Interpreter(model_path=model_path)
+    tensors = {x['index']: x for x in interpreter.get_tensor_details()}
+    nodes = []
+    for op in interpreter._get_ops_details():
+        if op['op_name'] not in ['FULLY_CONNECTED', 'CONV_2D', 'DEPTHWISE_CONV_2D']:
+            continue
+        input_shape = list(tensors[op['inputs'][0]]['shape'])
+        weight_shape = list(tensors[op['inputs'][1]]['shape'])
+        name = tensors[op['outputs'][0]]['name']
+        if op['op_name'] == 'FULLY_CONNECTED':
+            cout, cin = weight_shape
+            features = dict(n=max(1, int(math.prod(input_shape[:-1]))), cin=cin, cout=cout, k=1, hw=1)
+            nodes.append((name, 'dense', features))
+        elif op['op_name'] == 'CONV_2D':
+            cout, k, _, cin = weight_shape
+            nodes.append((name, 'conv', dict(n=1, cin=cin, cout=cout, k=k, hw=input_shape[1])))
+        else:
+            _, k, _, c = weight_shape
+            nodes.append((name, 'dwconv', dict(n=1, cin=c, cout=c, k=k, hw=input_shape[1])))
+    return nodes
+
+
+def plan_quantization(nodes, table, margin=0.):
+    '''
+    quantize a node only when its predicted int8 latency is below (1 - margin) * fp32 latency.
+    nodes without latency data are left to the quantizer default and not counted in the prediction.
+    '''
+    plan = dict(quantize=[], exclude=[], unknown=[], fp32_ms=0., int8_ms=0., planned_ms=0.)
+    for name, op, features in nodes:
+        fp32_ms, int8_ms = predict_latency(table, op, features)
+        if fp32_ms is None:
+            plan['unknown'].append(name)
+            continue
+        plan['fp32_ms'] += fp32_ms
+        plan['int8_ms'] += int8_ms
+        if int8_ms < fp32_ms * (1 - margin):
+            plan['quantize'].append(name)
+            plan['planned_ms'] += int8_ms
+        else:
+            plan['exclude'].append(name)
+            plan['planned_ms'] += fp32_ms
+    return plan
+
+
+def quantize_onnx_with_plan(model_path, output_path, nodes_to_exclude, mode='dynamic', calibration_data_reader=None):
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType
+
+    if mode == 'dynamic':
+        quantize_dynamic(model_path, output_path, activation_type=QuantType.QUInt8, nodes_to_exclude=nodes_to_exclude)
+    else:
+        if calibration_data_reader is None:
+            raise ValueError('calibration_data_reader must be provided for static quantization.')
+        quantize_static(model_path, output_path, calibration_data_reader, nodes_to_exclude=nodes_to_exclude)
+    print(f'Quantize {model_path} to {output_path}, exclude {len(nodes_to_exclude)} nodes.')
+
+
+def quantize_tflite_with_plan(saved_model_path, output_path, nodes_to_exclude, representative_dataset):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_path)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    debug_options = tf.lite.experimental.QuantizationDebugOptions(denylisted_nodes=nodes_to_exclude)
+    debugger = tf.lite.experimental.QuantizationDebugger(converter=converter, debug_dataset=representative_dataset,
+                                                         debug_options=debug_options)
+    # the debug model carries NumericVerify ops and float copies of every tensor, only the plain one is measured
+    with open(output_path, 'wb') as f:
+        f.write(debugger.get_nondebug_quantized_model())
+    print(f'Quantize {saved_model_path} to {output_path}, exclude {len(nodes_to_exclude)} nodes.')
+
+
+def measure_onnx_latency(model_path, num_runs=50, warmup_runs=10, num_threads=1, input_shape=None):
+    import timeit
+    import numpy as np
+    from utils import get_onnx_session_inputs, create_onnx_session
+
+    session, _ = create_onnx_session(model_path, num_threads=num_threads)
+    # dense ops take 2-D / 3-D float inputs, the dtype comes from the session rather than the rank
+    input = get_onnx_session_inputs(session, input_shape=input_shape)
+    for _ in range(warmup_runs):
+        session.run(None, input)
+    latency_list = []
+    for _ in range(num_runs):
+        start_time = timeit.default_timer()
+        session.run(None, input)
+        latency_list.append(timeit.default_timer() - start_time)
+    return np.average(latency_list) * 1000
+
+
+def measure_tflite_latency(model_path, num_runs=50, warmup_runs=10, num_threads=1, input_shape=None):
+    import timeit
+    import numpy as np
+    import tensorflow as tf
+
+    interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+    if input_shape:
+        # models with dynamic dims are resized in place to the measured shape
+        interpreter.resize_tensor_input(interpreter.get_input_details()[0]['index'], input_shape, strict=True)
+    interpreter.allocate_tensors()
+    for detail in interpreter.get_input_details():
+        interpreter.set_tensor(detail['index'], np.random.rand(*detail['shape']).astype(detail['dtype']))
+    for _ in range(warmup_runs):
+        interpreter.invoke()
+    latency_list = []
+    for _ in range(num_runs):
+        start_time = timeit.default_timer()
+        interpreter.invoke()
+        latency_list.append(timeit.default_timer() - start_time)
+    return np.average(latency_list) * 1000
+
+
+def print_plan(plan, measured=None):
+    if plan['fp32_ms'] == 0:
+        print(f'No latency data matches the {len(plan["unknown"])} quantizable nodes.')
+        return
+    print(f'quantize {len(plan["quantize"])} nodes, exclude {len(plan["exclude"])} nodes, no latency data for {len(plan["unknown"])} nodes.')
+    print(f'Exclude list: {plan["exclude"]}')
+    print(f'Predicted latency (ms) of planned nodes: fp32 {plan["fp32_ms"]:.2f}, all int8 {plan["int8_ms"]:.2f}, planned {plan["planned_ms"]:.2f}')
+    print(f'Predicted speedup: all int8 {plan["fp32_ms"] / plan["int8_ms"]:.2f}x, planned {plan["fp32_ms"] / plan["planned_ms"]:.2f}x')
+    if measured:
+        print(f'Measured latency (ms): fp32 {measured["fp32"]:.2f}, all int8 {measured["int8"]:.2f}, planned {measured["planned"]:.2f}')
+        print(f'Measured speedup: all int8 {measured["fp32"] / measured["int8"]:.2f}x, planned {measured["fp32"] / measured["planned"]:.2f}x')
@@ -0,0 +1,58 @@
+import csv
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+import op_sweep
+
+HAS_ORT = all(importlib.util.find_spec(x) is not None for x in ['torch', 'onnx', 'onnxruntime'])
+
+
+@unittest.skipUnless(HAS_ORT, 'needs torch, onnx and onnxruntime')
+class TestOnnxHost(TestCase):
+  def setUp(self):
+    self.work_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.work_dir, ignore_errors=True)
+
+  def test_dense_templates(self):
+    # float 3-D / 2-D inputs, the old rank-based feeds gave them int64
+    for op, params in [('dense', dict(n=16, cin=5, cout=7)), ('dense2d', dict(n=16, cin=5, cout=7))]:
+      path = os.path.join(self.work_dir, f'{op}.onnx')
+      op_sweep.export_onnx_template(op, path)
+      avg_ms, std_ms = op_sweep.run_onnx_host(path, num_runs=3, warmup_runs=1,
+                                              input_shape=op_sweep.get_input_shape(op, params, 'NCHW'))
+      self.assertGreater(avg_ms, 0)
+      self.assertIsNone(std_ms)
+
+  def test_failed_runner_is_recorded(self):
+    path = os.path.join(self.work_dir, 'dense.onnx')
+    op_sweep.export_onnx_template('dense', path)
+
+    def run_broken(model_path, **_):
+      raise RuntimeError('broken runner')
+    op_sweep.RUNNERS['broken'] = run_broken
+    self.addCleanup(op_sweep.RUNNERS.pop, 'broken')
+
+    target = dict(case='dense_n', name='dense16_5_7', op='dense', params=dict(n=16, cin=5, cout=7), backend='onnx',
+                  quantization='None', path=path, input_shape=[1, 16, 5])
+    targets = [dict(target, key='a'), dict(target, key='b', backend='tflite')]
+    results_path = op_sweep.benchmark_targets(targets, self.work_dir, runners=dict(tflite='broken'),
+                                              runner_args=dict(onnx_host=dict(num_runs=3, warmup_runs=1)))
+
+    with open(results_path, newline='') as f:
+      rows = list(csv.DictReader(f))
+    self.assertEqual([(x['key'], x['runner']) for x in rows], [('a', 'onnx_host')])
+    with open(os.path.join(self.work_dir, op_sweep.FAILED_NAME)) as f:
+      failed = [json.loads(line) for line in f]
+    self.assertEqual([(x['key'], x['runner']) for x in failed], [('b', 'broken')])
+    self.assertIn('broken runner', failed[0]['error'])
+
+
+if __name__ == '__main__':
+  unittest.main()
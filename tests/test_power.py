@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+
+from benchmark.power import (BEGIN_MARKER, END_MARKER, PowerSampler, compute_energy, get_timed_window,
+                             load_power_samples)
+
+
+class StubADB:
+  '''
+  stands in for benchmark.ADBConnect: the sampler loop "ran" on the device and produced canned
+  current_now (uA) / voltage_now (uV) readings, the benchmark command prints its device clock window.
+  '''
+  def __init__(self, readings, bench_output, begin, end):
+    self.readings = readings
+    self.bench_output = bench_output
+    self.begin = begin
+    self.end = end
+    self.pushed = []
+    self.commands = []
+
+  def push_files(self, src, dst):
+    with open(src) as f:
+      self.pushed.append((dst, f.read()))
+
+  def pull_files(self, src, dst):
+    with open(dst, 'w') as f:
+      f.write('timestamp,battery_current,battery_voltage\n')
+      for timestamp, current, voltage in self.readings:
+        f.write(f'{timestamp},{current},{voltage}\n')
+      # a line cut by the stop signal
+      f.write(f'{self.readings[-1][0] + 0.1},250000\n')
+
+  def run_cmd(self, cmd, no_root=False):
+    self.commands.append(cmd)
+    if BEGIN_MARKER in cmd:
+      return f'{BEGIN_MARKER} {self.begin}\n{self.bench_output}\n{END_MARKER} {self.end}\n'
+    return ''
+
+
+class TestPowerSampler(TestCase):
+  NODES = {'battery_current': '/sys/class/power_supply/battery/current_now',
+           'battery_voltage': '/sys/class/power_supply/battery/voltage_now'}
+
+  def helper(self):
+    # 1000 mW idle outside [101, 103], 2000 mW inside, one sample every 0.1 s
+    readings = []
+    for i in range(41):
+      t = 100. + i * 0.1
+      busy = 101. - 1e-6 < t < 103. + 1e-6
+      readings.append((round(t, 1), -500000 if busy else 250000, 4000000))
+    adb = StubADB(readings, 'count=10 first=100000 curr=100000 min=100000 max=100000 avg=100000 std=0', 101., 103.)
+    return PowerSampler(adb, interval=0.01, nodes=self.NODES), adb
+
+  def test_sampler_round_trip(self):
+    sampler, adb = self.helper()
+    sampler.start()
+    self.assertTrue(sampler.running)
+    self.assertEqual(adb.pushed[0][0], sampler.script_path)
+    self.assertIn('battery_current=/sys/class/power_supply/battery/current_now', adb.commands[0])
+
+    output, begin, end = sampler.run_marked('taskset 70 benchmark_model', no_root=False)
+    self.assertEqual((begin, end), (101., 103.))
+    self.assertEqual(sampler.last_window, (101., 103.))
+    self.assertIn('avg=100000', output)
+    # the markers are read on the device clock, a root command is wrapped in su
+    self.assertIn("su -c 'taskset 70 benchmark_model'", adb.commands[-1])
+    self.assertIn('\\$EPOCHREALTIME', adb.commands[-1])
+
+    path = os.path.join(tempfile.mkdtemp(), 'power.csv')
+    samples = sampler.stop(path)
+    self.assertFalse(sampler.running)
+    self.assertEqual(samples, load_power_samples(path))
+    self.assertEqual(len(samples), 41)
+
+  def test_mj_per_inference(self):
+    sampler, adb = self.helper()
+    sampler.start()
+    _, begin, end = sampler.run_marked('benchmark_model')
+    samples = sampler.stop(os.path.join(tempfile.mkdtemp(), 'power.csv'))
+
+    # 10 timed runs of 100 ms are the last second of the command, init and warmup run before
+    timed_begin, timed_end = get_timed_window(begin, end, 10, 100.)
+    self.assertAlmostEqual(timed_begin, 102.)
+    energy = compute_energy(samples, timed_begin, timed_end, 10, busy_window=(begin, end))
+    self.assertAlmostEqual(energy['avg_power_mw'], 2000., places=3)
+    self.assertAlmostEqual(energy['idle_power_mw'], 1000., places=3)
+    self.assertAlmostEqual(energy['mj_per_inference'], 200., places=3)
+    self.assertAlmostEqual(energy['net_mj_per_inference'], 100., places=3)
+
+  def test_window_not_covered(self):
+    sampler, _ = self.helper()
+    samples = sampler.stop(os.path.join(tempfile.mkdtemp(), 'power.csv'))
+    with self.assertRaises(ValueError):
+      compute_energy(samples, 99., 101., 10)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,76 @@
+import time
+import unittest
+from unittest import TestCase
+
+from benchmark.thermal import READ_STATE_CMD, ThermalGuard
+
+
+class StubADB:
+  '''
+  stands in for benchmark.ADBConnect: answers the full state read and the caps-only cat from the current
+  (temperature, cpu cur/max freqs, gpu max freq).
+  '''
+  def __init__(self):
+    self.temp = 30000
+    self.cpus = {i: (300000, 2000000) for i in range(8)}
+    self.gpu_max = 800000000
+    self.commands = []
+
+  def run_cmd(self, cmd, no_root=False):
+    self.commands.append(cmd)
+    if cmd == READ_STATE_CMD:
+      lines = [f'T cpu-0 {self.temp}']
+      lines += [f'F {i} {cur} {cap} 2000000' for i, (cur, cap) in self.cpus.items()]
+      lines.append(f'G 300000000 {self.gpu_max}')
+      return '\n'.join(lines)
+    values = []
+    for path in cmd.split()[1:]:
+      values.append(self.gpu_max if 'kgsl' in path else self.cpus[int(path.split('/')[5][3:])][1])
+    return '\n'.join(str(x) for x in values)
+
+
+class TestThermalGuard(TestCase):
+  def helper(self, **kwargs):
+    adb = StubADB()
+    guard = ThermalGuard(adb, cpus=[4, 5, 6], poll_interval=0.01, max_wait=0., **kwargs)
+    guard.calibrate()
+    return guard, adb
+
+  def test_no_read_during_run(self):
+    guard, adb = self.helper()
+    calls = []
+    guard.run(lambda: calls.append(len(adb.commands)))
+    # the state is read before and after the workload, never while it runs
+    self.assertEqual(len(adb.commands), calls[0] + 1)
+    self.assertFalse(guard.last_record['throttled'])
+
+  def test_gpu_run_with_idle_cpus(self):
+    # a gpu run leaves the cpu clocks low, only the caps decide
+    guard, adb = self.helper(sample_during=True)
+    guard.cpus = None
+    guard.run(lambda: time.sleep(0.05))
+    self.assertFalse(guard.last_record['throttled'])
+    self.assertGreater(len(guard.last_record['trace'][0]['during']), 0)
+    self.assertTrue(all(x.startswith('cat ') for x in adb.commands if x != READ_STATE_CMD))
+
+  def test_cap_drop_after_run(self):
+    guard, adb = self.helper(max_retries=0)
+
+    def run():
+      adb.cpus[5] = (1000000, 1200000)
+    guard.run(run)
+    self.assertTrue(guard.last_record['throttled'])
+
+  def test_cap_drop_recovered_during_run(self):
+    guard, adb = self.helper(sample_during=True, max_retries=0)
+
+    def run():
+      adb.gpu_max = 400000000
+      time.sleep(0.05)
+      adb.gpu_max = 800000000
+    guard.run(run)
+    self.assertTrue(guard.last_record['throttled'])
+
+
+if __name__ == '__main__':
+  unittest.main()
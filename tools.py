@@ -6,10 +6,9 @@ import numpy as np
 
 def server_benchmark():
     import onnx
-    import onnxruntime as ort
     import numpy as np
     import os
-    from utils import get_onnx_model_inputs
+    from utils import get_onnx_model_inputs, create_onnx_session, create_io_binding, ORT_CACHE_DIR
 
 
     parser = argparse.ArgumentParser()
@@ -64,56 +63,43 @@ def server_benchmark():
         type=str,
         help='input_shape'
     )
+    parser.add_argument('--session_cache_dir', default=ORT_CACHE_DIR, type=str, help='directory of the cached optimized graphs')
+    parser.add_argument('--no_session_cache', action='store_true', help='always optimize the graph when creating the session')
     parser.set_defaults(io_binding=False)
     args = parser.parse_args()
 
     execution_providers = ['CPUExecutionProvider'
                                ] if not args.use_gpu else ['CUDAExecutionProvider', 'CPUExecutionProvider']
-    session_options = ort.SessionOptions()
-    session_options.intra_op_num_threads = args.intra_op_threads
-    session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-
-    session = ort.InferenceSession(args.model, providers=execution_providers, sess_options=session_options)
-    if args.io_binding:
-        io_binding = session.io_binding()
+    session, session_info = create_onnx_session(args.model, num_threads=args.intra_op_threads, providers=execution_providers,
+                                                cache_dir=None if args.no_session_cache else args.session_cache_dir)
     model = onnx.load(args.model)
+    # inputs are generated once, for exports with initializers in graph.input only the session inputs are fed
+    input = get_onnx_model_inputs(model, args.dtype, [int(x) for x in args.input_shape.split(',')] if args.input_shape else None)
+    input = {x.name: input[x.name] for x in session.get_inputs()}
+
+    def measure(run):
+        for _ in range(args.warmup_runs):
+            run()
+        latency_list = []
+        for _ in range(args.num_runs):
+            start_time = timeit.default_timer()
+            run()
+            latency_list.append(timeit.default_timer() - start_time)
+        latency_list = sorted(latency_list)
+        if args.top:
+            latency_list = latency_list[:args.top]
+        return np.average(latency_list), np.std(latency_list)
+
+    results = {'session.run': measure(lambda: session.run(None, input))}
+    if args.io_binding:
+        # all inputs and outputs are bound once to preallocated buffers, the timed loop only runs the session
+        io_binding, input_values, output_values = create_io_binding(session, input, args.use_gpu)
+        results['io_binding'] = measure(lambda: session.run_with_iobinding(io_binding))
 
-    # warm up
-    for _ in range(args.warmup_runs):
-        input = get_onnx_model_inputs(model, args.dtype)
-        if args.io_binding:
-            io_binding.bind_cpu_input('input', input['input'])
-            io_binding.bind_output('output')
-            session.run_with_iobinding(io_binding)
-        else:
-            session.run(None, input)
-
-    # run
-    latency_list = []
-    for _ in range(args.num_runs):
-        input = get_onnx_model_inputs(model, args.dtype, [int(x) for x in args.input_shape.split(',')] if args.input_shape else None)
-        if args.io_binding:
-            io_binding.bind_cpu_input('input', input['input'])
-            io_binding.bind_output('output')
-
-        start_time = timeit.default_timer()
-
-        if args.io_binding:
-            session.run_with_iobinding(io_binding)
-        else:
-            session.run(None, input)
-            
-        latency = timeit.default_timer() - start_time
-        latency_list.append(latency)
-
-    # summarize
-    latency_list = sorted(latency_list)
-    if args.top:
-        latency_list = latency_list[:args.top]
-    avg_latency = np.average(latency_list)
-    std_latency = np.std(latency_list)
-    print(f'{os.path.basename(args.model)}  Avg latency: {avg_latency * 1000: .{args.precision}f} ms, Std: {std_latency * 1000: .{args.precision}f} ms.')
+    print(f'{os.path.basename(args.model)}  Session creation: {session_info["create_ms"]: .{args.precision}f} ms '
+          f'(cache {"hit" if session_info["cache_hit"] else "miss"}).')
+    for name, (avg_latency, std_latency) in results.items():
+        print(f'{os.path.basename(args.model)}  [{name}] Avg latency: {avg_latency * 1000: .{args.precision}f} ms, Std: {std_latency * 1000: .{args.precision}f} ms.')
 
 
 def test_tf_latency():
@@ -250,6 +236,8 @@ def export_onnx_deit():
     parser.add_argument('--input_shape', required=True, type=str, help='input shape')
     parser.add_argument('--type', type=str, choices=['tiny', 'small', 'base'], default='base', help='deit config')
     parser.add_argument('--fix_batch', action='store_true', dest='fix_batch')
+    parser.add_argument('--builtin_only', action='store_true', help='replace erf GELU with tanh GELU so that onnx2tflite needs no Flex op')
+    parser.add_argument('--gelu', default='erf', choices=['erf', 'tanh', 'tanh_pow', 'hard', 'relu'], help='GELU implementation to export')
     parser.set_defaults(fix_batch=False)
     args = parser.parse_args()
 
@@ -260,6 +248,11 @@ def export_onnx_deit():
 
 
     model = get_torch_deit(type)
+    if args.builtin_only and args.gelu == 'erf':
+        args.gelu = 'tanh'
+    if args.gelu != 'erf':
+        from modeling.torch_layers.activation import replace_gelu
+        print(f'Replace {replace_gelu(model, args.gelu)} GELU with {args.gelu} variant.')
     export_onnx(model, onnx_model_path, input_shape, dynamic_batch=not fix_batch)
 
 
@@ -274,6 +267,8 @@ def export_onnx_swin():
     parser.add_argument('--swin_repo_root_path', default='/data/v-xudongwang/Swin-Transformer', type=str, help='Swin-Transformer github repo root path')
     parser.add_argument('--pretrained_path', default=None, type=str, help='pretrained state_dict path')
     parser.add_argument('--fix_batch', action='store_true', dest='fix_batch')
+    parser.add_argument('--builtin_only', action='store_true', help='replace erf GELU with tanh GELU so that onnx2tflite needs no Flex op')
+    parser.add_argument('--gelu', default='erf', choices=['erf', 'tanh', 'tanh_pow', 'hard', 'relu'], help='GELU implementation to export')
     parser.set_defaults(fix_batch=False)
     args = parser.parse_args()
 
@@ -288,6 +283,12 @@ def export_onnx_swin():
         state_dict = torch.load(pretrained_path, map_location='cpu')
         model.load_state_dict(state_dict['model'])
         print(f'Load state_dict from {pretrained_path}')
+    if args.builtin_only and args.gelu == 'erf':
+        # torch.roll is exported as Slice + Concat, so GELU is the only op left that needs Flex
+        args.gelu = 'tanh'
+    if args.gelu != 'erf':
+        from modeling.torch_layers.activation import replace_gelu
+        print(f'Replace {replace_gelu(model, args.gelu)} GELU with {args.gelu} variant.')
 
     export_onnx(model, onnx_model_path, input_shape, dynamic_batch=not fix_batch)
 
@@ -466,6 +467,9 @@ def tf2tflite_cmd():
     parser.set_defaults(keras=False)
     parser.add_argument('--no_flex', action='store_false', dest='use_flex', help='specify not to use flex op')
     parser.add_argument('--input_shape', type=str, default=None, help='input_shape to generate fake dataset when perform int8 quantization')
+    parser.add_argument('--calib_data_path', default=None, type=str, help='imagenet root to calibrate int8 quantization with real train images')
+    parser.add_argument('--calib_cache', default='models/calibration/imagenet_train_calib.npy', type=str, help='calibration data cache file')
+    parser.add_argument('--num_calib_samples', default=1000, type=int, help='number of stratified calibration images')
     parser.set_defaults(use_flex=True)
     args = parser.parse_args()
 
@@ -476,7 +480,51 @@ def tf2tflite_cmd():
     if args.input_shape:
         input_shape = [int(x) for x in args.input_shape.split(',')]
 
-    tf2tflite(args.input, args.output, quantization=args.quantization, use_flex=args.use_flex, input_shape=input_shape)
+    calibration_data = None
+    if args.calib_data_path:
+        from calibration import load_calibration_data
+        calibration_data = load_calibration_data(args.calib_data_path, args.calib_cache, args.num_calib_samples)
+    tf2tflite(args.input, args.output, quantization=args.quantization, use_flex=args.use_flex, input_shape=input_shape, calibration_data=calibration_data)
+
+
+def tflite_ops_cmd():
+    from utils import get_tflite_op_counts
+    parser = argparse.ArgumentParser()
+    parser.add_argument('func', help='specify the work to do.')
+    parser.add_argument('--model', required=True, type=str, help='tflite model path')
+    args = parser.parse_args()
+
+    op_counts = get_tflite_op_counts(args.model)
+    for op, count in sorted(op_counts.items(), key=lambda x: -x[1]):
+        print(f'{op:<30}{count}')
+    flex_ops = [op for op in op_counts if op.startswith('Flex')]
+    print(f'Total ops: {sum(op_counts.values())}, Flex ops: {flex_ops if flex_ops else "None"}')
+
+
+def op_sweep_cmd():
+    import json
+    from op_sweep import load_spec, run_sweep, export_quant_latency_table
+    parser = argparse.ArgumentParser()
+    parser.add_argument('func', help='specify the work to do.')
+    parser.add_argument('--spec', required=True, type=str, help='json sweep spec, see op_sweep.py')
+    parser.add_argument('--work_dir', default='models/op_sweep', type=str, help='directory of the model cache and the result table')
+    parser.add_argument('--num_workers', default=4, type=int, help='number of processes building and converting models')
+    parser.add_argument('--runner_args', default='{}', type=str, help='json dict of runner name -> kwargs, e.g. {"tflite_android": {"serial_number": "xxx"}}')
+    parser.add_argument('--skip_benchmark', action='store_true', help='only build and convert models')
+    parser.add_argument('--dynamic', action='store_true', help='one model with symbolic activation dims per op family for tflite/onnx/openvino')
+    parser.add_argument('--quant_table', default=None, type=str, help='append fp32 vs int8 rows of the results to this quant_plan latency table')
+    parser.add_argument('--int8_mode', default=None, type=str, help='quantization mode paired with fp32 in --quant_table, default is the int8 mode of each backend')
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    if args.dynamic:
+        spec['dynamic'] = True
+    results_path = run_sweep(spec, args.work_dir, num_workers=args.num_workers, runner_args=json.loads(args.runner_args),
+                             skip_benchmark=args.skip_benchmark)
+    if results_path:
+        print(f'Results: {results_path}')
+        if args.quant_table:
+            export_quant_latency_table(results_path, args.quant_table, int8_mode=args.int8_mode)
 
 
 def tf2tflite_dir_cmd():
@@ -487,14 +535,24 @@ def tf2tflite_dir_cmd():
     parser.add_argument('--output_dir', required=True, type=str, help='output path')
     parser.add_argument('--quantization', default='None', choices=['None', 'dynamic', 'float16', 'int8'], type=str, help='quantization type')
     parser.add_argument('--skip_existed', action='store_true', help='skip if the output tflite file exists')
+    parser.add_argument('--incremental', action='store_true', help='skip models whose input and settings are unchanged since the last conversion')
+    parser.add_argument('--num_workers', default=1, type=int, help='number of parallel conversion processes')
     parser.add_argument('--input_shape', type=str, default=None, help='input_shape to generate fake dataset when perform int8 quantization')
+    parser.add_argument('--calib_data_path', default=None, type=str, help='imagenet root to calibrate int8 quantization with real train images')
+    parser.add_argument('--calib_cache', default='models/calibration/imagenet_train_calib.npy', type=str, help='calibration data cache file')
+    parser.add_argument('--num_calib_samples', default=1000, type=int, help='number of stratified calibration images')
     args = parser.parse_args()
 
     input_shape=None
     if args.input_shape:
         input_shape = [int(x) for x in args.input_shape.split(',')]
-    
-    tf2tflite_dir(args.input_dir, args.output_dir, quantization=args.quantization, skip_existed=args.skip_existed, input_shape=input_shape)
+    calibration_data = None
+    if args.calib_data_path:
+        from calibration import load_calibration_data
+        calibration_data = load_calibration_data(args.calib_data_path, args.calib_cache, args.num_calib_samples)
+
+    tf2tflite_dir(args.input_dir, args.output_dir, quantization=args.quantization, skip_existed=args.skip_existed, input_shape=input_shape,
+                  calibration_data=calibration_data, num_workers=args.num_workers, incremental=args.incremental)
 
 
 
@@ -517,6 +575,14 @@ def mobile_benchmark():
     parser.add_argument('--no_root', action='store_true', help='run cmd on phone without root')
     parser.add_argument('--use_xnnpack', default='store_true', dest='use_xnnpack', help='use xnnpack delegate, default false')
     parser.add_argument('--profiling_output_csv_file', default=None, type=str, help='do profiling and save output to this path')
+    parser.add_argument('--thermal_guard', action='store_true', help='wait for the device to cool down before the run and repeat it when throttled')
+    parser.add_argument('--cool_temp', type=float, default=None, help='with --thermal_guard, cool down below this absolute temperature instead of the idle baseline + margin')
+    parser.add_argument('--thermal_baseline', type=str, default=None, help='with --thermal_guard, json of the idle baseline, recorded at the first call and reused by the later ones')
+    parser.add_argument('--thermal_sample_during', action='store_true', help='with --thermal_guard, also read the frequency caps during the run (one adb cat every 2s next to the benchmark)')
+    parser.add_argument('--config_sweep', action='store_true', help='find the fastest (taskset_mask, num_threads, xnnpack) from the device cpu topology, --model may be a directory')
+    parser.add_argument('--max_threads', type=int, default=4, help='max number of threads in --config_sweep')
+    parser.add_argument('--prune_ratio', type=float, default=1.2, help='drop configs whose probe latency is above prune_ratio x the best probe')
+    parser.add_argument('--measure_energy', action='store_true', help='sample battery power on the device and report mJ/inference in --config_sweep')
     parser.set_defaults(use_gpu=False)
     parser.set_defaults(skip_push=False)
     parser.set_defaults(use_xnnpack=False)
@@ -543,11 +609,92 @@ def mobile_benchmark():
         benchmark_binary_directory = '/data/tf_benchmark'
 
     adb = ADBConnect(serial_number)
+    if args.config_sweep:
+        import os
+        from benchmark.config_sweep import read_cpu_topology, generate_configs, sweep_configs, print_config_results
+        from benchmark.power import PowerSampler
+        from benchmark.thermal import ThermalGuard
+        clusters = read_cpu_topology(adb)
+        print(f'CPU clusters: {clusters}')
+        configs = generate_configs(clusters, max_threads=args.max_threads)
+        thermal_guard = None
+        if args.thermal_guard:
+            # the baseline is recorded before the first probe run, while the device is still idle
+            thermal_guard = ThermalGuard(adb, cool_temp=args.cool_temp, baseline_path=args.thermal_baseline, sample_during=args.thermal_sample_during)
+            thermal_guard.calibrate()
+        power_sampler = PowerSampler(adb) if args.measure_energy else None
+        model_paths = [os.path.join(model_path, x) for x in sorted(os.listdir(model_path)) if x.endswith('.tflite')] if os.path.isdir(model_path) else [model_path]
+        best_dict = {}
+        for path in model_paths:
+            results = sweep_configs(path, adb, configs, num_runs=num_runs, warmup_runs=warmup_runs, prune_ratio=args.prune_ratio,
+                                    thermal_guard=thermal_guard, power_sampler=power_sampler, use_gpu=use_gpu,
+                                    benchmark_binary_dir=benchmark_binary_directory, bin_name=bin_name, no_root=no_root)
+            print_config_results(path, results)
+            best_dict[path] = results[0]
+        print('===== Best configuration per model =====')
+        for path, best in best_dict.items():
+            energy = f', {best["mj_per_inference"]:.2f} mJ/inference' if best['mj_per_inference'] else ''
+            print(f'{os.path.basename(path)}: --taskset_mask={best["taskset_mask"]} --num_threads={best["num_threads"]} '
+                  f'{"--use_xnnpack " if best["use_xnnpack"] else ""}avg {best["avg_ms"]:.2f} ms{energy}')
+        return
+
+    thermal_guard = None
+    if args.thermal_guard:
+        from benchmark.thermal import ThermalGuard
+        from benchmark.run_on_host import parse_taskset_mask
+        thermal_guard = ThermalGuard(adb, cpus=parse_taskset_mask(mask), cool_temp=args.cool_temp, baseline_path=args.thermal_baseline, sample_during=args.thermal_sample_during)
+        thermal_guard.calibrate()
     std_ms, avg_ms, mem_mb = run_on_android(model_path, adb, num_threads=num_threads, num_runs=num_runs, warmup_runs=warmup_runs, 
                                             benchmark_binary_dir=benchmark_binary_directory, bin_name=bin_name, taskset_mask=mask, use_gpu=use_gpu, 
                                             skip_push=skip_push, no_root=no_root, use_xnnpack=use_xnnpack, 
-                                            profiling_output_csv_file=profiling_output_csv_file)
+                                            profiling_output_csv_file=profiling_output_csv_file, thermal_guard=thermal_guard)
     print(std_ms / avg_ms * 100, f'Avg latency {avg_ms} ms,', f'Std {std_ms} ms. Mem footprint(MB): {mem_mb}')
+    if thermal_guard:
+        record = thermal_guard.last_record
+        print(f'Cool-down {record["cooldown_s"]:.1f}s, attempts {record["attempts"]}, throttled {record["throttled"]}')
+        print(f'Thermal state before {record["trace"][-1]["pre"]}, after {record["trace"][-1]["post"]}')
+
+
+def host_benchmark():
+    import os
+    from benchmark.run_on_host import run_on_host, run_on_host_parallel
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('func', help='specify the work to do.')
+    parser.add_argument('--model', required=True, type=str, help='tflite model path or directory of tflite models')
+    parser.add_argument('--num_runs', type=int, default=10, help='number of runs')
+    parser.add_argument('--warmup_runs', type=int, default=10)
+    parser.add_argument('--num_threads', type=int, default=1, help='number of threads')
+    parser.add_argument('--no_xnnpack', action='store_true', help='disable the default xnnpack delegate')
+    parser.add_argument('--taskset_mask', type=str, default=None, help='mask of cpu affinity, e.g. 70')
+    parser.add_argument('--parallel_masks', type=str, default=None, help='comma separated core masks, run one model per mask in parallel, e.g. 1,2,4,8')
+    parser.add_argument('--profiling_output_csv_file', default=None, type=str, help='do op profiling with host benchmark_model and save output to this path, a directory for a model directory')
+    parser.add_argument('--benchmark_binary', default='benchmark_model', type=str, help='host benchmark_model binary used for op profiling')
+    args = parser.parse_args()
+
+    kwargs = dict(use_xnnpack=not args.no_xnnpack, num_threads=args.num_threads, num_runs=args.num_runs, warmup_runs=args.warmup_runs,
+                  benchmark_binary=args.benchmark_binary)
+    if os.path.isdir(args.model):
+        model_paths = [os.path.join(args.model, name) for name in sorted(os.listdir(args.model)) if name.endswith('.tflite')]
+    else:
+        model_paths = [args.model]
+
+    if args.parallel_masks:
+        results = run_on_host_parallel(model_paths, args.parallel_masks.split(','), profiling_output_dir=args.profiling_output_csv_file, **kwargs)
+    else:
+        results = {}
+        for model_path in model_paths:
+            profiling_output_csv_file = args.profiling_output_csv_file
+            if profiling_output_csv_file and len(model_paths) > 1:
+                os.makedirs(profiling_output_csv_file, exist_ok=True)
+                profiling_output_csv_file = os.path.join(profiling_output_csv_file, os.path.basename(model_path).replace('.tflite', '.csv'))
+            results[model_path] = run_on_host(model_path, taskset_mask=args.taskset_mask, profiling_output_csv_file=profiling_output_csv_file, **kwargs)
+
+    for model_path in model_paths:
+        if model_path in results:
+            std_ms, avg_ms, mem_mb = results[model_path]
+            print(model_path)
+            print(std_ms / avg_ms * 100, f'Avg latency {avg_ms} ms,', f'Std {std_ms} ms. Mem footprint(MB): {mem_mb}')
 
 
 def get_onnx_opset_version_cmd():
@@ -565,21 +712,34 @@ def get_onnx_opset_version_cmd():
 
 
 def onnx2tflite_cmd():
+    import os
     from utils import onnx2tflite
     parser = argparse.ArgumentParser()
     parser.add_argument('func', help='specify the work to do.')
-    parser.add_argument('--model', required=True, type=str, help='onnx model path')
-    parser.add_argument('--output', '-o', default=None, type=str, help='output tflite model path')
+    parser.add_argument('--model', required=True, type=str, help='onnx model path, or a directory of onnx models to convert in parallel')
+    parser.add_argument('--output', '-o', default=None, type=str, help='output tflite model path, or output directory when --model is a directory')
     parser.add_argument('--model_home', default=None, type=str, help='root dir of models')
     parser.add_argument('--save_tf', action='store_true', dest='save_tf', help='to save tf SavedModel')
+    parser.add_argument('--no_flex', action='store_false', dest='use_flex', help='convert with builtin ops only and verify no Flex op remains')
+    parser.add_argument('--num_workers', default=4, type=int, help='number of parallel conversion processes when --model is a directory')
+    parser.add_argument('--incremental', action='store_true', help='skip models whose input and settings are unchanged since the last conversion')
     parser.set_defaults(save_tf=False)
+    parser.set_defaults(use_flex=True)
     args = parser.parse_args()
 
+    if os.path.isdir(args.model):
+        from convert_farm import get_jobs, run_convert_farm
+        if args.output is None:
+            raise ValueError('--output directory must be specified when --model is a directory.')
+        jobs = get_jobs('onnx2tflite', args.model, args.output, dict(use_flex=args.use_flex))
+        run_convert_farm(jobs, args.output, args.num_workers, args.incremental)
+        return
+
     onnx_model_path = args.model
     output_path = args.output
     save_tf = args.save_tf
     model_home = args.model_home
-    onnx2tflite(onnx_model_path, output_path, save_tf, model_home=model_home)
+    onnx2tflite(onnx_model_path, output_path, save_tf, model_home=model_home, use_flex=args.use_flex)
 
 
 def save_vit():
@@ -832,6 +992,10 @@ def quantize_onnx():
     parser.add_argument('--model', required=True, type=str, help='float32 onnx model to quantize')
     parser.add_argument('--output_path', '--output', '-o', default=None, type=str)
     parser.add_argument('--dtype', '--data_type', choices=['uint8', 'int8'], default='uint8', type=str, help='quantization output data type')
+    parser.add_argument('--static', action='store_true', help='static quantization calibrated with --calib_data_path')
+    parser.add_argument('--calib_data_path', default=None, type=str, help='imagenet root to calibrate int8 quantization with real train images')
+    parser.add_argument('--calib_cache', default='models/calibration/imagenet_train_calib.npy', type=str, help='calibration data cache file')
+    parser.add_argument('--num_calib_samples', default=1000, type=int, help='number of stratified calibration images')
     args = parser.parse_args()
     input_path = args.model
     output_path = args.output_path
@@ -840,10 +1004,106 @@ def quantize_onnx():
         output_path = name + '_quant.onnx'
 
     dtype = QuantType.QInt8 if args.dtype == 'int8' else QuantType.QUInt8
-    quantize_dynamic(input_path, output_path, activation_type=dtype)
+    if args.static:
+        import onnx
+        from onnxruntime.quantization import quantize_static
+        from calibration import load_calibration_data
+        if args.calib_data_path is None:
+            raise ValueError('--calib_data_path must be specified for static quantization.')
+        calibration_data = load_calibration_data(args.calib_data_path, args.calib_cache, args.num_calib_samples)
+        input_name = onnx.load(input_path).graph.input[0].name
+        quantize_static(input_path, output_path, calibration_data.onnx_data_reader(input_name), activation_type=dtype)
+    else:
+        quantize_dynamic(input_path, output_path, activation_type=dtype)
     print(f'Successfully quantize model to {output_path}.')
 
 
+def build_quant_latency_table():
+    from quant_planner import build_latency_table
+    parser = argparse.ArgumentParser()
+    parser.add_argument('func', help='specify the work to do.')
+    parser.add_argument('--fp32_log', required=True, type=str, help='benchmark log of fp32 quant op test models')
+    parser.add_argument('--int8_log', required=True, type=str, help='benchmark log of int8 quant op test models')
+    parser.add_argument('--backend', required=True, choices=['tflite', 'onnx', 'openvino', 'tensorrt'], type=str)
+    parser.add_argument('--output', '-o', required=True, type=str, help='latency table csv, rows are appended if it exists')
+    args = parser.parse_args()
+
+    build_latency_table(args.fp32_log, args.int8_log, args.backend, args.output)
+
+
+def quant_plan():
+    import os
+    import quant_planner
+    parser = argparse.ArgumentParser()
+    parser.add_argument('func', help='specify the work to do.')
+    parser.add_argument('--model', required=True, type=str, help='fp32 onnx model or tf saved model')
+    parser.add_argument('--table', required=True, type=str, help='latency table csv built by build_quant_latency_table')
+    parser.add_argument('--output', '-o', default=None, type=str, help='selectively quantized model path')
+    parser.add_argument('--margin', default=0.05, type=float, help='quantize a node only if predicted int8 latency < (1 - margin) * fp32 latency')
+    parser.add_argument('--input_shape', type=str, default=None, help='input_shape to generate representative dataset for tflite')
+    parser.add_argument('--measure', action='store_true', help='measure fp32, all int8 and planned model latency on host')
+    parser.add_argument('--num_threads', default=1, type=int)
+    parser.add_argument('--mode', default='dynamic', choices=['dynamic', 'static'], help='onnx quantization mode')
+    parser.add_argument('--calib_data_path', default=None, type=str, help='imagenet root to calibrate int8 quantization with real train images')
+    parser.add_argument('--calib_cache', default='models/calibration/imagenet_train_calib.npy', type=str, help='calibration data cache file')
+    parser.add_argument('--num_calib_samples', default=1000, type=int, help='number of stratified calibration images')
+    args = parser.parse_args()
+    calibration_data = None
+    if args.calib_data_path:
+        from calibration import load_calibration_data
+        calibration_data = load_calibration_data(args.calib_data_path, args.calib_cache, args.num_calib_samples)
+
+    is_onnx = args.model.endswith('.onnx')
+    backend = 'onnx' if is_onnx else 'tflite'
+    table = quant_planner.load_latency_table(args.table, backend)
+    name = os.path.splitext(args.model.rstrip('/'))[0]
+
+    if is_onnx:
+        output_path = args.output or name + '_quant_planned.onnx'
+        plan = quant_planner.plan_quantization(quant_planner.get_onnx_quant_nodes(args.model), table, args.margin)
+        get_reader = None
+        if args.mode == 'static':
+            if calibration_data is None:
+                raise ValueError('--calib_data_path must be specified for static quantization.')
+            import onnx
+            input_name = onnx.load(args.model).graph.input[0].name
+            get_reader = lambda: calibration_data.onnx_data_reader(input_name)
+        quant_planner.quantize_onnx_with_plan(args.model, output_path, plan['exclude'], args.mode, get_reader() if get_reader else None)
+        if args.measure:
+            all_int8_path = name + '_quant_all.onnx'
+            quant_planner.quantize_onnx_with_plan(args.model, all_int8_path, [], args.mode, get_reader() if get_reader else None)
+            measure = quant_planner.measure_onnx_latency
+    else:
+        import tensorflow as tf
+        from utils import tf2tflite
+        if args.input_shape is None:
+            raise ValueError('--input_shape must be specified to quantize a tflite model.')
+        input_shape = [int(x) for x in args.input_shape.split(',')]
+        def representative_dataset():
+            for _ in range(100):
+                yield [tf.random.normal(input_shape)]
+        if calibration_data is not None:
+            representative_dataset = calibration_data.tflite_representative_dataset(input_shape)
+
+        fp32_path = name + '.tflite'
+        output_path = args.output or name + '_quant_planned.tflite'
+        tf2tflite(args.model, fp32_path, use_flex=False)
+        plan = quant_planner.plan_quantization(quant_planner.get_tflite_quant_nodes(fp32_path), table, args.margin)
+        quant_planner.quantize_tflite_with_plan(args.model, output_path, plan['exclude'], representative_dataset)
+        if args.measure:
+            all_int8_path = name + '_quant_all.tflite'
+            quant_planner.quantize_tflite_with_plan(args.model, all_int8_path, [], representative_dataset)
+            measure = quant_planner.measure_tflite_latency
+
+    measured = None
+    if args.measure:
+        fp32_path = args.model if is_onnx else fp32_path
+        measured = dict(fp32=measure(fp32_path, num_threads=args.num_threads),
+                        int8=measure(all_int8_path, num_threads=args.num_threads),
+                        planned=measure(output_path, num_threads=args.num_threads))
+    quant_planner.print_plan(plan, measured)
+
+
 def optimize_onnx_transformer():
     import os
     from onnxruntime.transformers import optimizer
@@ -883,6 +1143,29 @@ def evaluate_onnx_cmd():
     evaluate_onnx_pipeline(model_path, data_path, num_threads, batch_size, num_workers)
 
 
+def compact_onnx_cmd():
+    import os
+    import json
+    from onnx_compactor import compact_onnx
+    parser = argparse.ArgumentParser()
+    parser.add_argument('func', help='specify the work to do.')
+    parser.add_argument('--model', required=True, type=str, help='mask-pruned transformer onnx model, before onnxruntime fusion')
+    parser.add_argument('--output', '-o', default=None, type=str, help='compacted model path')
+    parser.add_argument('--no_verify', action='store_false', dest='verify', help='skip the ORT CPU output check')
+    parser.add_argument('--threads', default=1, type=int, help='num of threads of the ORT check')
+    parser.add_argument('--atol', default=1e-4, type=float, help='max abs output difference allowed by the check')
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.splitext(args.model)[0] + '_compact.onnx'
+    result = compact_onnx(args.model, output_path, args.verify, args.threads, args.atol)
+    report_path = os.path.splitext(output_path)[0] + '-compaction.json'
+    with open(report_path, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'Save compaction report to {report_path}.')
+    if result['max_diff'] is not None and result['max_diff'] > args.atol:
+        exit(1)
+
+
 def evaluate_tflite_cmd():
     from utils import evaluate_tflite_pipeline
     parser = argparse.ArgumentParser()
@@ -898,7 +1181,7 @@ def evaluate_tflite_cmd():
 
 
 def evaluate_deit_cmd():
-    from utils import evaluate_deit_pipeline
+    from utils import evaluate_deit_pipeline, cpu_bf16_available
     parser = argparse.ArgumentParser()
     parser.add_argument('func', help='specify the work to do.')
     parser.add_argument('--type', choices=['base', 'small', 'tiny'], help='deit model type')
@@ -907,16 +1190,51 @@ def evaluate_deit_cmd():
     parser.add_argument('--batch_size', default=50, type=int, help='batch size')
     parser.add_argument('--pretrained', action='store_true', dest='pretrained', help='specify to load offcial pretrained model')
     parser.add_argument('--model', default=None, type=str, help='state_dict_path')
+    parser.add_argument('--cpu_backend', default=None, choices=['eager', 'script', 'compile'], help='use the fast CPU path when no GPU is available')
+    parser.add_argument('--threads', default=None, type=int, help='num of threads of the CPU path')
+    parser.add_argument('--bf16', action='store_true', help='bf16 autocast on the CPU path')
     parser.set_defaults(pretrained=False)
     args = parser.parse_args()
 
     if args.pretrained is False and args.model is None:
         exit('Either load official pretrained model or specify state_dict_path')
+    if args.bf16 and not cpu_bf16_available():
+        exit('--bf16 needs torch.cpu.amp, which is only available from torch 1.10 on')
         
     evaluate_deit_pipeline(args.type, args.model, args.data_path, 
                            pretrained=args.pretrained, 
                            batch_size=args.batch_size,
-                           num_workers=args.num_workers)
+                           num_workers=args.num_workers,
+                           cpu_backend=args.cpu_backend,
+                           num_threads=args.threads,
+                           bf16=args.bf16)
+
+
+def compare_torch_cpu_cmd():
+    import json
+    from utils import compare_torch_cpu_pipeline, cpu_bf16_available
+    parser = argparse.ArgumentParser()
+    parser.add_argument('func', help='specify the work to do.')
+    parser.add_argument('--data_path', required=True, type=str, help='image net 1k dataset path')
+    parser.add_argument('--types', nargs='+', default=['tiny', 'small', 'base'], choices=['tiny', 'small', 'base'], help='deit model types')
+    parser.add_argument('--num_samples', default=None, type=int, help='evaluate on a subset of the val set')
+    parser.add_argument('--batch_size', '-b', default=50, type=int, help='batch size')
+    parser.add_argument('--num_workers', default=8, type=int, help='num of workers to load data')
+    parser.add_argument('--threads', default=None, type=int, help='num of threads to perform inference')
+    parser.add_argument('--backend', default='script', choices=['eager', 'script', 'compile'], help='CPU path model backend')
+    parser.add_argument('--bf16', action='store_true', help='bf16 autocast on the CPU path')
+    parser.add_argument('--no_channels_last', action='store_false', dest='channels_last', help='keep the NCHW input layout')
+    parser.add_argument('--output', '-o', default=None, type=str, help='json report path')
+    args = parser.parse_args()
+    if args.bf16 and not cpu_bf16_available():
+        exit('--bf16 needs torch.cpu.amp, which is only available from torch 1.10 on')
+
+    report = compare_torch_cpu_pipeline(args.data_path, args.types, args.num_samples, args.batch_size, args.num_workers,
+                                        args.threads, args.backend, args.bf16, args.channels_last)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Save report to {args.output}.')
 
 
 def export_tf_deit():
@@ -936,6 +1254,35 @@ def export_tf_deit():
     deit_tiny.save('models/tf_model/deit_tiny_patch16_224.tf')
 
 
+def export_tf_t2t_vit():
+    from modeling.models.t2t_vit import get_t2t_vit_7, get_t2t_vit_10, get_t2t_vit_12, get_t2t_vit_14
+    from modeling.layers.activation import get_gelu
+    import tensorflow as tf
+    parser = argparse.ArgumentParser()
+    parser.add_argument('func', help='specify the work to do.')
+    parser.add_argument('--version', '-v', type=int, choices=[7, 10, 12, 14], required=True, help='T2T-ViT version')
+    parser.add_argument('--output', '-o', default=None, type=str, help='output path')
+    parser.add_argument('--builtin_only', action='store_true', help='use modules that lower to TFLite builtin ops only')
+    parser.add_argument('--gelu', default='tanh_pow', choices=['tanh_pow', 'tanh', 'erf', 'hard', 'relu'], help='GELU implementation')
+    args = parser.parse_args()
+
+    get_model_dict = {
+        7: get_t2t_vit_7,
+        10: get_t2t_vit_10,
+        12: get_t2t_vit_12,
+        14: get_t2t_vit_14,
+    }
+    if args.output is None:
+        suffix = '_builtin' if args.builtin_only else ''
+        suffix += '' if args.gelu == 'tanh_pow' else f'_gelu_{args.gelu}'
+        args.output = f'models/tf_model/t2t_vit_{args.version}{suffix}.tf'
+
+    input = tf.keras.Input(shape=[224, 224, 3], batch_size=1)
+    output = get_model_dict[args.version](builtin_only=args.builtin_only, activation=get_gelu(args.gelu))(input)
+    tf.keras.Model(input, output).save(args.output)
+    print(f'Successfully save model to {args.output}.')
+
+
 def prune_deit_cmd():
     from utils import get_torch_deit, prune_deit_ffn_h, load_torch_deit_state_dict
     parser = argparse.ArgumentParser()
@@ -1066,6 +1413,8 @@ def main():
         quantize_onnx()
     elif func == 'eval_onnx':
         evaluate_onnx_cmd()
+    elif func == 'compact_onnx':
+        compact_onnx_cmd()
     elif func in ['opt_onnx_transformer', 'opt_onnx', 'optimize_onnx']:
         optimize_onnx_transformer()
     elif func == 'export_tf_deit':
@@ -1074,6 +1423,8 @@ def main():
         evaluate_tflite_cmd()
     elif func == 'eval_deit':
         evaluate_deit_cmd()
+    elif func == 'compare_torch_cpu':
+        compare_torch_cpu_cmd()
     elif func == 'eval_tf':
         eval_tf()
     elif func == 'prune_deit':
@@ -1084,6 +1435,18 @@ def main():
         tf2tflite_dir_cmd()
     elif func == 'trt_benchmark':
         trt_benchmark_cmd()
+    elif func == 'build_quant_latency_table':
+        build_quant_latency_table()
+    elif func == 'quant_plan':
+        quant_plan()
+    elif func == 'tflite_ops':
+        tflite_ops_cmd()
+    elif func == 'export_tf_t2t_vit':
+        export_tf_t2t_vit()
+    elif func == 'op_sweep':
+        op_sweep_cmd()
+    elif func == 'host_benchmark':
+        host_benchmark()
 
 
 if __name__ == '__main__':
@@ -206,7 +206,7 @@ def get_onnx_opset_version(onnx_model_path):
     return model.opset_import
 
 
-def onnx2tflite(onnx_model_path, output_path, save_tf=False, model_home=None):
+def onnx2tflite(onnx_model_path, output_path, save_tf=False, model_home=None, use_flex=True):
     import os
     
     if model_home is None:
@@ -229,7 +229,8 @@ def onnx2tflite(onnx_model_path, output_path, save_tf=False, model_home=None):
     
     import sys
     dir = os.path.dirname(sys.argv[0])
-    r = os.system(f'python {os.path.join(dir, "tools.py")} tf2tflite --input {tf_model_path} --output {tflite_model_path}')
+    no_flex = '' if use_flex else ' --no_flex'
+    r = os.system(f'python {os.path.join(dir, "tools.py")} tf2tflite --input {tf_model_path} --output {tflite_model_path}{no_flex}')
     if r:
         if not save_tf:
             os.system(f'rm -r {tf_model_path}')
@@ -239,7 +240,7 @@ def onnx2tflite(onnx_model_path, output_path, save_tf=False, model_home=None):
     print('Convert successfully.')
 
 
-def tf2tflite(saved_model_path: str, output_path: str, is_keras=False, quantization='None', use_flex=True, input_shape=None):
+def tf2tflite(saved_model_path: str, output_path: str, is_keras=False, quantization='None', use_flex=True, input_shape=None, calibration_data=None):
     import tensorflow as tf
     import os
 
@@ -267,6 +268,9 @@ def tf2tflite(saved_model_path: str, output_path: str, is_keras=False, quantizat
             #      yield [input_value]
             for _ in range (100):
                 yield [tf.random.normal(input_shape)]
+        if calibration_data is not None:
+            print(f'Calibrate with {len(calibration_data)} real images.')
+            representative_data_gen = calibration_data.tflite_representative_dataset(input_shape)
         converter.optimizations = [tf.lite.Optimize.DEFAULT]
         converter.representative_dataset = representative_data_gen
         # Ensure that if any ops can't be quantized, the converter throws an error
@@ -293,8 +297,32 @@ def tf2tflite(saved_model_path: str, output_path: str, is_keras=False, quantizat
         f.write(tflite_model)
     print(f'Successfully convert model to {output_path}.')
 
+    if not use_flex:
+        flex_ops = get_tflite_flex_ops(output_path)
+        if flex_ops:
+            raise ValueError(f'{output_path} is expected to be builtin-only but contains Flex ops: {flex_ops}')
+        print('Verified: no Flex op in converted model.')
+
+
+def get_tflite_op_counts(model_path):
+    import tensorflow as tf
+    from collections import Counter
+    interpreter = tf.lite.Interpreter(model_path=model_path)
+    return Counter(op['op_name'] for op in interpreter._get_ops_details())
+
+
+def get_tflite_flex_ops(model_path):
+    return sorted(op for op in get_tflite_op_counts(model_path) if op.startswith('Flex'))
+
+
+def tf2tflite_dir(saved_model_dir, output_dir, quantization, skip_existed=False, input_shape=None, calibration_data=None, num_workers=1, incremental=False):
+    if num_workers > 1 or incremental:
+        from convert_farm import get_jobs, run_convert_farm
+        settings = dict(quantization=quantization, use_flex=True, input_shape=input_shape,
+                        calib_cache=calibration_data.cache_path if calibration_data is not None else None)
+        run_convert_farm(get_jobs('tf2tflite', saved_model_dir, output_dir, settings), output_dir, num_workers, incremental)
+        return
 
-def tf2tflite_dir(saved_model_dir, output_dir, quantization, skip_existed=False, input_shape=None):
     quant_suffix_dict = dict(
         dynamic = '_quant_dynamic',
         float16 = '_quant_float16',
@@ -316,7 +344,7 @@ def tf2tflite_dir(saved_model_dir, output_dir, quantization, skip_existed=False,
                 model = tf.keras.models.load_model(src_path)
                 input_shape = model.input_shape
                 print(f'input_shape: {input_shape}')
-            tf2tflite(src_path, dst_path, quantization=quantization, input_shape=input_shape)
+            tf2tflite(src_path, dst_path, quantization=quantization, input_shape=input_shape, calibration_data=calibration_data)
 
 
 def get_attention(h=768, a=12, h_k=None, is_tf=True, n=128):
@@ -490,6 +518,32 @@ def get_onnx_model_inputs(model, dtype=None, input_shape=None):
     return inputs
 
 
+ONNX_SESSION_DTYPES = {'tensor(float)': 'float32', 'tensor(float16)': 'float16', 'tensor(double)': 'float64',
+                       'tensor(int64)': 'int64', 'tensor(int32)': 'int32', 'tensor(int8)': 'int8', 'tensor(uint8)': 'uint8'}
+
+
+def get_onnx_session_inputs(session, input_shape=None):
+    '''
+    random feeds of the dtype and shape the ORT session expects, symbolic dims are 1 unless input_shape is given.
+    '''
+    import numpy as np
+    inputs = {}
+    for input in session.get_inputs():
+        shape = input_shape or [d if isinstance(d, int) else 1 for d in input.shape]
+        dtype = ONNX_SESSION_DTYPES.get(input.type)
+        if dtype is None:
+            raise ValueError(f'Unsupported onnx input type {input.type} of {input.name}.')
+        if dtype.startswith('float'):
+            inputs[input.name] = np.random.randn(*shape).astype(dtype)
+        elif 'mask' in input.name:
+            inputs[input.name] = np.ones(shape=shape, dtype=dtype)
+        elif 'type' in input.name:
+            inputs[input.name] = np.zeros(shape=shape, dtype=dtype)
+        else:
+            inputs[input.name] = np.random.randint(low=0, high=min(10000, np.iinfo(dtype).max), size=shape, dtype=dtype)
+    return inputs
+
+
 
 def freeze_graph(keras_model_path=None, keras_model=None, output_path='./tmp.pb'):
     import tensorflow as tf
@@ -590,22 +644,23 @@ def save_to_pb(outputs, output_path):
     evaluate model
 ========================================================================================================='''
 
-def build_eval_dataset(data_path, input_size=224, is_train=False):
-    def build_eval_transform(input_size):
-        from torchvision import transforms
-        from timm.data.constants import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD
-        t = []
-        if input_size > 32:
-            size = int((256 / 224) * input_size)
-            t.append(
-                transforms.Resize(size, interpolation=3),  # to maintain same ratio w.r.t. 224 images
-            )
-            t.append(transforms.CenterCrop(input_size))
-
-        t.append(transforms.ToTensor())
-        t.append(transforms.Normalize(IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD))
-        return transforms.Compose(t)
+def build_eval_transform(input_size):
+    from torchvision import transforms
+    from timm.data.constants import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD
+    t = []
+    if input_size > 32:
+        size = int((256 / 224) * input_size)
+        t.append(
+            transforms.Resize(size, interpolation=3),  # to maintain same ratio w.r.t. 224 images
+        )
+        t.append(transforms.CenterCrop(input_size))
+
+    t.append(transforms.ToTensor())
+    t.append(transforms.Normalize(IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD))
+    return transforms.Compose(t)
+
 
+def build_eval_dataset(data_path, input_size=224, is_train=False):
     import os
     from torchvision import datasets
     transform = build_eval_transform(input_size)
@@ -628,18 +683,88 @@ def to_data_loader(dataset, batch_size, num_workers):
     return data_loader
 
 
-def evaluate_onnx(model_path, data_loader, threads):
+ORT_CACHE_DIR = os.environ.get('ORT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'ort_sessions'))
+ORT_OPT_LEVELS = dict(disable='ORT_DISABLE_ALL', basic='ORT_ENABLE_BASIC', extended='ORT_ENABLE_EXTENDED', all='ORT_ENABLE_ALL')
+
+
+def _hash_file(path, chunk_size=1 << 24):
+    import hashlib
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def create_onnx_session(model_path, num_threads=1, providers=None, opt_level='all', cache_dir=ORT_CACHE_DIR):
+    '''
+    create an InferenceSession whose optimized graph is cached in cache_dir, keyed by the model content,
+    the ort version, the providers and the optimization level. A cached graph is loaded with optimizations
+    disabled. cache_dir=None always optimizes. Returns (session, dict(create_ms, cache_hit, model_path)).
+    '''
+    import timeit
+    import hashlib
+    import onnxruntime as ort
+
+    providers = providers or ['CPUExecutionProvider']
+    session_options = ort.SessionOptions()
+    session_options.intra_op_num_threads = num_threads
+    session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    session_options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, ORT_OPT_LEVELS[opt_level])
+
+    cache_path = None
+    if cache_dir and opt_level != 'disable':
+        key = f'{_hash_file(model_path)}_{ort.__version__}_{"-".join(providers)}_{opt_level}'
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        cache_path = os.path.join(cache_dir, f'{name}_{hashlib.sha1(key.encode()).hexdigest()[:16]}.onnx')
+
+    start_time = timeit.default_timer()
+    cache_hit = cache_path is not None and os.path.exists(cache_path)
+    if cache_hit:
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        session = ort.InferenceSession(cache_path, providers=providers, sess_options=session_options)
+    elif cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # parallel sweeps may optimize the same model, the rename makes the cache entry appear atomically
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        session_options.optimized_model_filepath = tmp_path
+        session = ort.InferenceSession(model_path, providers=providers, sess_options=session_options)
+        os.replace(tmp_path, cache_path)
+    else:
+        session = ort.InferenceSession(model_path, providers=providers, sess_options=session_options)
+    create_ms = (timeit.default_timer() - start_time) * 1000
+    return session, dict(create_ms=create_ms, cache_hit=cache_hit, model_path=cache_path if cache_hit else model_path)
+
+
+def create_io_binding(session, inputs, use_gpu=False):
+    '''
+    bind every session input to an OrtValue of the given numpy arrays, and every output to an OrtValue
+    preallocated from one plain run, so run_with_iobinding reuses the same buffers on every call.
+    Returns (io_binding, input_values, output_values), the name -> OrtValue dicts must outlive the binding.
+    '''
+    import numpy as np
     import onnxruntime as ort
+
+    device = 'cuda' if use_gpu else 'cpu'
+    io_binding = session.io_binding()
+    input_values = {x.name: ort.OrtValue.ortvalue_from_numpy(inputs[x.name], device, 0) for x in session.get_inputs()}
+    for name, value in input_values.items():
+        io_binding.bind_ortvalue_input(name, value)
+    output_names = [x.name for x in session.get_outputs()]
+    outputs = session.run(output_names, inputs)
+    output_values = {name: ort.OrtValue.ortvalue_from_numpy(np.empty_like(output), device, 0) for name, output in zip(output_names, outputs)}
+    for name, value in output_values.items():
+        io_binding.bind_ortvalue_output(name, value)
+    return io_binding, input_values, output_values
+
+
+def evaluate_onnx(model_path, data_loader, threads):
     import numpy as np
 
 
     # execution_providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-    execution_providers = ['CPUExecutionProvider']
-    session_options = ort.SessionOptions()
-    session_options.intra_op_num_threads = threads
-    session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
-    session = ort.InferenceSession(model_path, providers=execution_providers, sess_options=session_options)
+    session, session_info = create_onnx_session(model_path, num_threads=threads)
+    print(f'Session created in {session_info["create_ms"]:.1f} ms (optimized graph cache {"hit" if session_info["cache_hit"] else "miss"}).')
 
     input_name = session.get_inputs()[0].name
 
@@ -782,9 +907,11 @@ def load_torch_deit_state_dict(model, state_dict_path):
     print (f'Load deit state_dict from {state_dict_path}.')
 
 
-def evaluate_torch(model, data_loader, device):
+def evaluate_torch(model, data_loader, device, return_throughput=False):
     from datetime import datetime
+    import timeit
     import torch
+    forward_time = 0
     with torch.no_grad():
         # switch to evaluation mode
         model.eval()
@@ -792,6 +919,7 @@ def evaluate_torch(model, data_loader, device):
         total = 0
         correct = 0
         for images, target in data_loader:
+            start_time = timeit.default_timer()
             images = images.to(device, non_blocking=True)
             target = target.to(device, non_blocking=True)
 
@@ -803,6 +931,9 @@ def evaluate_torch(model, data_loader, device):
             pred = torch.argmax(logits, axis=1).reshape(-1)
             target = target.reshape(-1)
 
+            if torch.device(device).type == 'cuda':
+                torch.cuda.synchronize()
+            forward_time += timeit.default_timer() - start_time
             correct_tmp = int(torch.sum(pred == target).cpu().numpy())
             correct += correct_tmp
             total += batch_size
@@ -810,10 +941,137 @@ def evaluate_torch(model, data_loader, device):
             s = f'[{datetime.now().strftime("D%m%d %H:%M:%S")} {total: 5d} / 50000]  Cur Accuracy: {correct_tmp / batch_size * 100: .2f}% Total Accuracy: {correct / total * 100: .2f}%'
             print(s)
     print(f'Summary model accuracy is {correct / total * 100: .2f}%')
+    if return_throughput:
+        return correct / total, total / forward_time
     return correct / total
 
 
-def evaluate_deit_pipeline(type, state_dict_path, data_path, pretrained=False, batch_size=50, num_workers=8):
+TORCH_CPU_BACKENDS = ['eager', 'script', 'compile']
+
+
+def cpu_bf16_available():
+    # torch.cpu.amp only exists from torch 1.10 on, not in the pinned torch 1.9
+    import torch
+    return hasattr(torch, 'cpu') and hasattr(torch.cpu, 'amp')
+
+
+def _cpu_autocast(bf16):
+    import contextlib
+    import torch
+    if not bf16:
+        return contextlib.nullcontext()
+    if not cpu_bf16_available():
+        raise RuntimeError(f'bf16 needs torch.cpu.amp (torch >= 1.10), not available in torch {torch.__version__}.')
+    return torch.cpu.amp.autocast(dtype=torch.bfloat16)
+
+
+def prepare_torch_cpu_model(model, example_images, backend='script', bf16=False, channels_last=True):
+    '''
+    eval mode model for CPU inference. script: torch.jit.trace + freeze (traced under the bf16 autocast so the
+    casts are part of the graph), compile: torch.compile where available, falls back to script.
+    '''
+    import torch
+    model = model.eval()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+        example_images = example_images.contiguous(memory_format=torch.channels_last)
+    if backend == 'compile' and not hasattr(torch, 'compile'):
+        print(f'torch.compile is not available in torch {torch.__version__}, use script instead.')
+        backend = 'script'
+
+    if backend == 'compile':
+        model = torch.compile(model)
+    elif backend == 'script':
+        with torch.no_grad(), _cpu_autocast(bf16):
+            model = torch.jit.freeze(torch.jit.trace(model, example_images, check_trace=False))
+    elif backend != 'eager':
+        raise ValueError(f'Unknown backend {backend}, should be in {TORCH_CPU_BACKENDS}')
+
+    # the first runs of a traced / compiled model optimize the graph
+    with torch.inference_mode(), _cpu_autocast(bf16):
+        for _ in range(3):
+            model(example_images)
+    return model
+
+
+def evaluate_torch_cpu(model, data_loader, num_threads=None, backend='script', bf16=False, channels_last=True):
+    '''
+    CPU counterpart of evaluate_torch: inference_mode, explicit thread count, channels last input,
+    traced + frozen (or compiled) model and optional bf16 autocast. The model stays on CPU, so there is no per
+    batch device copy. Returns dict(accuracy, images_per_sec), images_per_sec only counts the forward passes.
+    '''
+    import timeit
+    import torch
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    print(f'Evaluate on CPU with {torch.get_num_threads()} threads, backend {backend}, bf16 {bf16}, channels_last {channels_last}.')
+
+    images, _ = next(iter(data_loader))
+    model = prepare_torch_cpu_model(model, images, backend, bf16, channels_last)
+
+    total = 0
+    correct = 0
+    forward_time = 0
+    with torch.inference_mode(), _cpu_autocast(bf16):
+        for images, target in data_loader:
+            if channels_last:
+                images = images.contiguous(memory_format=torch.channels_last)
+            start_time = timeit.default_timer()
+            logits = model(images)
+            forward_time += timeit.default_timer() - start_time
+
+            pred = torch.argmax(logits.reshape(images.shape[0], -1), axis=1)
+            correct += int(torch.sum(pred == target.reshape(-1)))
+            total += images.shape[0]
+            if total % 1000 < images.shape[0]:
+                print(f'{total: 5d} / {len(data_loader.dataset)}  Accuracy: {correct / total * 100: .2f}%  {total / forward_time: .1f} images/sec')
+
+    result = dict(accuracy=correct / total, images_per_sec=total / forward_time)
+    print(f'Summary model accuracy is {result["accuracy"] * 100: .2f}%, {result["images_per_sec"]: .1f} images/sec')
+    return result
+
+
+def compare_torch_cpu_pipeline(data_path, types=('tiny', 'small', 'base'), num_samples=None, batch_size=50, num_workers=8,
+                               num_threads=None, backend='script', bf16=False, channels_last=True):
+    '''
+    images/sec and top-1 of evaluate_torch (the reference path) vs evaluate_torch_cpu for the official DeiT models,
+    on the first num_samples images of ImageNet val (all of them by default).
+    '''
+    import torch
+    if bf16 and not cpu_bf16_available():
+        raise RuntimeError(f'bf16 needs torch.cpu.amp (torch >= 1.10), not available in torch {torch.__version__}.')
+    dataset, _ = build_eval_dataset(data_path)
+    if num_samples:
+        # evenly spaced, the val set is sorted by class
+        dataset = torch.utils.data.Subset(dataset, list(range(0, len(dataset), max(len(dataset) // num_samples, 1)))[:num_samples])
+    data_loader = to_data_loader(dataset, batch_size, num_workers)
+    device = torch.device('cpu')
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    report = []
+    for type in types:
+        reference_accuracy, reference_throughput = evaluate_torch(get_torch_deit(type), data_loader, device, return_throughput=True)
+        result = evaluate_torch_cpu(get_torch_deit(type), data_loader, num_threads, backend, bf16, channels_last)
+        report.append(dict(
+            type=type,
+            reference_top1=reference_accuracy * 100,
+            reference_images_per_sec=reference_throughput,
+            top1=result['accuracy'] * 100,
+            images_per_sec=result['images_per_sec'],
+            top1_delta=(result['accuracy'] - reference_accuracy) * 100,
+            speedup=result['images_per_sec'] / reference_throughput,
+        ))
+
+    print(f'{"type":<6}{"ref img/s":>11}{"img/s":>9}{"speedup":>9}{"ref top1":>10}{"top1":>8}{"delta":>8}')
+    for r in report:
+        print(f'{r["type"]:<6}{r["reference_images_per_sec"]:>11.1f}{r["images_per_sec"]:>9.1f}{r["speedup"]:>9.2f}'
+              f'{r["reference_top1"]:>10.2f}{r["top1"]:>8.2f}{r["top1_delta"]:>+8.2f}')
+    return report
+
+
+def evaluate_deit_pipeline(type, state_dict_path, data_path, pretrained=False, batch_size=50, num_workers=8, cpu_backend=None,
+                           num_threads=None, bf16=False):
     import torch
     dataset, _ = build_eval_dataset(data_path)
     data_loader = to_data_loader(dataset, batch_size, num_workers)
@@ -823,6 +1081,8 @@ def evaluate_deit_pipeline(type, state_dict_path, data_path, pretrained=False, b
         load_torch_deit_state_dict(model, state_dict_path)
 
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if device.type == 'cpu' and cpu_backend:
+        return evaluate_torch_cpu(model, data_loader, num_threads, cpu_backend, bf16)['accuracy']
     model = model.to(device)
 
     return evaluate_torch(model, data_loader, device)